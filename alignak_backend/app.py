@@ -20,13 +20,13 @@ import time
 import traceback
 import uuid
 from collections import OrderedDict
-from datetime import datetime, timedelta
+from datetime import datetime
 from future.utils import iteritems
 
+from bson.objectid import ObjectId
 from eve import Eve
 from eve.auth import TokenAuth
 from eve.io.mongo import Validator
-from eve.methods.delete import deleteitem_internal
 from eve.methods.patch import patch_internal
 from eve.methods.post import post_internal
 from eve.utils import debug_error_message
@@ -35,15 +35,30 @@ from flask import current_app, g, request, abort, jsonify, make_response, send_f
     redirect
 from flask_apscheduler import APScheduler
 from flask_bootstrap import Bootstrap
-from werkzeug.security import check_password_hash, generate_password_hash
 
 import alignak_backend.log
 from alignak_backend import manifest
+from alignak_backend.authcache import AuthCache
+from alignak_backend.circuitbreaker import CircuitBreaker
 from alignak_backend.grafana import Grafana
+from alignak_backend.jobqueue import JobQueue
+from alignak_backend.lease import Lease
+from alignak_backend.livestate import Livestate
 from alignak_backend.livesynthesis import Livesynthesis
+from alignak_backend.livesynthesisretention import LivesynthesisRetention
 from alignak_backend.models import register_models
+from alignak_backend.overallstate import OverallState
+from alignak_backend.passwordhash import PasswordHash
+from alignak_backend.realmpath import RealmPath
+from alignak_backend.realmtree import RealmTree
+from alignak_backend.rightscheck import RightsCheck
+from alignak_backend.signedtoken import SignedToken
 from alignak_backend.template import Template
 from alignak_backend.timeseries import Timeseries
+from alignak_backend.timeseriesbatch import TimeseriesBatch
+from alignak_backend.timeseriesclients import TimeseriesClients
+from alignak_backend.timeseriesstats import TimeseriesStats
+from alignak_backend.userrights import UserRights
 
 _subcommands = OrderedDict()
 
@@ -61,14 +76,15 @@ class MyTokenAuth(TokenAuth):
     """
     Class to manage authentication
     """
-    children_realms = {}
-    parent_realms = {}
 
-    """Authentication token class"""
     def check_auth(self, token, allowed_roles, resource, method):
         """
         Check if account exist and get roles for this user
 
+        The rights of the user are computed when its userrestrictrole change (see UserRights)
+        and they are cached for the token (see AuthCache), so when the cache is hit, no
+        database request is made.
+
         :param token: token for auth
         :type username: str
         :param allowed_roles:
@@ -80,104 +96,52 @@ class MyTokenAuth(TokenAuth):
         :return: True if user exist and password is ok or if no roles defined, otherwise False
         :rtype: bool
         """
-        user = current_app.data.driver.db['user'].find_one({'token': token})
-        if user:
-            # We get all resources we have in the backend for the userrestrictrole with *
-            resource_list = list(current_app.config['DOMAIN'])
+        rights = AuthCache.get(token)
+        payload = SignedToken.verify(token)
+        if payload is not None:
+            # Signed token, the database is requested only if the rights are not yet cached
+            # or if they are older than the token. The user is always read when the cache
+            # misses, so a deleted or demoted user loses its rights without waiting for the
+            # token expiry
+            if rights is None or rights['version'] < payload['v']:
+                user = current_app.data.driver.db['user'].find_one(
+                    {'_id': ObjectId(payload['u'])})
+                if not user:
+                    return False
+                rights = self.get_rights(user)
+                AuthCache.set(token, rights)
+        elif rights is None:
+            user = current_app.data.driver.db['user'].find_one({'token': token})
+            if not user:
+                return False
+            rights = self.get_rights(user)
+            AuthCache.set(token, rights)
 
-            g.updateRealm = False
-            g.updateGroup = False
-            # get children of realms for rights
-            realmsdrv = current_app.data.driver.db['realm']
-            allrealms = realmsdrv.find()
-            self.children_realms = {}
-            self.parent_realms = {}
-            for realm in allrealms:
-                self.children_realms[realm['_id']] = realm['_all_children']
-                self.parent_realms[realm['_id']] = realm['_tree_parents']
-
-            g.back_role_super_admin = user['back_role_super_admin']
-            userrestrictroles = current_app.data.driver.db['userrestrictrole']
-            userrestrictrole = userrestrictroles.find({'user': user['_id']})
-            g.resources_get = {}
-            g.resources_get_parents = {}
-            get_parents = {}
-            g.resources_get_custom = {}
-            g.resources_post = {}
-            g.resources_post_parents = {}
-            g.resources_patch = {}
-            g.resources_patch_parents = {}
-            g.resources_patch_custom = {}
-            g.resources_delete = {}
-            g.resources_delete_parents = {}
-            g.resources_delete_custom = {}
-            for rights in userrestrictrole:
-                self.add_resources_realms('read', rights, False, g.resources_get, resource_list,
-                                          get_parents)
-                self.add_resources_realms('read', rights, True, g.resources_get_custom,
-                                          resource_list)
-                self.add_resources_realms('create', rights, False, g.resources_post, resource_list)
-                self.add_resources_realms('update', rights, False, g.resources_patch,
-                                          resource_list)
-                self.add_resources_realms('update', rights, True, g.resources_patch_custom,
-                                          resource_list)
-                self.add_resources_realms('delete', rights, False, g.resources_delete,
-                                          resource_list)
-                self.add_resources_realms('delete', rights, True, g.resources_delete_custom,
-                                          resource_list)
-            for resource in g.resources_get:
-                g.resources_get[resource] = list(set(g.resources_get[resource]))
-                if resource in g.resources_get_custom:
-                    g.resources_get_custom[resource] = list(set(g.resources_get_custom[resource]))
-                g.resources_get_parents[resource] = [item for item in get_parents[resource]
-                                                     if item not in g.resources_get[resource]]
-            for resource in g.resources_post:
-                g.resources_post[resource] = list(set(g.resources_post[resource]))
-            for resource in g.resources_patch:
-                g.resources_patch[resource] = list(set(g.resources_patch[resource]))
-            for resource in g.resources_delete:
-                g.resources_delete[resource] = list(set(g.resources_delete[resource]))
-            g.users_id = user['_id']
-            self.set_request_auth_value(user['_id'])
-        return user
-
-    def add_resources_realms(self, right, data, custom, resource, resource_list, parents=None):
+        g.updateRealm = False
+        g.updateGroup = False
+        g.back_role_super_admin = rights['back_role_super_admin']
+        # Copy the cached rights because the hooks may update them during the request
+        for name in AuthCache.resources:
+            setattr(g, name, dict((res, list(realms))
+                                  for res, realms in iteritems(rights.get(name, {}))))
+        g.users_id = rights['user']
+        self.set_request_auth_value(rights['user'])
+        return True
+
+    @staticmethod
+    def get_rights(user):
         """
-        Add realms found for rights. it's used to fill rights when connect to app
-
-        :param right: right in list: create, read, update, delete
-        :type right: str
-        :param data: data (one record) from userrestrictrole (from mongo)
-        :type data: dict
-        :param custom: True if it's a custom right, otherwise False
-        :type custom: bool
-        :param resource: variable where store realm rights
-        :type resource: dict
-        :param resource_list: list of all resources of the backend
-        :type resource_list: dict
-        :param parents: variable where store parents realms (required only for read right)
-        :type parents: dict or None
-        :return: None
+        Get the rights of a user, as they are stored in the authentication cache
+
+        :param user: the user (from mongo)
+        :type user: dict
+        :return: rights of the user
+        :rtype: dict
         """
-        # pylint: disable=too-many-arguments
-        search_field = right
-        if custom:
-            search_field = 'custom'
-        if data['resource'] == '*':
-            my_resources = resource_list
-        else:
-            my_resources = [data['resource']]
-        if search_field in data['crud']:
-            for my_resource in my_resources:
-                if my_resource not in resource:
-                    resource[my_resource] = []
-                if right == 'read' and not custom and my_resource not in parents:
-                    parents[my_resource] = []
-                resource[my_resource].append(data['realm'])
-                if right == 'read' and not custom:
-                    parents[my_resource].extend(self.parent_realms[data['realm']])
-                if data['sub_realm']:
-                    resource[my_resource].extend(self.children_realms[data['realm']])
+        rights = dict(UserRights.get_user_rights(user))
+        rights['user'] = user['_id']
+        rights['back_role_super_admin'] = user['back_role_super_admin']
+        return rights
 
 
 class MyValidator(Validator):
@@ -205,29 +169,12 @@ def pre_get(resource, user_request, lookup):
         return
     # Only in case not super-admin
     if resource not in ['user']:
-        # get all resources we can have rights in read
-        resources_get = g.get('resources_get', {})
-        resources_get_parents = g.get('resources_get_parents', {})
-        resources_get_custom = g.get('resources_get_custom', {})
-        users_id = g.get('users_id', {})
-
-        if resource not in resources_get and resource not in resources_get_custom:
+        # get the conditions on the items we can read
+        rights_lookup = RightsCheck.get_lookup(resource)
+        if rights_lookup is None:
             lookup["_id"] = ''
         else:
-            if resource not in resources_get:
-                resources_get[resource] = []
-            if resource not in resources_get_parents:
-                resources_get_parents[resource] = []
-            if resource not in resources_get_custom:
-                resources_get_custom[resource] = []
-            if resource in ['realm']:
-                lookup['$or'] = [{'_id': {'$in': resources_get[resource]}}]
-            else:
-                lookup['$or'] = [{'_realm': {'$in': resources_get[resource]}},
-                                 {'$and': [{'_sub_realm': True},
-                                           {'_realm': {'$in': resources_get_parents[resource]}}]},
-                                 {'$and': [{'_users_read': users_id},
-                                           {'_realm': {'$in': resources_get_custom[resource]}}]}]
+            lookup['$or'] = rights_lookup
 
 
 # History
@@ -237,22 +184,47 @@ def pre_history_post(items):
 
     If host _id is not provided, search for an host with host_name. Same for service and user.
 
+    The hosts, services and users of all the items are searched with one request for each
+    resource.
+
     :param items: history fields
     :type items: dict
     :return: None
     """
+    # pylint: disable=too-many-locals
     hosts_drv = current_app.data.driver.db['host']
     services_drv = current_app.data.driver.db['service']
     users_drv = current_app.data.driver.db['user']
+
+    # Search all the hosts
+    hosts_id = {}
+    hosts_name = {}
+    search = {'host': [], 'host_name': []}
+    for dummy, item in enumerate(items):
+        if 'host' in item and item['host']:
+            search['host'].append(item['host'])
+        elif 'host_name' in item and item['host_name']:
+            search['host_name'].append(item['host_name'])
+    if search['host'] or search['host_name']:
+        hosts = hosts_drv.find({'$or': [{'_id': {'$in': search['host']}},
+                                        {'name': {'$in': search['host_name']}}]},
+                               {'name': 1, '_realm': 1})
+        for host in hosts:
+            hosts_id[host['_id']] = host
+            hosts_name.setdefault(host['name'], host)
+
+    # Set the host of the items and search all the services and users
+    known_items = []
+    search = {'service': [], 'service_host': [], 'service_name': [], 'user': [], 'user_name': []}
     for dummy, item in enumerate(items):
         if 'host' in item and item['host']:
-            host = hosts_drv.find_one({'_id': item['host']})
+            host = hosts_id.get(item['host'])
             if host:
                 item['host_name'] = host['name']
             else:
                 continue
         elif 'host_name' in item and item['host_name']:
-            host = hosts_drv.find_one({'name': item['host_name']})
+            host = hosts_name.get(item['host_name'])
             if host:
                 item['host'] = host['_id']
             else:
@@ -260,27 +232,60 @@ def pre_history_post(items):
         else:
             continue
 
-        host = hosts_drv.find_one({'_id': item['host']})
         # Set _realm as host's _realm
         item['_realm'] = host['_realm']
+        known_items.append(item)
+
+        if 'service' in item and item['service']:
+            search['service'].append(item['service'])
+        elif 'service_name' in item and item['service_name']:
+            search['service_host'].append(item['host'])
+            search['service_name'].append(item['service_name'])
 
+        if 'user' in item and item['user']:
+            search['user'].append(item['user'])
+        elif 'user_name' in item and item['user_name']:
+            search['user_name'].append(item['user_name'])
+
+    services_id = {}
+    services_name = {}
+    if search['service'] or search['service_name']:
+        services = services_drv.find({'$or': [{'_id': {'$in': search['service']}},
+                                              {'host': {'$in': search['service_host']},
+                                               'name': {'$in': search['service_name']}}]},
+                                     {'name': 1, 'host': 1})
+        for service in services:
+            services_id[service['_id']] = service
+            services_name.setdefault((service['host'], service['name']), service)
+
+    users_id = {}
+    users_name = {}
+    if search['user'] or search['user_name']:
+        users = users_drv.find({'$or': [{'_id': {'$in': search['user']}},
+                                        {'name': {'$in': search['user_name']}}]},
+                               {'name': 1})
+        for user in users:
+            users_id[user['_id']] = user
+            users_name.setdefault(user['name'], user)
+
+    for item in known_items:
         # Find service and service_name
         if 'service' in item and item['service']:
-            service = services_drv.find_one({'_id': item['service']})
+            service = services_id.get(item['service'])
             if service:
                 item['service_name'] = service['name']
         elif 'service_name' in item and item['service_name']:
-            service = services_drv.find_one({'host': item['host'], 'name': item['service_name']})
+            service = services_name.get((item['host'], item['service_name']))
             if service:
                 item['service'] = service['_id']
 
         # Find user and user_name
         if 'user' in item and item['user']:
-            user = users_drv.find_one({'_id': item['user']})
+            user = users_id.get(item['user'])
             if user:
                 item['user_name'] = user['name']
         elif 'user_name' in item and item['user_name']:
-            user = users_drv.find_one({'name': item['user_name']})
+            user = users_name.get(item['user_name'])
             if user:
                 item['user'] = user['_id']
         else:
@@ -321,6 +326,7 @@ def after_insert_logcheckresult(items):
     :type items: dict
     :return: None
     """
+    histories = []
     for dummy, item in enumerate(items):
         # Create an history event for the new forcecheck
         data = {
@@ -333,7 +339,22 @@ def after_insert_logcheckresult(items):
             'message': '',
             'logcheckresult': item['_id']
         }
-        post_internal("history", data, True)
+        histories.append(data)
+    if histories:
+        JobQueue.enqueue('history', histories)
+
+
+def post_history(items):
+    """
+    Job to add history elements
+
+    :param items: history fields
+    :type items: list
+    :return: False if the history elements were not added
+    :rtype: bool
+    """
+    response = post_internal("history", items, True)
+    return response[3] in [200, 201]
 
 
 # Actions acknowledge
@@ -380,7 +401,7 @@ def after_insert_actionacknowledge(items):
             'type': 'ack.' + item['action'],
             'message': item['comment']
         }
-        post_internal("history", data, True)
+        JobQueue.enqueue('history', [data])
 
 
 def after_update_actionacknowledge(updated, original):
@@ -416,7 +437,7 @@ def after_update_actionacknowledge(updated, original):
             'content': {
             }
         }
-        post_internal("history", data, True)
+        JobQueue.enqueue('history', [data])
 
 
 # Actions downtime
@@ -463,7 +484,7 @@ def after_insert_actiondowntime(items):
             'type': 'downtime.' + item['action'],
             'message': item['comment']
         }
-        post_internal("history", data, True)
+        JobQueue.enqueue('history', [data])
 
 
 def after_update_actiondowntime(updated, original):
@@ -499,7 +520,7 @@ def after_update_actiondowntime(updated, original):
             'content': {
             }
         }
-        post_internal("history", data, True)
+        JobQueue.enqueue('history', [data])
 
 
 # Actions forcecheck
@@ -546,7 +567,7 @@ def after_insert_actionforcecheck(items):
             'type': 'check.request',
             'message': item['comment']
         }
-        post_internal("history", data, True)
+        JobQueue.enqueue('history', [data])
 
 
 def after_update_actionforcecheck(updated, original):
@@ -582,7 +603,7 @@ def after_update_actionforcecheck(updated, original):
             'content': {
             }
         }
-        post_internal("history", data, True)
+        JobQueue.enqueue('history', [data])
 
 
 # Hosts groups
@@ -655,7 +676,7 @@ def pre_timeseries_post(items):
     """
     graphite_drv = current_app.data.driver.db['graphite']
     influxdb_drv = current_app.data.driver.db['influxdb']
-    realm_drv = current_app.data.driver.db['realm']
+    realm_tree = RealmTree.get()
     for dummy, item in enumerate(items):
         if 'grafana' in item and item['grafana'] is not None:
             # search graphite with grafana id in this realm
@@ -667,13 +688,13 @@ def pre_timeseries_post(items):
                     {'_realm': item['_realm'], 'grafana': item['grafana']}).count() > 0:
                 abort(make_response("A timeserie is yet attached to grafana in this realm", 412))
             # get parent realms
-            tsrealms = realm_drv.find_one({'_id': item['_realm']})
+            tsrealms = list(realm_tree.parents[item['_realm']])
             if graphite_drv.find(
-                    {'_realm': {'$in': tsrealms['_tree_parents']}, 'grafana': item['grafana'],
+                    {'_realm': {'$in': tsrealms}, 'grafana': item['grafana'],
                      '_sub_realm': True}).count() > 0:
                 abort(make_response("A timeserie is yet attached to grafana in parent realm", 412))
             if influxdb_drv.find(
-                    {'_realm': {'$in': tsrealms['_tree_parents']}, 'grafana': item['grafana'],
+                    {'_realm': {'$in': tsrealms}, 'grafana': item['grafana'],
                      '_sub_realm': True}).count() > 0:
                 abort(make_response("A timeserie is yet attached to grafana in parent realm", 412))
 
@@ -881,6 +902,7 @@ def after_insert_realm(items):
     :return: None
     """
     # pylint: disable=unused-argument
+    RealmTree.bump()
     for dummy, item in enumerate(items):
         # update _children fields on all parents
         realmsdrv = current_app.data.driver.db['realm']
@@ -906,6 +928,7 @@ def after_update_realm(updated, original):
     :type original: dict
     :return: None
     """
+    RealmTree.bump()
     if g.updateRealm:
         if '_all_children' in updated and updated['_all_children'] != original['_all_children']:
             s = set(original['_all_children'])
@@ -955,6 +978,7 @@ def after_delete_realm(item):
     :type item: dict
     :return: None
     """
+    RealmTree.bump()
     realmsdrv = current_app.data.driver.db['realm']
     if len(item['_tree_parents']) > 0:
         parent = realmsdrv.find_one({'_id': item['_tree_parents'][-1]})
@@ -977,6 +1001,7 @@ def after_delete_resource_realm():
 
     :return: None
     """
+    RealmTree.bump()
     realmsdrv = current_app.data.driver.db['realm']
     realmall = realmsdrv.find_one({'_level': 0})
     lookup = {"_id": realmall['_id']}
@@ -1041,39 +1066,11 @@ def pre_host_patch(updates, original):
         if ('_overall_state_id' in updates and updates['_overall_state_id'] == -1) or \
                 ('ls_state_type' in updates and updates['ls_state_type'] == 'HARD'):
 
-            overall_state = 0
-
-            acknowledged = original['ls_acknowledged']
-            if 'ls_acknowledged' in updates:
-                acknowledged = updates['ls_acknowledged']
+            host = dict(original)
+            host.update(updates)
+            overall_state = Livestate.get_host_overall_state(host)
 
-            downtimed = original['ls_downtimed']
-            if 'ls_downtimed' in updates:
-                downtimed = updates['ls_downtimed']
-
-            state = original['ls_state']
-            if 'ls_state' in updates:
-                state = updates['ls_state']
-            state = state.upper()
-
-            if acknowledged:
-                overall_state = 1
-            elif downtimed:
-                overall_state = 2
-            else:
-                if state == 'UNREACHABLE':
-                    overall_state = 3
-                elif state == 'DOWN':
-                    overall_state = 4
-
-            if overall_state <= 2:
-                services_drv = current_app.data.driver.db['service']
-                services = services_drv.find({'host': original['_id']})
-                for service in services:
-                    if service['ls_state_type'] == 'HARD':
-                        overall_state = max(overall_state, service['_overall_state_id'])
-
-            # Get the host services overall states
+            # Set the host overall state, including its services overall states
             updates['_overall_state_id'] = overall_state
 
         # Only some live state fields, do not change _updated field
@@ -1090,25 +1087,9 @@ def after_insert_host(items):
     """
     etags = {}
     for dummy, item in enumerate(items):
-        overall_state = 0
-
-        acknowledged = item['ls_acknowledged']
-        downtimed = item['ls_downtimed']
-        state = item['ls_state']
-        state = state.upper()
-
-        if acknowledged:
-            overall_state = 1
-        elif downtimed:
-            overall_state = 2
-        else:
-            if state == 'UNREACHABLE':
-                overall_state = 3
-            elif state == 'DOWN':
-                overall_state = 4
-
         # Do not care about services... when inserting an host,
         # services are not yet existing for this host!
+        overall_state = Livestate.get_overall_state('host', item)
 
         # Host overall was computed, update the host overall state
         lookup = {"_id": item['_id']}
@@ -1161,34 +1142,9 @@ def pre_service_patch(updates, original):
         if 'ls_state_type' in updates and updates['ls_state_type'] == 'HARD':
             # We updated the service live state, compute the new overall state
             if 'ls_state' in updates or 'ls_acknowledged' in updates or 'ls_downtimed' in updates:
-                overall_state = 0
-
-                acknowledged = original['ls_acknowledged']
-                if 'ls_acknowledged' in updates:
-                    acknowledged = updates['ls_acknowledged']
-
-                downtimed = original['ls_downtimed']
-                if 'ls_downtimed' in updates:
-                    downtimed = updates['ls_downtimed']
-
-                state = original['ls_state']
-                if 'ls_state' in updates:
-                    state = updates['ls_state']
-                state = state.upper()
-
-                if acknowledged:
-                    overall_state = 1
-                elif downtimed:
-                    overall_state = 2
-                else:
-                    if state == 'WARNING':
-                        overall_state = 3
-                    elif state == 'CRITICAL':
-                        overall_state = 4
-                    elif state == 'UNKNOWN':
-                        overall_state = 3
-                    elif state == 'UNREACHABLE':
-                        overall_state = 4
+                service = dict(original)
+                service.update(updates)
+                overall_state = Livestate.get_overall_state('service', service)
 
                 updates['_overall_state_id'] = overall_state
 
@@ -1206,26 +1162,7 @@ def after_insert_service(items):
     """
     etags = {}
     for dummy, item in enumerate(items):
-        overall_state = 0
-
-        acknowledged = item['ls_acknowledged']
-        downtimed = item['ls_downtimed']
-        state = item['ls_state']
-        state = state.upper()
-
-        if acknowledged:
-            overall_state = 1
-        elif downtimed:
-            overall_state = 2
-        else:
-            if state == 'WARNING':
-                overall_state = 3
-            elif state == 'CRITICAL':
-                overall_state = 4
-            elif state == 'UNKNOWN':
-                overall_state = 3
-            elif state == 'UNREACHABLE':
-                overall_state = 4
+        overall_state = Livestate.get_overall_state('service', item)
 
         # Service overall was computed, update the service overall state
         lookup = {"_id": item['_id']}
@@ -1266,10 +1203,15 @@ def after_updated_service(updated, original):
     :type original: dict
     :return: None
     """
-    if '_overall_state_id' in updated:
-        # Service overall was updated, we should update its host overall state
-        lookup = {"_id": original['host']}
-        patch_internal('host', {"_overall_state_id": -1}, False, False, **lookup)
+    service = dict(original)
+    service.update(updated)
+    if Livestate.get_service_bucket(service) != Livestate.get_service_bucket(original) or \
+            service.get('host') != original.get('host'):
+        # The service is counted in another overall state of its host (HARD state and overall
+        # state), its host overall state will be computed at the end of the request
+        Livestate.mark_host(original.get('host'))
+        if service.get('host') != original.get('host'):
+            Livestate.mark_host(service.get('host'))
 
 
 # Users
@@ -1284,7 +1226,7 @@ def pre_user_post(items):
     """
     for key, item in enumerate(items):
         if 'password' in item:
-            items[key]['password'] = generate_password_hash(item['password'])
+            items[key]['password'] = PasswordHash.generate(item['password'])
 
 
 def pre_user_patch(updates, original):
@@ -1303,7 +1245,7 @@ def pre_user_patch(updates, original):
     """
     # pylint: disable=unused-argument
     if 'password' in updates:
-        updates['password'] = generate_password_hash(updates['password'])
+        updates['password'] = PasswordHash.generate(updates['password'])
     # Special case, we don't want update _updated field when update ui_preferences field
     if len(updates) == 2 and 'ui_preferences' in updates:
         del updates['_updated']
@@ -1446,10 +1388,66 @@ settings['PORT'] = 5000
 settings['SERVER_NAME'] = None
 settings['DEBUG'] = False
 
+# Rights computed for a token are cached during AUTH_CACHE_TTL seconds, 0 to disable the cache
+# (per process cache, the other processes get the modified rights when their entry expires)
+settings['AUTH_CACHE_TTL'] = 60
+settings['AUTH_CACHE_SIZE'] = 1000
+# Signed tokens (no database request to authenticate), valid during AUTH_TOKEN_LIFETIME seconds
+settings['AUTH_TOKEN_SIGNED'] = False
+settings['AUTH_TOKEN_SECRET'] = None
+settings['AUTH_TOKEN_LIFETIME'] = 86400
+
+# Passwords hashed with PASSWORD_HASH_ITERATIONS, in a pool of PASSWORD_HASH_WORKERS processes
+# (0 to hash in the backend process) with at most PASSWORD_HASH_QUEUE waiting hashes
+settings['PASSWORD_HASH_ITERATIONS'] = 50000
+settings['PASSWORD_HASH_WORKERS'] = 2
+settings['PASSWORD_HASH_QUEUE'] = 32
+settings['PASSWORD_HASH_TIMEOUT'] = 10
+
+# Background jobs (history, timeseries) queued and processed by the jobs_worker command
+settings['JOB_QUEUE'] = False
+settings['JOB_QUEUE_THREADS'] = 4
+settings['JOB_QUEUE_MAX_ATTEMPTS'] = 10
+settings['JOB_QUEUE_BACKOFF'] = 5
+settings['JOB_QUEUE_BACKOFF_MAX'] = 3600
+settings['JOB_QUEUE_LEASE'] = 300
+settings['JOB_QUEUE_POLL'] = 1
+
+# Search the documents of the realms and sub-realms with the realm path
+settings['REALM_PATH_FILTER'] = False
+
+# Compute the overall state of the hosts with updated services every X seconds rather than at
+# the end of each request (0)
+settings['HOST_OVERALL_STATE_FLUSH'] = 0
+
 settings['SCHEDULER_TIMESERIES_ACTIVE'] = False
 settings['SCHEDULER_GRAFANA_ACTIVE'] = False
+# The timeseries clients are kept open, the statsd configuration is read again every X seconds
+settings['TIMESERIES_CLIENTS_REFRESH'] = 60
+# Send the perfdata to each timeseries database by batches of X points (0 to disable), a point
+# waits at most Y milliseconds in a batch
+settings['TIMESERIES_BATCH_SIZE'] = 0
+settings['TIMESERIES_BATCH_DELAY'] = 1000
+# Stop sending the perfdata to a timeseries database (retention only) after X consecutive
+# failures (0 to disable), try again after Y seconds, doubled after each failed try (max Z)
+settings['TIMESERIES_BREAKER_FAILURES'] = 3
+settings['TIMESERIES_BREAKER_DELAY'] = 10
+settings['TIMESERIES_BREAKER_DELAY_MAX'] = 300
+# Directory of the spool files of the perfdata not sent to the timeseries databases, rather than
+# the timeseriesretention collection ('' to disable), and maximum size of a spool file (bytes)
+settings['TIMESERIES_SPOOL'] = ''
+settings['TIMESERIES_SPOOL_SEGMENT_SIZE'] = 10485760
+# Maximum number of perfdata sent per second by the timeseries scheduler (0 for no limit)
+settings['TIMESERIES_REPLAY_RATE'] = 0
 settings['SCHEDULER_LIVESYNTHESIS_HISTORY'] = 0
+# History tiers with a lower resolution: list of [resolution (seconds), retention (minutes)]
+settings['LIVESYNTHESIS_HISTORY_TIERS'] = []
 settings['SCHEDULER_TIMEZONE'] = 'Etc/GMT'
+# The scheduler jobs run in the backend process holding the scheduler lease, renewed by the jobs
+settings['SCHEDULER_LEASE'] = 60
+# Maximum duration of the startup tasks (default elements, counters), then the time during
+# which they are not run again by the other backend processes
+settings['BOOTSTRAP_LEASE'] = 300
 settings['JOBS'] = []
 
 # Read configuration file to update/complete the configuration
@@ -1458,6 +1456,9 @@ get_settings(settings)
 if os.environ.get('ALIGNAK_BACKEND_MONGO_DBNAME'):
     settings['MONGO_DBNAME'] = os.environ.get('ALIGNAK_BACKEND_MONGO_DBNAME')
 
+if settings['AUTH_TOKEN_SIGNED'] and not settings['AUTH_TOKEN_SECRET']:
+    sys.exit("[ERROR] AUTH_TOKEN_SECRET must be defined to use signed tokens")
+
 # scheduler config
 jobs = []
 
@@ -1512,13 +1513,35 @@ app = Eve(
 app.on_pre_GET += pre_get
 app.on_insert_user += pre_user_post
 app.on_update_user += pre_user_patch
+app.on_inserted_host += OverallState.on_inserted_host
 app.on_inserted_host += after_insert_host
 app.on_post_POST_host += update_etag
+app.on_inserted_service += Livestate.on_inserted_service
+app.on_inserted_service += OverallState.on_inserted_service
 app.on_inserted_service += after_insert_service
 app.on_post_POST_service += update_etag
 app.on_update_host += pre_host_patch
 app.on_update_service += pre_service_patch
+app.on_updated_service += Livestate.on_updated_service
+app.on_deleted_item_service += Livestate.on_deleted_item_service
+app.on_deleted_resource_service += Livestate.on_deleted_resource_service
+app.on_replace_host += Livestate.on_replace_host
 app.on_updated_service += after_updated_service
+app.after_request(Livestate.flush_request)
+# Overall state of the realms and groups
+app.on_updated_host += OverallState.on_updated_host
+app.on_updated_service += OverallState.on_updated_service
+app.on_deleted_item_host += OverallState.on_deleted_item_host
+app.on_deleted_item_service += OverallState.on_deleted_item_service
+app.on_deleted_resource_host += OverallState.on_deleted_resource_host
+app.on_deleted_resource_service += OverallState.on_deleted_resource_service
+app.on_inserted_hostgroup += OverallState.on_inserted_hostgroup
+app.on_updated_hostgroup += OverallState.on_updated_hostgroup
+app.on_deleted_item_hostgroup += OverallState.on_deleted_item_hostgroup
+app.on_inserted_servicegroup += OverallState.on_inserted_servicegroup
+app.on_updated_servicegroup += OverallState.on_updated_servicegroup
+app.on_deleted_item_servicegroup += OverallState.on_deleted_item_servicegroup
+app.on_updated_realm += OverallState.on_updated_realm
 app.on_delete_item_realm += pre_delete_realm
 app.on_deleted_item_realm += after_delete_realm
 app.on_deleted_resource_realm += after_delete_resource_realm
@@ -1528,6 +1551,15 @@ app.on_update_hostgroup += pre_hostgroup_patch
 app.on_update_servicegroup += pre_servicegroup_patch
 app.on_insert_graphite += pre_timeseries_post
 app.on_insert_influxdb += pre_timeseries_post
+app.on_updated_graphite += TimeseriesClients.on_updated_graphite
+app.on_deleted_item_graphite += TimeseriesClients.on_deleted_item_graphite
+app.on_updated_influxdb += TimeseriesClients.on_updated_influxdb
+app.on_deleted_item_influxdb += TimeseriesClients.on_deleted_item_influxdb
+app.on_updated_statsd += TimeseriesClients.on_updated_statsd
+app.on_deleted_item_statsd += TimeseriesClients.on_deleted_item_statsd
+# Statistics of the timeseries sends published for all the processes
+TimeseriesStats.register('batch', TimeseriesBatch.stats)
+TimeseriesStats.register('breaker', CircuitBreaker.stats)
 
 # docs api
 Bootstrap(app)
@@ -1545,8 +1577,15 @@ app.config['SWAGGER_INFO'] = {
 }
 app.config['ENABLE_HOOK_DESCRIPTION'] = True
 
-# Create default backend elements
-with app.test_request_context():
+
+def create_default_elements():
+    """
+    Create the default backend elements (realm, groups, timeperiods, commands, dummy host and
+    super administrator) if they do not exist
+
+    :return: None
+    """
+    # pylint: disable=too-many-locals
     # Create default realm if not defined
     realms = app.data.driver.db['realm']
     default_realm = realms.find_one({'name': 'All'})
@@ -1672,32 +1711,67 @@ with app.test_request_context():
               "admin-password")
         print("===============================================================================")
 
-    # Live synthesis management
-    app.on_inserted_host += Livesynthesis.on_inserted_host
-    app.on_inserted_service += Livesynthesis.on_inserted_service
-    app.on_updated_host += Livesynthesis.on_updated_host
-    app.on_updated_service += Livesynthesis.on_updated_service
-    app.on_fetched_item_livesynthesis += Livesynthesis.on_fetched_item_history
 
-    # Templates management
-    app.on_pre_POST_host += Template.pre_post_host
-    app.on_update_host += Template.on_update_host
-    app.on_updated_host += Template.on_updated_host
+def recalculate():
+    """
+    Compute again the counters of the backend: live synthesis, overall states, users rights
+    and realm path (backend upgrade, counters not updated...)
+
+    :return: None
+    """
+    # Initial livesynthesis
+    Livesynthesis.recalculate()
+
+    # Services overall states of the hosts (backend upgrade)
+    if app.data.driver.db['host'].find_one({'_overall_state_services': {'$exists': False}}):
+        Livestate.recalculate_services_states()
+
+    # Overall state of the realms and groups (backend upgrade)
+    if app.data.driver.db['realm'].find_one({'_overall_state_counts': {'$exists': False}}):
+        OverallState.recalculate()
 
-    app.on_inserted_host += Template.on_inserted_host
-    app.on_inserted_service += Template.on_inserted_service
-    app.on_deleted_item_service += Template.on_deleted_item_service
+    # History of the live synthesis in buckets (backend upgrade)
+    LivesynthesisRetention.create_indexes()
+    Timeseries.create_indexes()
+    if app.data.driver.db['livesynthesisretention'].find_one({'start': {'$exists': False}}):
+        print("Moved %d live synthesis history documents to buckets"
+              % LivesynthesisRetention.migrate())
 
-    app.on_pre_POST_service += Template.pre_post_service
-    app.on_update_service += Template.on_update_service
-    app.on_updated_service += Template.on_updated_service
+    # Initial users rights (the backend resources may have changed)
+    UserRights.update()
+    if settings['REALM_PATH_FILTER']:
+        RealmPath.backfill()
 
-    app.on_pre_POST_user += Template.pre_post_user
-    app.on_update_user += Template.on_update_user
-    app.on_updated_user += Template.on_updated_user
 
-    # Initial livesynthesis
-    Livesynthesis.recalculate()
+# Create default backend elements, in only one process of the backend nodes
+with app.test_request_context():
+    Lease.run_once('bootstrap', create_default_elements, settings['BOOTSTRAP_LEASE'])
+
+# Live synthesis management
+app.on_inserted_host += Livesynthesis.on_inserted_host
+app.on_inserted_service += Livesynthesis.on_inserted_service
+app.on_updated_host += Livesynthesis.on_updated_host
+app.on_updated_service += Livesynthesis.on_updated_service
+app.on_updated_realm += Livesynthesis.on_updated_realm
+app.on_deleted_item_realm += Livesynthesis.on_deleted_item_realm
+app.on_fetched_item_livesynthesis += Livesynthesis.on_fetched_item_history
+
+# Templates management
+app.on_pre_POST_host += Template.pre_post_host
+app.on_update_host += Template.on_update_host
+app.on_updated_host += Template.on_updated_host
+
+app.on_inserted_host += Template.on_inserted_host
+app.on_inserted_service += Template.on_inserted_service
+app.on_deleted_item_service += Template.on_deleted_item_service
+
+app.on_pre_POST_service += Template.pre_post_service
+app.on_update_service += Template.on_update_service
+app.on_updated_service += Template.on_updated_service
+
+app.on_pre_POST_user += Template.pre_post_user
+app.on_update_user += Template.on_update_user
+app.on_updated_user += Template.on_updated_user
 
 # hooks post-init
 app.on_insert_realm += pre_realm_post
@@ -1722,14 +1796,56 @@ app.on_updated_actionforcecheck += after_update_actionforcecheck
 
 app.on_insert_history += pre_history_post
 
+# Background jobs
+JobQueue.register('history', post_history)
+JobQueue.register('timeseries', Timeseries.after_inserted_logcheckresult)
+
 app.on_insert_logcheckresult += pre_logcheckresult_post
 app.on_inserted_logcheckresult += after_insert_logcheckresult
 
 app.on_pre_DELETE += keep_default_items_resource
 app.on_delete_item += keep_default_items_item
 
+# Users rights
+app.on_inserted_user += UserRights.on_inserted_user
+app.on_inserted_userrestrictrole += UserRights.on_inserted_userrestrictrole
+app.on_updated_userrestrictrole += UserRights.on_updated_userrestrictrole
+app.on_deleted_item_userrestrictrole += UserRights.on_deleted_item_userrestrictrole
+app.on_deleted_resource_userrestrictrole += UserRights.on_deleted_resource_userrestrictrole
+app.on_inserted_realm += UserRights.on_realm_changed
+app.on_updated_realm += UserRights.on_realm_changed
+app.on_deleted_item_realm += UserRights.on_realm_changed
+app.on_deleted_resource_realm += UserRights.on_realm_changed
+app.after_request(UserRights.flush_request)
+
+# Authentication cache invalidation
+app.on_updated_user += AuthCache.on_updated_user
+app.on_deleted_item_user += AuthCache.on_deleted_item_user
+app.on_deleted_resource_user += AuthCache.on_realm_changed
+app.on_inserted_userrestrictrole += AuthCache.on_inserted_userrestrictrole
+app.on_updated_userrestrictrole += AuthCache.on_updated_userrestrictrole
+app.on_deleted_item_userrestrictrole += AuthCache.on_deleted_item_userrestrictrole
+app.on_deleted_resource_userrestrictrole += AuthCache.on_realm_changed
+app.on_inserted_realm += AuthCache.on_realm_changed
+app.on_updated_realm += AuthCache.on_realm_changed
+app.on_deleted_item_realm += AuthCache.on_realm_changed
+app.on_deleted_resource_realm += AuthCache.on_realm_changed
+
 with app.test_request_context():
-    app.on_inserted_logcheckresult += Timeseries.after_inserted_logcheckresult
+    app.on_inserted_logcheckresult += Timeseries.on_inserted_logcheckresult
+
+    # Realm path of the realm-scoped documents, once the other hooks have set the _realm
+    for resource_name in RealmPath.get_resources():
+        insert_hook = getattr(app, 'on_insert_%s' % resource_name)
+        insert_hook += RealmPath.on_insert
+        update_hook = getattr(app, 'on_update_%s' % resource_name)
+        update_hook += RealmPath.on_update
+        replace_hook = getattr(app, 'on_replace_%s' % resource_name)
+        replace_hook += RealmPath.on_replace
+    app.on_updated_realm += RealmPath.on_updated_realm
+
+    # Counters of the backend, computed in only one process of the backend nodes
+    Lease.run_once('recalculate', recalculate, settings['BOOTSTRAP_LEASE'])
 
 # Start scheduler (internal cron)
 if len(settings['JOBS']) > 0:
@@ -1767,11 +1883,21 @@ def login_app():
         _users = app.data.driver.db['user']
         user = _users.find_one({'name': posted_data['username']})
         if user:
-            if check_password_hash(user['password'], posted_data['password']):
+            if PasswordHash.check(user['password'], posted_data['password']):
+                if PasswordHash.needs_rehash(user['password']):
+                    # Hash the password again with the configured cost
+                    _users.update({'_id': user['_id']},
+                                  {'$set': {'password': PasswordHash.generate(
+                                      posted_data['password'])}})
+                if settings['AUTH_TOKEN_SIGNED']:
+                    version = UserRights.get_user_rights(user)['version']
+                    return jsonify({'token': SignedToken.generate(user, version)})
                 if 'action' in posted_data:
                     if posted_data['action'] == 'generate' or not user['token']:
                         token = generate_token()
                         _users.update({'_id': user['_id']}, {'$set': {'token': token}})
+                        # The former token is revoked
+                        AuthCache.invalidate_user(user['_id'])
                         return jsonify({'token': token})
                 elif not user['token']:
                     token = generate_token()
@@ -1799,33 +1925,113 @@ def backend_config():
     return jsonify(my_config)
 
 
+@app.route("/rights/check", methods=['POST'])
+def rights_check():
+    """
+    Check the rights of the logged-in user on a list of items
+
+    The posted data is a list of checks, each check being a list (or a dictionary) with a
+    resource, an item_id and a method (GET, PATCH or DELETE)
+
+    :return: the checks with the allowed field (True / False)
+    :rtype: dict
+    """
+    if not app.auth.authorized([], 'rights', 'POST'):
+        return app.auth.authenticate()
+
+    posted_data = request.get_json(silent=True)
+    if isinstance(posted_data, dict):
+        posted_data = posted_data.get('checks')
+    checks = RightsCheck.parse(posted_data)
+    if checks is None:
+        abort(400, description='The checks must be a list of (resource, item_id, method)')
+
+    items = []
+    for (resource, item_id, method), allowed in zip(checks, RightsCheck.check(checks)):
+        items.append({'resource': resource, 'item_id': str(item_id), 'method': method,
+                      'allowed': allowed})
+    return jsonify({'_items': items})
+
+
+@app.route("/livestate", methods=['POST'])
+def livestate():
+    """
+    Update the live state of many hosts and services
+
+    The posted data is a dictionary with the host and service lists, each item of the lists
+    having an _id and the ls_* fields to update
+
+    :return: number of updated hosts and services and the invalid items
+    :rtype: dict
+    """
+    if not app.auth.authorized([], 'livestate', 'POST'):
+        return app.auth.authenticate()
+
+    posted_data = request.get_json(silent=True)
+    if not isinstance(posted_data, dict):
+        abort(400, description='The live state must be a dictionary with host and service lists')
+
+    result = Livestate.update(posted_data)
+    response = {'_status': 'OK', '_updated': result['updated']}
+    if result['issues']:
+        response['_status'] = 'ERR'
+        response['_issues'] = result['issues']
+    return jsonify(response)
+
+
+@app.route("/jobqueue")
+def jobqueue_stats():
+    """
+    Get the number of background jobs in the queue
+
+    :return: number of jobs by status and by name
+    :rtype: dict
+    """
+    if not app.auth.authorized([], 'jobqueue', 'GET'):
+        return app.auth.authenticate()
+    return jsonify(JobQueue.stats())
+
+
+@app.route("/timeseries_batch")
+def timeseries_batch_stats():
+    """
+    Get the statistics of the perfdata batches of all the backend processes and jobs workers
+
+    :return: points waiting in the batches and statistics of the sent batches
+    :rtype: dict
+    """
+    if not app.auth.authorized([], 'timeseries_batch', 'GET'):
+        return app.auth.authenticate()
+    return jsonify(TimeseriesBatch.aggregate(TimeseriesStats.get('batch')))
+
+
+@app.route("/timeseries_breaker")
+def timeseries_breaker_stats():
+    """
+    Get the state of the circuit breakers of the timeseries databases of all the backend
+    processes and jobs workers
+
+    :return: state of the circuit breaker of each timeseries database
+    :rtype: dict
+    """
+    if not app.auth.authorized([], 'timeseries_breaker', 'GET'):
+        return app.auth.authenticate()
+    return jsonify(CircuitBreaker.aggregate(TimeseriesStats.get('breaker')))
+
+
 @app.route("/cron_timeseries")
 def cron_timeseries():
     """
-    Cron used to add perfdata from retention to timeseries databases
+    Cron used to add perfdata from retention (and spool files) to timeseries databases
 
-    :return: None
+    The replay stops after half the scheduler lease, the next run goes on.
+
+    :return: number of sent perfdata and progress of each timeseries database
+    :rtype: dict
     """
     with app.test_request_context():
-        timeseriesretention_db = current_app.data.driver.db['timeseriesretention']
-        graphite_db = current_app.data.driver.db['graphite']
-        influxdb_db = current_app.data.driver.db['influxdb']
-        if timeseriesretention_db.find().count() > 0:
-            tsc = timeseriesretention_db.find({'graphite': {'$ne': None}})
-            for data in tsc:
-                graphite = graphite_db.find_one({'_id': data['graphite']})
-                if not Timeseries.send_to_timeseries_graphite([data], graphite):
-                    break
-                lookup = {"_id": data['_id']}
-                deleteitem_internal('timeseriesretention', False, False, **lookup)
-
-            tsc = timeseriesretention_db.find({'influxdb': {'$ne': None}})
-            for data in tsc:
-                influxdb = influxdb_db.find_one({'_id': data['influxdb']})
-                if not Timeseries.send_to_timeseries_influxdb([data], influxdb):
-                    break
-                lookup = {"_id": data['_id']}
-                deleteitem_internal('timeseriesretention', False, False, **lookup)
+        progress = Timeseries.replay(time.time() + settings['SCHEDULER_LEASE'] / 2.0)
+        return jsonify(progress)
 
 
 @app.route("/cron_grafana", methods=['GET'])
@@ -1940,29 +2146,97 @@ def cron_livesynthesis_history():
     """
     Cron used to generate new history line for livesynthesis (+ delete too old entries)
 
-    :return: empty dictionary
+    :return: number of inserted, rolled up and expired samples / buckets and duration of each
+             step (seconds)
     :rtype: dict
     """
-    minutes = settings['SCHEDULER_LIVESYNTHESIS_HISTORY']
     with app.test_request_context():
-        # for each livesynthesis, add into internal livesynthesisretention endpoint
+        result = {'duration': {}}
+        # for each livesynthesis, add a sample in its current history bucket
+        start = time.time()
         livesynthesis_db = current_app.data.driver.db['livesynthesis']
-        livesynthesisretention_db = current_app.data.driver.db['livesynthesisretention']
-        livesynthesis = livesynthesis_db.find()
-        for livesynth in livesynthesis:
-            livesynth['livesynthesis'] = livesynth['_id']
-            for prop in ['_id', '_created', '_updated', '_realm', '_users_read']:
-                if prop in livesynth:
-                    del livesynth[prop]
-            post_internal("livesynthesisretention", livesynth, True)
-            # delete older data
-            if minutes > 0:
-                items = livesynthesisretention_db.find(
-                    {"_created": {"$lt": (datetime.utcnow() - timedelta(seconds=60 * minutes))}})
-                for item in items:
-                    lookup = {"_id": item['_id']}
-                    deleteitem_internal('livesynthesisretention', False, False, **lookup)
-        return jsonify({})
+        now = datetime.utcnow()
+        result['inserted'] = LivesynthesisRetention.add([(livesynth['_id'], now, livesynth)
+                                                         for livesynth in livesynthesis_db.find()])
+        result['duration']['insert'] = round(time.time() - start, 3)
+        # compute the samples of the tiers with a lower resolution
+        start = time.time()
+        result['rolled_up'] = LivesynthesisRetention.rollup(now)
+        result['duration']['rollup'] = round(time.time() - start, 3)
+        # delete older data (the buckets whose all samples are too old) of each tier
+        start = time.time()
+        result['expired'] = LivesynthesisRetention.expire(now)
+        result['duration']['expire'] = round(time.time() - start, 3)
+        return jsonify(result)
+
+
+@register_command("Set the realm path of all the realm-scoped documents")
+def realm_path(options):
+    """
+    Create the realm path index and set the realm path of the documents which do not have it
+    or have a wrong one (backend upgrade, realm moved...)
+
+    :param options: command line options
+    :type options: dict
+    :return: None
+    """
+    # pylint: disable=unused-argument
+    with app.test_request_context():
+        start = time.time()
+        count = RealmPath.backfill()
+        print("Updated the realm path of %d documents in %.2f seconds"
+              % (count, time.time() - start))
+
+
+@register_command("Compute the overall state of the realms, hostgroups and servicegroups")
+def groups_overall_state(options):
+    """
+    Compute the counters and the overall state of all the realms, hostgroups and
+    servicegroups from the hosts and services (repair of the incremental updates)
+
+    :param options: command line options
+    :type options: dict
+    :return: None
+    """
+    # pylint: disable=unused-argument
+    with app.test_request_context():
+        start = time.time()
+        count = Livestate.recalculate_services_states()
+        print("Computed the services overall states of %d hosts" % count)
+        count = OverallState.recalculate()
+        print("Computed the overall state of %d realms and groups in %.2f seconds"
+              % (count, time.time() - start))
+
+
+@register_command("Compute the live synthesis of all the realms")
+def livesynthesis_recalculate(options):
+    """
+    Compute the live synthesis counters of all the realms from the hosts and services. Only
+    the wrong counters are written, unless the --full option is used.
+
+    :param options: command line options
+    :type options: dict
+    :return: None
+    """
+    with app.test_request_context():
+        start = time.time()
+        count = Livesynthesis.recalculate(options.get('--full', False))
+        print("Updated the live synthesis of %d realms in %.2f seconds"
+              % (count, time.time() - start))
+
+
+@register_command("Process the background jobs queue")
+def jobs_worker(options):
+    """
+    Process the background jobs (history, timeseries) with JOB_QUEUE_THREADS threads
+
+    :param options: command line options
+    :type options: dict
+    :return: None
+    """
+    # pylint: disable=unused-argument
+    print("Jobs worker started with %d threads" % settings['JOB_QUEUE_THREADS'])
+    JobQueue.run_worker(app, settings['JOB_QUEUE_THREADS'])
 
 
 @app.route('/docs')
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.authcache`` module
+
+    This module manages the cache of the users rights computed when authenticating a request
+"""
+from __future__ import print_function
+import threading
+import time
+from future.utils import iteritems
+from flask import current_app
+
+
+class AuthCache(object):
+    """
+        AuthCache class
+
+        Per-process cache of the rights computed for a token. An entry is removed when it
+        expires (AUTH_CACHE_TTL seconds) or when the Eve hooks tell us that a user, a
+        userrestrictrole or a realm was modified. The hooks only run in the process which made
+        the modification, so the other processes keep the former rights until their entries
+        expire.
+    """
+    # Rights dictionaries stored in the cache and copied in the flask g object
+    resources = ['resources_get', 'resources_get_parents', 'resources_get_custom',
+                 'resources_get_direct', 'resources_get_paths',
+                 'resources_post', 'resources_post_parents',
+                 'resources_patch', 'resources_patch_parents', 'resources_patch_custom',
+                 'resources_delete', 'resources_delete_parents', 'resources_delete_custom']
+
+    entries = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def get(token):
+        """
+        Get the rights cached for a token
+
+        :param token: the user token
+        :type token: str
+        :return: the rights dictionary or None if not cached / expired
+        :rtype: dict or None
+        """
+        with AuthCache.lock:
+            rights = AuthCache.entries.get(token)
+            if rights is None:
+                return None
+            if rights['_expire'] < time.time():
+                del AuthCache.entries[token]
+                return None
+            return rights
+
+    @staticmethod
+    def set(token, rights):
+        """
+        Store the rights computed for a token
+
+        :param token: the user token
+        :type token: str
+        :param rights: the rights dictionary
+        :type rights: dict
+        :return: None
+        """
+        ttl = current_app.config.get('AUTH_CACHE_TTL', 60)
+        if not ttl:
+            return
+
+        now = time.time()
+        rights['_expire'] = now + ttl
+        with AuthCache.lock:
+            if len(AuthCache.entries) >= current_app.config.get('AUTH_CACHE_SIZE', 1000):
+                # Remove the expired entries and, if not enough, flush the cache
+                for key in [key for key, value in iteritems(AuthCache.entries)
+                            if value['_expire'] < now]:
+                    del AuthCache.entries[key]
+                if len(AuthCache.entries) >= current_app.config.get('AUTH_CACHE_SIZE', 1000):
+                    AuthCache.entries = {}
+            AuthCache.entries[token] = rights
+
+    @staticmethod
+    def invalidate_user(user_id):
+        """
+        Remove all the cached entries of a user
+
+        :param user_id: id of the user
+        :type user_id: ObjectId
+        :return: None
+        """
+        with AuthCache.lock:
+            for key in [key for key, value in iteritems(AuthCache.entries)
+                        if value['user'] == user_id]:
+                del AuthCache.entries[key]
+
+    @staticmethod
+    def clear():
+        """
+        Remove all the cached entries
+
+        :return: None
+        """
+        with AuthCache.lock:
+            AuthCache.entries = {}
+
+    @staticmethod
+    def on_updated_user(updates, original):
+        """
+            What to do when a user is updated ...
+        """
+        # pylint: disable=unused-argument
+        AuthCache.invalidate_user(original['_id'])
+
+    @staticmethod
+    def on_deleted_item_user(item):
+        """
+            What to do when a user is deleted ...
+        """
+        AuthCache.invalidate_user(item['_id'])
+
+    @staticmethod
+    def on_inserted_userrestrictrole(items):
+        """
+            What to do when some userrestrictrole are inserted ...
+        """
+        for _, item in enumerate(items):
+            AuthCache.invalidate_user(item['user'])
+
+    @staticmethod
+    def on_updated_userrestrictrole(updates, original):
+        """
+            What to do when a userrestrictrole is updated ...
+        """
+        AuthCache.invalidate_user(original['user'])
+        if 'user' in updates:
+            AuthCache.invalidate_user(updates['user'])
+
+    @staticmethod
+    def on_deleted_item_userrestrictrole(item):
+        """
+            What to do when a userrestrictrole is deleted ...
+        """
+        AuthCache.invalidate_user(item['user'])
+
+    @staticmethod
+    def on_realm_changed(*args):
+        """
+            What to do when a realm (or a whole resource) is inserted / updated / deleted ...
+
+            The realms tree is used for the rights of all the users, so flush the cache
+        """
+        # pylint: disable=unused-argument
+        AuthCache.clear()
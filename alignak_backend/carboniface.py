@@ -17,18 +17,33 @@ Get it here: https://gist.github.com/otger/6606437#file-carboniface-py
 
 class CarbonIface(object):
 
-    def __init__(self, host, port, event_url=None):
+    def __init__(self, host, port, event_url=None, persistent=False):
         """Initialize Carbon Interface.
         host: host where the carbon daemon is running
         port: port where carbon daemon is listening for pickle protocol on host
         event_url: web app url where events can be added. It must be provided if add_event(...)
                    is to be used. Otherwise an exception by urllib2 will raise
+        persistent: keep the connection open between the sends (reconnect after an error)
         """
         self.host = host
         self.port = port
         self.event_url = event_url
+        self.persistent = persistent
         self.__data = []
         self.__data_lock = threading.Lock()
+        self.__socket = None
+        self.__socket_lock = threading.Lock()
+
+    def close(self):
+        """
+        Close the persistent connection
+
+        :return: None
+        """
+        with self.__socket_lock:
+            if self.__socket is not None:
+                self.__socket.close()
+                self.__socket = None
 
     def add_data(self, metric, value, ts=None):
         """
@@ -97,25 +112,36 @@ class CarbonIface(object):
                 self.__data_lock.release()
             else:
                 return False
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         payload = pickle.dumps(data)
         header = struct.pack("!L", len(payload))
         message = header + payload
-        s.settimeout(1)
-        s.connect((self.host, self.port))
-        try:
-            s.send(message)
-        except:
-            # log.exception('Error when sending data to carbon')
-            if save_in_error:
-                self.__data.extend(data)
-            return False
-        else:
-            # log.debug('Sent data to {host}:{port}: {0} metrics, {1} bytes'.format(len(data),
-            #   len(message), host = self.host, port=self.port))
-            return True
-        finally:
-            s.close()
+        with self.__socket_lock:
+            s = self.__socket
+            self.__socket = None
+            if s is None:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                s.settimeout(1)
+                try:
+                    s.connect((self.host, self.port))
+                except:
+                    s.close()
+                    raise
+            try:
+                s.sendall(message)
+            except:
+                # log.exception('Error when sending data to carbon')
+                if save_in_error:
+                    self.__data.extend(data)
+                s.close()
+                return False
+            else:
+                # log.debug('Sent data to {host}:{port}: {0} metrics, {1} bytes'.format(len(data),
+                #   len(message), host = self.host, port=self.port))
+                if self.persistent:
+                    self.__socket = s
+                else:
+                    s.close()
+                return True
 
     def add_event(self, what, data=None, tags=None, when=None):
         """
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.circuitbreaker`` module
+
+    This module manages the circuit breakers of the timeseries databases
+"""
+from __future__ import print_function
+import threading
+import time
+from future.utils import iteritems
+from flask import current_app
+
+
+class CircuitBreaker(object):
+    """
+        CircuitBreaker class
+
+        Per-process circuit breaker of each timeseries database (graphite or influxdb). After
+        TIMESERIES_BREAKER_FAILURES consecutive send failures, the breaker is open: the
+        perfdata are not sent, they go straight to the timeseries retention. After
+        TIMESERIES_BREAKER_DELAY seconds, the breaker is half-open: one send is tried, the
+        breaker is closed if it succeeds, otherwise it is open again for twice the delay (at
+        most TIMESERIES_BREAKER_DELAY_MAX seconds). A probe whose result is not recorded within
+        TIMESERIES_BREAKER_DELAY seconds is a failure.
+
+        The state of the breakers is published for all the processes (TimeseriesStats), see
+        aggregate.
+    """
+    breakers = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def allow(resource, destination_id):
+        """
+        Check if the perfdata may be sent to a timeseries database
+
+        :param resource: graphite or influxdb
+        :type resource: str
+        :param destination_id: id of the graphite or influxdb
+        :type destination_id: ObjectId
+        :return: True if the breaker is closed or if this send is the half-open probe
+        :rtype: bool
+        """
+        with CircuitBreaker.lock:
+            breaker = CircuitBreaker.breakers.get((resource, destination_id))
+            if breaker is None or breaker['state'] == 'closed':
+                return True
+            now = time.time()
+            if breaker['state'] == 'half-open' and now >= breaker['retry']:
+                # The probe never recorded its result
+                breaker['failures'] += 1
+                CircuitBreaker.trip(breaker)
+            if breaker['state'] == 'open' and now >= breaker['retry']:
+                breaker['state'] = 'half-open'
+                # Deadline of the probe
+                breaker['retry'] = now + current_app.config.get('TIMESERIES_BREAKER_DELAY', 10)
+                return True
+            breaker['rejected'] += 1
+            return False
+
+    @staticmethod
+    def record(resource, destination_id, success):
+        """
+        Record the result of a send to a timeseries database
+
+        :param resource: graphite or influxdb
+        :type resource: str
+        :param destination_id: id of the graphite or influxdb
+        :type destination_id: ObjectId
+        :param success: True if the perfdata were sent
+        :type success: bool
+        :return: None
+        """
+        failures = current_app.config.get('TIMESERIES_BREAKER_FAILURES', 3)
+        if not failures:
+            return
+        with CircuitBreaker.lock:
+            breaker = CircuitBreaker.breakers.get((resource, destination_id))
+            if success:
+                if breaker is not None:
+                    breaker.update({'state': 'closed', 'failures': 0, 'delay': 0})
+                return
+            if breaker is None:
+                breaker = CircuitBreaker.breakers[(resource, destination_id)] = {
+                    'state': 'closed', 'failures': 0, 'delay': 0, 'retry': 0, 'opened': 0,
+                    'rejected': 0}
+            breaker['failures'] += 1
+            if breaker['state'] == 'half-open' or breaker['failures'] >= failures:
+                if breaker['state'] == 'closed':
+                    breaker['opened'] += 1
+                CircuitBreaker.trip(breaker)
+
+    @staticmethod
+    def trip(breaker):
+        """
+        Open a breaker for twice its former delay, at most TIMESERIES_BREAKER_DELAY_MAX seconds
+        (the lock must be held)
+
+        :param breaker: the breaker
+        :type breaker: dict
+        :return: None
+        """
+        breaker['delay'] = min(
+            breaker['delay'] * 2 or current_app.config.get('TIMESERIES_BREAKER_DELAY', 10),
+            current_app.config.get('TIMESERIES_BREAKER_DELAY_MAX', 300))
+        breaker['state'] = 'open'
+        breaker['retry'] = time.time() + breaker['delay']
+
+    @staticmethod
+    def stats():
+        """
+        Get the state of the circuit breakers of the process
+
+        :return: for each timeseries database (resource/id), the state of the breaker, the
+                 number of consecutive failures, the number of times it was open, the number of
+                 rejected sends and the delay before the next try (seconds)
+        :rtype: dict
+        """
+        now = time.time()
+        with CircuitBreaker.lock:
+            return dict(('%s/%s' % key, {'state': breaker['state'],
+                                         'failures': breaker['failures'],
+                                         'opened': breaker['opened'],
+                                         'rejected': breaker['rejected'],
+                                         'retry_in': max(int(breaker['retry'] - now), 0)
+                                         if breaker['state'] == 'open' else 0})
+                        for key, breaker in iteritems(CircuitBreaker.breakers))
+
+    @staticmethod
+    def aggregate(processes):
+        """
+        Aggregate the state of the circuit breakers of some processes
+
+        :param processes: state of the breakers of each process (see stats)
+        :type processes: dict
+        :return: for each timeseries database, the worst state (open, half-open, closed), the
+                 number of processes where the breaker is not closed, the sum of the number of
+                 times the breaker was open and of the rejected sends, and the state of the
+                 breakers of each process
+        :rtype: dict
+        """
+        states = ['closed', 'half-open', 'open']
+        destinations = {}
+        for breakers in processes.values():
+            for key, breaker in iteritems(breakers):
+                total = destinations.setdefault(key, {'state': 'closed', 'not_closed': 0,
+                                                      'opened': 0, 'rejected': 0,
+                                                      'retry_in': 0})
+                if states.index(breaker['state']) > states.index(total['state']):
+                    total['state'] = breaker['state']
+                if breaker['state'] != 'closed':
+                    total['not_closed'] += 1
+                total['opened'] += breaker['opened']
+                total['rejected'] += breaker['rejected']
+                total['retry_in'] = max(total['retry_in'], breaker['retry_in'])
+        return {'destinations': destinations, 'processes': processes}
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.jobqueue`` module
+
+    This module manages the queue of background jobs
+"""
+from __future__ import print_function
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from flask import current_app
+from pymongo import ASCENDING, ReturnDocument
+
+
+class JobQueue(object):
+    """
+        JobQueue class
+
+        The side effects of an insert / update (history, timeseries) are jobs stored in the job
+        collection. They are processed by the jobs worker (alignak-backend jobs_worker) and
+        deleted once done. A failed job is retried later, with an exponential backoff, until
+        JOB_QUEUE_MAX_ATTEMPTS attempts.
+
+        A job handler returns False (or raises an exception) if the job must be retried.
+        If the queue is not activated (JOB_QUEUE), the jobs are processed immediately.
+    """
+    handlers = {}
+    stop = threading.Event()
+
+    @staticmethod
+    def register(name, handler):
+        """
+        Register the function which processes a kind of job
+
+        :param name: name of the job
+        :type name: str
+        :param handler: function called with the job data
+        :type handler: function
+        :return: None
+        """
+        JobQueue.handlers[name] = handler
+
+    @staticmethod
+    def enqueue(name, data):
+        """
+        Add a job in the queue, or process it if the queue is not activated
+
+        :param name: name of the job
+        :type name: str
+        :param data: data of the job
+        :type data: list
+        :return: None
+        """
+        if not current_app.config.get('JOB_QUEUE', False):
+            JobQueue.handlers[name](data)
+            return
+
+        now = datetime.utcnow()
+        current_app.data.driver.db['job'].insert_one({
+            'name': name,
+            'data': data,
+            'status': 'pending',
+            'attempts': 0,
+            'not_before': now,
+            'created': now
+        })
+
+    @staticmethod
+    def create_indexes():
+        """
+        Create the indexes of the job collection
+
+        :return: None
+        """
+        jobs = current_app.data.driver.db['job']
+        jobs.create_index([('status', ASCENDING), ('not_before', ASCENDING)])
+        jobs.create_index([('status', ASCENDING), ('locked_until', ASCENDING)])
+
+    @staticmethod
+    def take():
+        """
+        Take the next job to process: the oldest pending job or a job whose worker did not
+        finish in time (JOB_QUEUE_LEASE seconds)
+
+        :return: the job or None if no job to process
+        :rtype: dict or None
+        """
+        now = datetime.utcnow()
+        lease = timedelta(seconds=current_app.config.get('JOB_QUEUE_LEASE', 300))
+        return current_app.data.driver.db['job'].find_one_and_update(
+            {'$or': [{'status': 'pending', 'not_before': {'$lte': now}},
+                     {'status': 'running', 'locked_until': {'$lt': now}}]},
+            {'$set': {'status': 'running', 'locked_until': now + lease},
+             '$inc': {'attempts': 1}},
+            sort=[('not_before', ASCENDING)],
+            return_document=ReturnDocument.AFTER)
+
+    @staticmethod
+    def process(job):
+        """
+        Process a job, delete it when done or schedule a retry if failed
+
+        :param job: the job
+        :type job: dict
+        :return: True if the job was processed, otherwise False
+        :rtype: bool
+        """
+        jobs = current_app.data.driver.db['job']
+        try:
+            error = None
+            if JobQueue.handlers[job['name']](job['data']) is False:
+                error = 'Job failed'
+        except Exception:  # pylint: disable=W0703
+            error = traceback.format_exc()
+        if error is not None:
+            if job['attempts'] >= current_app.config.get('JOB_QUEUE_MAX_ATTEMPTS', 10):
+                jobs.update_one({'_id': job['_id']},
+                                {'$set': {'status': 'failed', 'error': error},
+                                 '$unset': {'locked_until': ''}})
+            else:
+                delay = min(current_app.config.get('JOB_QUEUE_BACKOFF', 5) *
+                            2 ** (job['attempts'] - 1),
+                            current_app.config.get('JOB_QUEUE_BACKOFF_MAX', 3600))
+                jobs.update_one({'_id': job['_id']},
+                                {'$set': {'status': 'pending', 'error': error,
+                                          'not_before': datetime.utcnow() +
+                                          timedelta(seconds=delay)},
+                                 '$unset': {'locked_until': ''}})
+            return False
+        jobs.delete_one({'_id': job['_id']})
+        return True
+
+    @staticmethod
+    def work(app):
+        """
+        Process the jobs until the worker is stopped
+
+        :param app: the backend application
+        :type app: Eve
+        :return: None
+        """
+        while not JobQueue.stop.is_set():
+            with app.test_request_context():
+                job = JobQueue.take()
+                if job is not None:
+                    JobQueue.process(job)
+                    continue
+                poll = current_app.config.get('JOB_QUEUE_POLL', 1)
+            JobQueue.stop.wait(poll)
+
+    @staticmethod
+    def run_worker(app, threads):
+        """
+        Run the jobs worker with some threads
+
+        :param app: the backend application
+        :type app: Eve
+        :param threads: number of threads
+        :type threads: int
+        :return: None
+        """
+        with app.test_request_context():
+            JobQueue.create_indexes()
+        workers = []
+        for _ in range(threads):
+            worker = threading.Thread(target=JobQueue.work, args=(app,))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        try:
+            while [worker for worker in workers if worker.is_alive()]:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            JobQueue.stop.set()
+            for worker in workers:
+                worker.join()
+
+    @staticmethod
+    def stats():
+        """
+        Get the number of jobs for each status and each kind of job
+
+        :return: number of jobs by status and by name
+        :rtype: dict
+        """
+        stats = {'pending': 0, 'running': 0, 'failed': 0, 'jobs': {}}
+        pipeline = [{'$group': {'_id': {'name': '$name', 'status': '$status'},
+                                'count': {'$sum': 1},
+                                'oldest': {'$min': '$created'}}}]
+        for group in current_app.data.driver.db['job'].aggregate(pipeline):
+            name = group['_id']['name']
+            status = group['_id']['status']
+            stats[status] = stats.get(status, 0) + group['count']
+            job_stats = stats['jobs'].setdefault(name, {'pending': 0, 'running': 0, 'failed': 0})
+            job_stats[status] = group['count']
+            if status == 'pending':
+                job_stats['oldest'] = group['oldest']
+        for job_stats in stats['jobs'].values():
+            if 'oldest' in job_stats:
+                job_stats['delay'] = int((datetime.utcnow() - job_stats['oldest'])
+                                         .total_seconds())
+                job_stats['oldest'] = job_stats['oldest'].isoformat()
+        return stats
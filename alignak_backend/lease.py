@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.lease`` module
+
+    This module manages the leases shared by all the backend processes
+"""
+from __future__ import print_function
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class Lease(object):
+    """
+        Lease class
+
+        A lease is a document of the lease collection, held by one backend process (of any
+        backend node) until it expires. It is used to run the startup tasks (default elements,
+        counters recalculation) and the scheduler jobs in only one process.
+    """
+    # Identifier of this backend node, the process id is added for each process
+    node = '%s-%s' % (socket.gethostname(), uuid.uuid4().hex[:8])
+
+    @staticmethod
+    def get_owner():
+        """
+        Get the identifier of the current process
+
+        :return: the lease owner identifier
+        :rtype: str
+        """
+        return '%s-%d' % (Lease.node, os.getpid())
+
+    @staticmethod
+    def acquire(name, duration):
+        """
+        Acquire a lease, or renew it if the current process already holds it
+
+        :param name: name of the lease
+        :type name: str
+        :param duration: duration of the lease in seconds
+        :type duration: int
+        :return: True if the current process holds the lease
+        :rtype: bool
+        """
+        now = datetime.utcnow()
+        owner = Lease.get_owner()
+        try:
+            lease = current_app.data.driver.db['lease'].find_one_and_update(
+                {'_id': name, '$or': [{'expires': {'$lt': now}}, {'owner': owner}]},
+                {'$set': {'owner': owner, 'expires': now + timedelta(seconds=duration),
+                          'done': False}},
+                upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # The lease is held by another process
+            return False
+        return lease is not None and lease['owner'] == owner
+
+    @staticmethod
+    def release(name):
+        """
+        Release a lease held by the current process
+
+        :param name: name of the lease
+        :type name: str
+        :return: None
+        """
+        current_app.data.driver.db['lease'].delete_one({'_id': name,
+                                                        'owner': Lease.get_owner()})
+
+    @staticmethod
+    def run_once(name, func, duration):
+        """
+        Run a function in only one process of all the backend nodes started at the same time
+
+        The process which gets the lease runs the function, then keeps the lease for duration
+        seconds, so the processes started in the meantime do not run it again. The other
+        processes wait until the function is done or until the lease expires (the process
+        running the function died) or is released (the function failed), then they try to
+        get the lease again.
+
+        :param name: name of the lease
+        :type name: str
+        :param func: function to run
+        :type func: function
+        :param duration: duration of the lease in seconds
+        :type duration: int
+        :return: True if the function was run by the current process
+        :rtype: bool
+        """
+        leases = current_app.data.driver.db['lease']
+        while True:
+            if Lease.acquire(name, duration):
+                start = time.time()
+                try:
+                    func()
+                except Exception:
+                    # Another process will run the function
+                    Lease.release(name)
+                    raise
+                leases.update_one({'_id': name, 'owner': Lease.get_owner()},
+                                  {'$set': {'done': True,
+                                            'expires': datetime.utcnow() +
+                                            timedelta(seconds=duration)}})
+                print("[%s] done in %.2f seconds" % (name, time.time() - start))
+                return True
+            lease = leases.find_one({'_id': name})
+            if lease is not None and lease.get('done', False):
+                print("[%s] already done by %s" % (name, lease['owner']))
+                return False
+            time.sleep(0.5)
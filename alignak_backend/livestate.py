@@ -0,0 +1,521 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.livestate`` module
+
+    This module manages the live state of the hosts and services
+"""
+from __future__ import print_function
+import threading
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from future.utils import iteritems
+from eve.utils import document_etag
+from flask import current_app, g
+from pymongo import UpdateOne
+from alignak_backend.livesynthesis import Livesynthesis
+from alignak_backend.overallstate import OverallState
+from alignak_backend.rightscheck import RightsCheck
+
+
+class Livestate(object):
+    """
+        Livestate class
+
+        The live state of many hosts and services is updated in one request, with the same
+        result as a PATCH request for each of them (overall states, live synthesis counters,
+        fields no longer inherited from the templates), but with one bulk write for each
+        collection.
+
+        Each host counts its services in an HARD state for each overall state in the
+        _overall_state_services field, so the host overall state is computed without reading
+        its services.
+
+        When a service moves to another counter of its host (HARD state and overall state), its
+        host is marked as dirty and the overall state of the dirty hosts is computed once at the
+        end of the request (or of the HOST_OVERALL_STATE_FLUSH window), with one bulk write.
+    """
+    # Overall state of the live states which are not acknowledged, in a downtime or OK / UP
+    overall_states = {
+        'host': {'UNREACHABLE': 3, 'DOWN': 4},
+        'service': {'WARNING': 3, 'CRITICAL': 4, 'UNKNOWN': 3, 'UNREACHABLE': 4}
+    }
+    # Dirty hosts waiting for the end of the flush window
+    dirty_hosts = set()
+    dirty_lock = threading.Lock()
+    flush_timer = None
+
+    @staticmethod
+    def get_overall_state(resource, item):
+        """
+        Get the overall state of an host or a service from its own live state
+
+        The services of an host are not used here, see get_host_overall_state
+
+        :param resource: host or service
+        :type resource: str
+        :param item: the host / service
+        :type item: dict
+        :return: the overall state
+        :rtype: int
+        """
+        if item['ls_acknowledged']:
+            return 1
+        if item['ls_downtimed']:
+            return 2
+        return Livestate.overall_states[resource].get(item['ls_state'].upper(), 0)
+
+    @staticmethod
+    def get_host_overall_state(host):
+        """
+        Get the overall state of an host from its live state and the overall states of its
+        services in an HARD state (see _overall_state_services)
+
+        If the host overall state is <= 2, it is the maximum of the host overall state and of
+        its services overall states
+
+        :param host: the host
+        :type host: dict
+        :return: the overall state
+        :rtype: int
+        """
+        overall_state = Livestate.get_overall_state('host', host)
+        if overall_state <= 2:
+            services_states = host.get('_overall_state_services') or {}
+            for state in range(4, overall_state, -1):
+                if services_states.get(str(state), 0) > 0:
+                    return state
+        return overall_state
+
+    @staticmethod
+    def get_service_bucket(service):
+        """
+        Get the counter of the host _overall_state_services where a service is counted
+
+        :param service: the service
+        :type service: dict
+        :return: the overall state of the service as a string, None if not counted
+        :rtype: str or None
+        """
+        if service.get('ls_state_type') != 'HARD' or service.get('_overall_state_id') is None:
+            return None
+        return str(service['_overall_state_id'])
+
+    @staticmethod
+    def add_service_bucket(counters, host_id, bucket, value):
+        """
+        Add a service in (or remove it from) the counters of its host
+
+        :param counters: counters delta for each host
+        :type counters: dict
+        :param host_id: id of the host
+        :type host_id: ObjectId
+        :param bucket: counter of the service, see get_service_bucket
+        :type bucket: str or None
+        :param value: 1 to add the service, -1 to remove it
+        :type value: int
+        :return: None
+        """
+        if bucket is None or host_id is None:
+            return
+        name = '_overall_state_services.%s' % bucket
+        host_counters = counters.setdefault(host_id, {})
+        host_counters[name] = host_counters.get(name, 0) + value
+
+    @staticmethod
+    def update_services_states(counters):
+        """
+        Update the _overall_state_services counters of the hosts with one bulk write
+
+        :param counters: counters delta for each host
+        :type counters: dict
+        :return: None
+        """
+        requests = []
+        for host_id, host_counters in iteritems(counters):
+            inc = dict((name, value) for name, value in iteritems(host_counters) if value)
+            if inc:
+                requests.append(UpdateOne({'_id': host_id}, {'$inc': inc}))
+        if requests:
+            current_app.data.driver.db['host'].bulk_write(requests, ordered=False)
+
+    @staticmethod
+    def on_inserted_service(items):
+        """
+            What to do when some services are inserted ...
+        """
+        counters = {}
+        for _, item in enumerate(items):
+            Livestate.add_service_bucket(counters, item.get('host'),
+                                         Livestate.get_service_bucket(item), 1)
+        Livestate.update_services_states(counters)
+
+    @staticmethod
+    def on_updated_service(updates, original):
+        """
+            What to do when a service is updated ...
+        """
+        service = dict(original)
+        service.update(updates)
+        old_bucket = Livestate.get_service_bucket(original)
+        new_bucket = Livestate.get_service_bucket(service)
+        if old_bucket != new_bucket or original.get('host') != service.get('host'):
+            counters = {}
+            Livestate.add_service_bucket(counters, original.get('host'), old_bucket, -1)
+            Livestate.add_service_bucket(counters, service.get('host'), new_bucket, 1)
+            Livestate.update_services_states(counters)
+
+    @staticmethod
+    def on_deleted_item_service(item):
+        """
+            What to do when a service is deleted ...
+        """
+        counters = {}
+        Livestate.add_service_bucket(counters, item.get('host'),
+                                     Livestate.get_service_bucket(item), -1)
+        Livestate.update_services_states(counters)
+
+    @staticmethod
+    def on_replace_host(document, original):
+        """
+            What to do when an host is replaced ...
+
+            The services counters are maintained by the services hooks, keep them
+        """
+        document['_overall_state_services'] = original.get('_overall_state_services') or \
+            Livestate.empty_services_states()
+
+    @staticmethod
+    def on_deleted_resource_service():
+        """
+            What to do when all the services are deleted ...
+        """
+        current_app.data.driver.db['host'].update_many(
+            {}, {'$set': {'_overall_state_services': Livestate.empty_services_states()}})
+
+    @staticmethod
+    def empty_services_states():
+        """
+        Get the _overall_state_services of an host without services
+
+        :return: a zero counter for each overall state
+        :rtype: dict
+        """
+        return dict((str(state), 0) for state in range(5))
+
+    @staticmethod
+    def recalculate_services_states():
+        """
+        Compute the _overall_state_services counters of all the hosts from their services
+
+        :return: number of hosts having some services in an HARD state
+        :rtype: int
+        """
+        hosts_drv = current_app.data.driver.db['host']
+        services_drv = current_app.data.driver.db['service']
+        pipeline = [
+            {'$match': {'ls_state_type': 'HARD'}},
+            {'$group': {'_id': {'host': '$host', 'state': '$_overall_state_id'},
+                        'count': {'$sum': 1}}}
+        ]
+        hosts = {}
+        for group in services_drv.aggregate(pipeline):
+            host_states = hosts.setdefault(group['_id']['host'], Livestate.empty_services_states())
+            host_states[str(group['_id']['state'])] = group['count']
+
+        hosts_drv.update_many({'_id': {'$nin': list(hosts)}},
+                              {'$set': {'_overall_state_services':
+                                        Livestate.empty_services_states()}})
+        requests = [UpdateOne({'_id': host_id}, {'$set': {'_overall_state_services': states}})
+                    for host_id, states in iteritems(hosts)]
+        if requests:
+            hosts_drv.bulk_write(requests, ordered=False)
+        return len(hosts)
+
+    @staticmethod
+    def mark_host(host_id):
+        """
+        Mark an host whose overall state must be computed again
+
+        :param host_id: id of the host
+        :type host_id: ObjectId
+        :return: None
+        """
+        if host_id is None:
+            return
+        window = current_app.config.get('HOST_OVERALL_STATE_FLUSH', 0)
+        if not window:
+            if g.get('dirty_hosts') is None:
+                g.dirty_hosts = set()
+            g.dirty_hosts.add(host_id)
+            return
+
+        with Livestate.dirty_lock:
+            Livestate.dirty_hosts.add(host_id)
+            if Livestate.flush_timer is None:
+                # pylint: disable=protected-access
+                Livestate.flush_timer = threading.Timer(
+                    window, Livestate.flush_window, args=(current_app._get_current_object(),))
+                Livestate.flush_timer.daemon = True
+                Livestate.flush_timer.start()
+
+    @staticmethod
+    def flush_window(app):
+        """
+        Compute the overall state of the hosts marked during the flush window
+
+        :param app: the backend application
+        :type app: Eve
+        :return: None
+        """
+        with Livestate.dirty_lock:
+            host_ids = Livestate.dirty_hosts
+            Livestate.dirty_hosts = set()
+            Livestate.flush_timer = None
+        with app.test_request_context():
+            Livestate.compute_hosts(host_ids)
+
+    @staticmethod
+    def flush_request(response):
+        """
+        Compute the overall state of the hosts marked during the request
+
+        :param response: the response of the request
+        :type response: flask.Response
+        :return: the response
+        :rtype: flask.Response
+        """
+        host_ids = g.pop('dirty_hosts', None)
+        if host_ids:
+            Livestate.compute_hosts(host_ids)
+        return response
+
+    @staticmethod
+    def compute_hosts(host_ids):
+        """
+        Compute the overall state of some hosts and write the changed ones with one bulk write
+
+        :param host_ids: ids of the hosts
+        :type host_ids: set
+        :return: number of hosts whose overall state changed
+        :rtype: int
+        """
+        docs = {}
+        changes = {}
+        transitions = []
+        search = {'_id': {'$in': list(host_ids)}, '_is_template': False}
+        for doc in current_app.data.driver.db['host'].find(search):
+            overall_state = Livestate.get_host_overall_state(doc)
+            if overall_state != doc.get('_overall_state_id'):
+                transitions.append((doc, doc.get('_overall_state_id'), -1))
+                transitions.append((doc, overall_state, 1))
+                doc['_overall_state_id'] = overall_state
+                docs[doc['_id']] = doc
+                changes[doc['_id']] = {'_overall_state_id': overall_state}
+        count = Livestate.write('host', docs, changes)
+        OverallState.update('host', transitions)
+        return count
+
+    @staticmethod
+    def get_items(resource, items, issues):
+        """
+        Get the valid live state updates of the posted items
+
+        :param resource: host or service
+        :type resource: str
+        :param items: posted items, each with an _id and the ls_* fields to update
+        :type items: list
+        :param issues: list where to add the invalid items
+        :type issues: list
+        :return: list of (item id, updates)
+        :rtype: list
+        """
+        schema = current_app.config['DOMAIN'][resource]['schema']
+        updates_list = []
+        if not isinstance(items, list):
+            issues.append({'resource': resource, 'issue': 'must be a list of items'})
+            return updates_list
+        for item in items:
+            if not isinstance(item, dict) or '_id' not in item:
+                issues.append({'resource': resource, 'issue': 'missing _id'})
+                continue
+            try:
+                item_id = ObjectId(item['_id'])
+            except (InvalidId, TypeError):
+                issues.append({'resource': resource, '_id': str(item['_id']),
+                               'issue': 'invalid _id'})
+                continue
+            updates = dict((key, value) for key, value in iteritems(item) if key != '_id')
+            fields = [key for key in updates if not key.startswith('ls_') or key not in schema]
+            if not updates or fields:
+                issues.append({'resource': resource, '_id': str(item_id),
+                               'issue': 'only ls_* fields may be updated'})
+                continue
+            updates_list.append((item_id, updates))
+        return updates_list
+
+    @staticmethod
+    def update(data):
+        """
+        Update the live state of hosts and services
+
+        The items are updated in the posted order, as if each of them was patched, then the
+        overall state of the hosts (if their live state is HARD or if the overall state of one
+        of their services changed) is computed once.
+
+        :param data: the hosts and services updates: {'host': [...], 'service': [...]}
+        :type data: dict
+        :return: number of updated items of each resource and the invalid items
+        :rtype: dict
+        """
+        # pylint: disable=too-many-locals
+        db = current_app.data.driver.db
+        issues = []
+        docs = {'host': {}, 'service': {}}
+        changes = {'host': {}, 'service': {}}
+        counters = {}
+        services_states = {}
+        hosts_to_compute = set()
+        overall_states = {}
+
+        for resource in ['service', 'host']:
+            updates_list = Livestate.get_items(resource, data.get(resource, []), issues)
+            if not updates_list:
+                continue
+            validator = current_app.validator(current_app.config['DOMAIN'][resource]['schema'],
+                                              resource=resource)
+            search = {'_id': {'$in': list({item_id for item_id, _ in updates_list})}}
+            for doc in db[resource].find(search):
+                docs[resource][doc['_id']] = doc
+                overall_states[doc['_id']] = doc.get('_overall_state_id')
+            for item_id, updates in updates_list:
+                doc = docs[resource].get(item_id)
+                if doc is None:
+                    issue = 'not found'
+                elif doc['_is_template']:
+                    issue = 'templates have no live state'
+                elif not g.get('back_role_super_admin', False) \
+                        and not RightsCheck.can_write(resource, doc, 'PATCH'):
+                    issue = 'not allowed'
+                elif not validator.validate_update(updates, item_id, doc):
+                    issue = validator.errors
+                else:
+                    issue = None
+                if issue:
+                    issues.append({'resource': resource, '_id': str(item_id), 'issue': issue})
+                    continue
+
+                # Live synthesis counters of the realm
+                minus, plus = Livesynthesis.livesynthesis_to_update(resource + 's', updates, doc)
+                if minus:
+                    realm_counters = counters.setdefault(doc['_realm'], {})
+                    realm_counters[minus] = realm_counters.get(minus, 0) - 1
+                    realm_counters[plus] = realm_counters.get(plus, 0) + 1
+
+                old_bucket = Livestate.get_service_bucket(doc)
+                doc.update(updates)
+                if resource == 'host':
+                    if updates.get('ls_state_type') == 'HARD':
+                        hosts_to_compute.add(item_id)
+                else:
+                    if updates.get('ls_state_type') == 'HARD' and \
+                            ('ls_state' in updates or 'ls_acknowledged' in updates or
+                             'ls_downtimed' in updates):
+                        updates['_overall_state_id'] = Livestate.get_overall_state('service',
+                                                                                   doc)
+                        doc['_overall_state_id'] = updates['_overall_state_id']
+                    # The host overall state only changes with the HARD services counters
+                    if Livestate.get_service_bucket(doc) != old_bucket:
+                        hosts_to_compute.add(doc['host'])
+                        Livestate.add_service_bucket(services_states, doc['host'], old_bucket,
+                                                     -1)
+                        Livestate.add_service_bucket(services_states, doc['host'],
+                                                     Livestate.get_service_bucket(doc), 1)
+                changes[resource].setdefault(item_id, {}).update(updates)
+
+        updated = {'service': Livestate.write('service', docs['service'], changes['service'])}
+
+        # Overall state of the hosts, with the services updated
+        missing = [host_id for host_id in hosts_to_compute if host_id not in docs['host']]
+        if missing:
+            for doc in db['host'].find({'_id': {'$in': missing}}):
+                docs['host'][doc['_id']] = doc
+                overall_states[doc['_id']] = doc.get('_overall_state_id')
+        for host_id in hosts_to_compute:
+            if host_id in docs['host']:
+                doc = docs['host'][host_id]
+                host_states = doc.setdefault('_overall_state_services',
+                                             Livestate.empty_services_states())
+                for name, value in iteritems(services_states.get(host_id, {})):
+                    bucket = name.split('.')[1]
+                    host_states[bucket] = host_states.get(bucket, 0) + value
+                doc['_overall_state_id'] = Livestate.get_host_overall_state(doc)
+                if host_id in changes['host'] or \
+                        doc['_overall_state_id'] != overall_states[host_id]:
+                    changes['host'].setdefault(host_id, {})['_overall_state_id'] = \
+                        doc['_overall_state_id']
+        updated['host'] = Livestate.write('host', docs['host'], changes['host'],
+                                          services_states)
+
+        # Overall state of the realms and groups
+        for resource in ['service', 'host']:
+            transitions = []
+            for item_id in changes[resource]:
+                doc = docs[resource][item_id]
+                if doc.get('_overall_state_id') != overall_states[item_id]:
+                    transitions.append((doc, overall_states[item_id], -1))
+                    transitions.append((doc, doc.get('_overall_state_id'), 1))
+            OverallState.update(resource, transitions)
+
+        # Live synthesis, one $inc for each realm and its parent realms
+        Livesynthesis.increment(counters)
+
+        return {'updated': updated, 'issues': issues}
+
+    @staticmethod
+    def write(resource, docs, changes, incs=None):
+        """
+        Write the changes of the items with one bulk write
+
+        The updated fields are no more inherited from the templates and the items get a new
+        _etag, as for a PATCH request. The _updated field is not changed for a live state
+        update.
+
+        :param resource: host or service
+        :type resource: str
+        :param docs: the items, with the changes
+        :type docs: dict
+        :param changes: fields updated for each item
+        :type changes: dict
+        :param incs: counters to increment for each item
+        :type incs: dict
+        :return: number of updated items
+        :rtype: int
+        """
+        requests = []
+        incs = dict((item_id, dict((name, value) for name, value in iteritems(item_incs)
+                                   if value))
+                    for item_id, item_incs in iteritems(incs or {}))
+        for item_id in incs:
+            if incs[item_id] and item_id not in changes:
+                requests.append(UpdateOne({'_id': item_id}, {'$inc': incs[item_id]}))
+        for item_id, updates in iteritems(changes):
+            doc = docs[item_id]
+            unset = {}
+            for field in updates:
+                if field in doc.get('_template_fields', {}):
+                    del doc['_template_fields'][field]
+                    unset['_template_fields.%s' % field] = ''
+            doc.pop('_etag', None)
+            updates['_etag'] = document_etag(doc)
+            doc['_etag'] = updates['_etag']
+            update = {'$set': updates}
+            if unset:
+                update['$unset'] = unset
+            if incs.get(item_id):
+                update['$inc'] = incs[item_id]
+            requests.append(UpdateOne({'_id': item_id}, update))
+        if requests:
+            current_app.data.driver.db[resource].bulk_write(requests, ordered=False)
+        return len(changes)
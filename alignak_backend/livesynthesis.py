@@ -7,217 +7,230 @@
     This module manages the livesynthesis
 """
 from __future__ import print_function
+from datetime import datetime
 import pymongo
+from future.utils import iteritems
 from flask import current_app, g, request, abort, jsonify
-from eve.methods.patch import patch_internal
+from eve.utils import document_etag, str_to_date
+from alignak_backend.livesynthesisretention import LivesynthesisRetention
+from alignak_backend.realmtree import RealmTree
 
 
 class Livesynthesis(object):
     """
         Livesynthesis class
     """
+    # Live synthesis counters of the hosts and the services
+    states = {
+        'hosts': ['up', 'down', 'unreachable'],
+        'services': ['ok', 'warning', 'critical', 'unknown', 'unreachable']
+    }
+
+    @staticmethod
+    def empty_counters():
+        """
+        Get the counters of a realm without hosts and services
+
+        :return: all the counters with a zero value
+        :rtype: dict
+        """
+        counters = {}
+        for type_check, states in Livesynthesis.states.items():
+            for name in ['total', 'acknowledged', 'in_downtime', 'flapping', 'business_impact']:
+                counters['%s_%s' % (type_check, name)] = 0
+            for state in states:
+                counters['%s_%s_hard' % (type_check, state)] = 0
+                counters['%s_%s_soft' % (type_check, state)] = 0
+        return counters
+
+    @staticmethod
+    def get_counters():
+        """
+        Compute the counters of all the realms with one aggregation for the hosts and one
+        for the services
+
+        The hosts / services are grouped by realm, state, state type, acknowledged and
+        downtimed. The state counters do not count the acknowledged hosts / services.
+
+        :return: the computed counters of each realm
+        :rtype: dict
+        """
+        realms = {}
+        for type_check in ['hosts', 'services']:
+            pipeline = [
+                {'$match': {'_is_template': False}},
+                {'$group': {'_id': {'realm': '$_realm', 'state': '$ls_state',
+                                    'state_type': '$ls_state_type',
+                                    'acknowledged': '$ls_acknowledged',
+                                    'downtimed': '$ls_downtimed'},
+                            'count': {'$sum': 1}}}
+            ]
+            collection = current_app.data.driver.db[type_check[:-1]]
+            for group in collection.aggregate(pipeline):
+                key = group['_id']
+                counters = realms.setdefault(key['realm'], Livesynthesis.empty_counters())
+                counters['%s_total' % type_check] += group['count']
+                if key.get('acknowledged'):
+                    counters['%s_acknowledged' % type_check] += group['count']
+                elif key.get('state') and key.get('state_type'):
+                    name = '%s_%s_%s' % (type_check, key['state'].lower(),
+                                         key['state_type'].lower())
+                    if name in counters:
+                        counters[name] += group['count']
+                if key.get('downtimed'):
+                    counters['%s_in_downtime' % type_check] += group['count']
+        return realms
+
+    @staticmethod
+    def get_all_counters(realms, computed):
+        """
+        Compute the counters of each realm and its sub-realms
+
+        :param realms: the realms, with their _tree_parents
+        :type realms: list
+        :param computed: the counters of each realm
+        :type computed: dict
+        :return: the counters of the realm and its sub-realms for each realm
+        :rtype: dict
+        """
+        all_counters = dict((realm['_id'], Livesynthesis.empty_counters()) for realm in realms)
+        for realm in realms:
+            counters = computed.get(realm['_id'])
+            if counters is None:
+                continue
+            for realm_id in [realm['_id']] + realm.get('_tree_parents', []):
+                if realm_id not in all_counters:
+                    continue
+                for name, value in iteritems(counters):
+                    all_counters[realm_id][name] += value
+        return all_counters
+
+    @staticmethod
+    def increment(counters):
+        """
+        Update the live synthesis counters of some realms with one bulk write: the counters of
+        each realm and the counters of the realm and its sub-realms (_all_counters) of the realm
+        and of all its parent realms
+
+        If the live synthesis of a realm does not exist, all the live synthesis are recalculated
+        from the hosts / services, so with the changes already written, instead.
+
+        :param counters: counters delta for each realm
+        :type counters: dict
+        :return: None
+        """
+        livesynthesis_db = current_app.data.driver.db['livesynthesis']
+        counters = dict((realm, realm_counters) for realm, realm_counters in iteritems(counters)
+                        if [value for value in realm_counters.values() if value])
+        if not counters:
+            return
+        if livesynthesis_db.find({'_realm': {'$in': list(counters)}}).count() < len(counters):
+            Livesynthesis.recalculate()
+            return
+
+        tree = RealmTree.get()
+        incs = {}
+        for realm, realm_counters in iteritems(counters):
+            for name, value in iteritems(realm_counters):
+                if not value:
+                    continue
+                inc = incs.setdefault(realm, {})
+                inc[name] = inc.get(name, 0) + value
+                for realm_id in (realm,) + tree.parents.get(realm, ()):
+                    inc = incs.setdefault(realm_id, {})
+                    inc['_all_counters.%s' % name] = \
+                        inc.get('_all_counters.%s' % name, 0) + value
+        livesynthesis_db.bulk_write([pymongo.UpdateOne({'_realm': realm}, {'$inc': inc})
+                                     for realm, inc in iteritems(incs)], ordered=False)
+
     @staticmethod
-    def recalculate():
+    def recalculate(full=False):
         """
-            Recalculate all the live synthesis counters
+        Recalculate all the live synthesis counters
+
+        The live synthesis of a realm is written only if one of its counters (or the counters
+        of the realm and its sub-realms) is wrong, or always if full is True. All the live
+        synthesis are written with one bulk write.
+
+        :param full: write the counters of all the realms
+        :type full: bool
+        :return: number of created / updated live synthesis
+        :rtype: int
         """
         livesynthesis = current_app.data.driver.db['livesynthesis']
-        realmsdrv = current_app.data.driver.db['realm']
-        allrealms = realmsdrv.find()
-        for _, realm in enumerate(allrealms):
-            live_current = livesynthesis.find_one({'_realm': realm['_id']})
+        computed = Livesynthesis.get_counters()
+        existing = dict((live['_realm'], live) for live in livesynthesis.find())
+
+        now = datetime.utcnow().replace(microsecond=0)
+        new_lives = []
+        requests = []
+        realms = list(current_app.data.driver.db['realm'].find({}, {'_tree_parents': 1}))
+        all_counters = Livesynthesis.get_all_counters(realms, computed)
+        for realm in realms:
+            counters = computed.get(realm['_id'], Livesynthesis.empty_counters())
+            counters['_all_counters'] = all_counters[realm['_id']]
+            live_current = existing.get(realm['_id'])
             if live_current is None:
-                data = {
-                    'hosts_total': 0,
-                    'hosts_up_hard': 0,
-                    'hosts_up_soft': 0,
-                    'hosts_down_hard': 0,
-                    'hosts_down_soft': 0,
-                    'hosts_unreachable_hard': 0,
-                    'hosts_unreachable_soft': 0,
-                    'hosts_acknowledged': 0,
-                    'hosts_in_downtime': 0,
-                    'hosts_flapping': 0,
-                    'hosts_business_impact': 0,
-                    'services_total': 0,
-                    'services_ok_hard': 0,
-                    'services_ok_soft': 0,
-                    'services_warning_hard': 0,
-                    'services_warning_soft': 0,
-                    'services_critical_hard': 0,
-                    'services_critical_soft': 0,
-                    'services_unreachable_hard': 0,
-                    'services_unreachable_soft': 0,
-                    'services_unknown_hard': 0,
-                    'services_unknown_soft': 0,
-                    'services_acknowledged': 0,
-                    'services_in_downtime': 0,
-                    'services_flapping': 0,
-                    'services_business_impact': 0,
-                    '_realm': realm['_id']
-                }
-                livesynthesis.insert(data)
-                live_current = livesynthesis.find_one({'_realm': realm['_id']})
-
-            # Update hosts live synthesis
-            hosts = current_app.data.driver.db['host']
-            hosts_count = hosts.find({'_is_template': False, '_realm': realm['_id']}).count()
-            if live_current['hosts_total'] != hosts_count:
-                data = {"hosts_total": hosts_count}
-
-                data['hosts_up_hard'] = hosts.find({
-                    '_is_template': False,
-                    "ls_state": "UP", "ls_state_type": "HARD",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['hosts_down_hard'] = hosts.find({
-                    '_is_template': False,
-                    "ls_state": "DOWN", "ls_state_type": "HARD",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['hosts_unreachable_hard'] = hosts.find({
-                    '_is_template': False,
-                    "ls_state": "UNREACHABLE", "ls_state_type": "HARD",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-
-                data['hosts_up_soft'] = hosts.find({
-                    '_is_template': False,
-                    "ls_state": "UP", "ls_state_type": "SOFT",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['hosts_down_soft'] = hosts.find({
-                    '_is_template': False,
-                    "ls_state": "DOWN", "ls_state_type": "SOFT",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['hosts_unreachable_soft'] = hosts.find({
-                    '_is_template': False,
-                    "ls_state": "UNREACHABLE", "ls_state_type": "SOFT",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-
-                data['hosts_acknowledged'] = hosts.find({
-                    '_is_template': False,
-                    'ls_acknowledged': True, "_realm": realm["_id"]
-                }).count()
-                data['hosts_in_downtime'] = hosts.find({
-                    '_is_template': False, 'ls_downtimed': True, "_realm": realm["_id"]
-                }).count()
-
-                lookup = {"_id": live_current['_id']}
-                patch_internal('livesynthesis', data, False, False, **lookup)
-
-            # Update services live synthesis
-            services = current_app.data.driver.db['service']
-            services_count = services.find({'_is_template': False, '_realm': realm['_id']}).count()
-            if live_current['services_total'] != services_count:
-                data = {"services_total": services_count}
-
-                data['services_ok_hard'] = services.find({
-                    '_is_template': False,
-                    "ls_state": "OK", "ls_state_type": "HARD",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['services_warning_hard'] = services.find({
-                    '_is_template': False,
-                    "ls_state": "WARNING", "ls_state_type": "HARD",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['services_critical_hard'] = services.find({
-                    '_is_template': False,
-                    "ls_state": "CRITICAL", "ls_state_type": "HARD",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['services_unknown_hard'] = services.find({
-                    '_is_template': False,
-                    "ls_state": "UNKNOWN", "ls_state_type": "HARD",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['services_unreachable_hard'] = services.find({
-                    '_is_template': False,
-                    "ls_state": "UNREACHABLE", "ls_state_type": "HARD",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-
-                data['services_ok_soft'] = services.find({
-                    '_is_template': False,
-                    "ls_state": "OK", "ls_state_type": "SOFT",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['services_warning_soft'] = services.find({
-                    '_is_template': False,
-                    "ls_state": "WARNING", "ls_state_type": "SOFT",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['services_critical_soft'] = services.find({
-                    '_is_template': False,
-                    "ls_state": "CRITICAL", "ls_state_type": "SOFT",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['services_unknown_soft'] = services.find({
-                    '_is_template': False,
-                    "ls_state": "UNKNOWN", "ls_state_type": "SOFT",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-                data['services_unreachable_soft'] = services.find({
-                    '_is_template': False,
-                    "ls_state": "UNREACHABLE", "ls_state_type": "SOFT",
-                    "ls_acknowledged": False, "_realm": realm["_id"]
-                }).count()
-
-                data['services_acknowledged'] = services.find({
-                    '_is_template': False,
-                    "ls_acknowledged": True, "_realm": realm["_id"]
-                }).count()
-                data['services_in_downtime'] = services.find({
-                    '_is_template': False,
-                    "ls_downtimed": True, "_realm": realm["_id"]
-                }).count()
-                lookup = {"_id": live_current['_id']}
-                patch_internal('livesynthesis', data, False, False, **lookup)
+                counters['_realm'] = realm['_id']
+                counters['_realm_path'] = RealmTree.get().id_paths.get(realm['_id'])
+                counters['_etag'] = document_etag(counters)
+                counters['_created'] = counters['_updated'] = now
+                new_lives.append(counters)
+                continue
+
+            # The flapping and business impact counters are not computed
+            del counters['hosts_flapping'], counters['hosts_business_impact']
+            del counters['services_flapping'], counters['services_business_impact']
+            if not full and all(live_current.get(name) == value
+                                for name, value in iteritems(counters)):
+                continue
+            live_current.update(counters)
+            live_current.pop('_etag', None)
+            counters['_etag'] = document_etag(live_current)
+            counters['_updated'] = now
+            requests.append(pymongo.UpdateOne({'_id': live_current['_id']}, {'$set': counters}))
+
+        if new_lives:
+            livesynthesis.insert_many(new_lives)
+        if requests:
+            livesynthesis.bulk_write(requests, ordered=False)
+        return len(new_lives) + len(requests)
 
     @staticmethod
     def on_inserted_host(items):
         """
             What to do when an host is inserted in the backend ...
         """
-        livesynthesis_db = current_app.data.driver.db['livesynthesis']
-        for _, item in enumerate(items):
-            if item['_is_template']:
-                continue
-
-            live_current = livesynthesis_db.find_one({'_realm': item['_realm']})
-            if live_current is None:
-                ls = Livesynthesis()
-                ls.recalculate()
-            else:
-                typecheck = 'hosts'
-                data = {"$inc": {"%s_%s_%s" % (typecheck, item['ls_state'].lower(),
-                                               item['ls_state_type'].lower()): 1,
-                                 "%s_total" % (typecheck): 1}}
-                current_app.data.driver.db.livesynthesis.update({'_id': live_current['_id']}, data)
+        Livesynthesis.on_inserted('hosts', items)
 
     @staticmethod
     def on_inserted_service(items):
         """
             What to do when a service is inserted in the backend ...
         """
-        livesynthesis_db = current_app.data.driver.db['livesynthesis']
-        for _, item in enumerate(items):
+        Livesynthesis.on_inserted('services', items)
+
+    @staticmethod
+    def on_inserted(type_check, items):
+        """
+        Count the inserted hosts / services in the live synthesis of their realms
+
+        :param type_check: hosts or services
+        :type type_check: str
+        :param items: the inserted hosts / services
+        :type items: list
+        :return: None
+        """
+        counters = {}
+        for item in items:
             if item['_is_template']:
                 continue
-
-            live_current = livesynthesis_db.find_one({'_realm': item['_realm']})
-            if live_current is None:
-                ls = Livesynthesis()
-                ls.recalculate()
-            else:
-                typecheck = 'services'
-                data = {"$inc": {"%s_%s_%s" % (typecheck, item['ls_state'].lower(),
-                                               item['ls_state_type'].lower()): 1,
-                                 "%s_total" % (typecheck): 1}}
-                current_app.data.driver.db.livesynthesis.update({'_id': live_current['_id']}, data)
+            realm_counters = counters.setdefault(item['_realm'], {})
+            for name in ["%s_%s_%s" % (type_check, item['ls_state'].lower(),
+                                       item['ls_state_type'].lower()),
+                         "%s_total" % type_check]:
+                realm_counters[name] = realm_counters.get(name, 0) + 1
+        Livesynthesis.increment(counters)
 
     @staticmethod
     def on_updated_host(updated, original):
@@ -229,13 +242,7 @@ class Livesynthesis(object):
 
         minus, plus = Livesynthesis.livesynthesis_to_update('hosts', updated, original)
         if minus:
-            livesynthesis_db = current_app.data.driver.db['livesynthesis']
-            live_current = livesynthesis_db.find_one({'_realm': original['_realm']})
-            if live_current is None:
-                ls = Livesynthesis()
-                ls.recalculate()
-            data = {"$inc": {minus: -1, plus: 1}}
-            current_app.data.driver.db.livesynthesis.update({'_id': live_current['_id']}, data)
+            Livesynthesis.increment({original['_realm']: {minus: -1, plus: 1}})
 
     @staticmethod
     def on_updated_service(updated, original):
@@ -247,13 +254,29 @@ class Livesynthesis(object):
 
         minus, plus = Livesynthesis.livesynthesis_to_update('services', updated, original)
         if minus:
-            livesynthesis_db = current_app.data.driver.db['livesynthesis']
-            live_current = livesynthesis_db.find_one({'_realm': original['_realm']})
-            if live_current is None:
-                ls = Livesynthesis()
-                ls.recalculate()
-            data = {"$inc": {minus: -1, plus: 1}}
-            current_app.data.driver.db.livesynthesis.update({'_id': live_current['_id']}, data)
+            Livesynthesis.increment({original['_realm']: {minus: -1, plus: 1}})
+
+    @staticmethod
+    def on_updated_realm(updates, original):
+        """
+            What to do when a realm is updated ...
+
+            When the realm moved in the tree, compute the counters of its former and new
+            parents again. The pre-patch hook modifies the _tree_parents of the original, so
+            check the _parent.
+        """
+        if '_parent' in updates and updates['_parent'] != original.get('_parent'):
+            Livesynthesis.recalculate()
+
+    @staticmethod
+    def on_deleted_item_realm(item):
+        """
+            What to do when a realm is deleted ...
+
+            Delete its live synthesis and compute the counters of its parents again
+        """
+        current_app.data.driver.db['livesynthesis'].delete_many({'_realm': item['_id']})
+        Livesynthesis.recalculate()
 
     @staticmethod
     def livesynthesis_to_update(type_check, updated, original):
@@ -314,70 +337,115 @@ class Livesynthesis(object):
 
         return minus, plus
 
+    @staticmethod
+    def get_date_arg(name):
+        """
+        Get a date parameter of the request: a timestamp or a RFC1123 date
+
+        :param name: name of the parameter
+        :type name: str
+        :return: the date, None if the parameter is not in the request
+        :rtype: datetime or None
+        """
+        value = request.args.get(name)
+        if value is None:
+            return None
+        try:
+            if value.isdigit():
+                return datetime.utcfromtimestamp(int(value))
+            return str_to_date(value).replace(tzinfo=None)
+        except ValueError:
+            abort(400, description='%s must be a timestamp or a RFC1123 date' % name)
+
+    @staticmethod
+    def get_concatenation_realms(realms):
+        """
+        Get the realms whose live synthesis are added for a concatenation: a realm whose all
+        sub-realms are in realms is counted with the counters of the realm and its sub-realms,
+        so its sub-realms are not counted again
+
+        :param realms: the realms, the realm of the live synthesis first
+        :type realms: list
+        :return: list of (realm, True if counted with its sub-realms)
+        :rtype: list
+        """
+        tree = RealmTree.get()
+        access = set(realms)
+        covered = set()
+        concatenation = []
+        for realm in sorted(access, key=lambda realm_id: tree.level.get(realm_id, 0)):
+            if realm in covered:
+                continue
+            children = tree.all_children.get(realm, ())
+            if [child for child in children if child not in access]:
+                concatenation.append((realm, False))
+            else:
+                concatenation.append((realm, True))
+                covered.update(children)
+        return concatenation
+
     @staticmethod
     def on_fetched_item_history(response):
         # pylint: disable=too-many-locals
         """
         Add to response some more information.
         We manage the 2 special parameters:
-         * history
+         * history, with the from, to and resolution parameters
         * concatenation
 
         :param response: the response
         :type response: dict
         :return: None
         """
-        realm_drv = current_app.data.driver.db['realm']
         livesynthesis_db = current_app.data.driver.db['livesynthesis']
-        livesynthesisretention_db = current_app.data.driver.db['livesynthesisretention']
 
         history = request.args.get('history')
         concatenation = request.args.get('concatenation')
 
         if concatenation is not None:
             # get the realm the user have access
-            realm = realm_drv.find_one({'_id': response['_realm']})
-            livesynthesis_id = []
+            tree = RealmTree.get()
             if g.get('back_role_super_admin', False):
-                # no restrictions, we are admin
-                livesynthesis = livesynthesis_db.find({'_realm': {'$in': realm['_all_children']}})
-                for lives in livesynthesis:
-                    livesynthesis_id.append(lives['_id'])
-                    for prop in [x for x in lives if not x.startswith('_')]:
-                        response[prop] += lives[prop]
-
+                # no restrictions, we are admin: the counters of the realm and its sub-realms
+                realms = [(response['_realm'], True)]
             else:
                 resources_get = g.get('resources_get', {})
                 livesynthesis_access = resources_get['livesynthesis']
                 custom_resources = g.get('resources_get_custom', {})
                 if 'livesynthesis' in custom_resources:
                     livesynthesis_access.extend(custom_resources['livesynthesis'])
-                livesynthesis = livesynthesis_db.find({'_realm': {'$in': livesynthesis_access}})
-                for lives in livesynthesis:
-                    if lives['_id'] != response['_id']:
-                        livesynthesis_id.append(lives['_id'])
-                        for prop in [x for x in lives if not x.startswith('_')]:
-                            response[prop] += lives[prop]
+                realms = Livesynthesis.get_concatenation_realms(
+                    [response['_realm']] + list(livesynthesis_access))
+
+            # all the counted realms, to concatenate the history
+            all_realms = []
+            for realm, sub_realms in realms:
+                all_realms.append(realm)
+                if sub_realms:
+                    all_realms.extend(tree.all_children.get(realm, ()))
+            counted = dict(realms)
+            props = [x for x in response if not x.startswith('_')]
+            for prop in props:
+                response[prop] = 0
+            for lives in livesynthesis_db.find({'_realm': {'$in': list(counted)}}):
+                counters = lives.get('_all_counters', {}) if counted[lives['_realm']] else lives
+                for prop in props:
+                    response[prop] += counters.get(prop, 0)
 
         if history is not None:
-            response['history'] = []
-            lsretentions = livesynthesisretention_db.find({'livesynthesis': response['_id']}).sort(
-                '_created', pymongo.DESCENDING)
-            for lsretention in lsretentions:
-                for prop in ['livesynthesis', '_id', '_updated', '_etag']:
-                    if prop in lsretention:
-                        del lsretention[prop]
-                for prop in lsretention:
-                    if not prop == '_created':
-                        lsretention[prop] = int(lsretention[prop])
-                response['history'].append(lsretention)
+            date_from = Livesynthesis.get_date_arg('from')
+            date_to = Livesynthesis.get_date_arg('to')
+            try:
+                resolution = int(request.args.get('resolution', 0))
+            except ValueError:
+                abort(400, description='resolution must be a number of seconds')
+            livesynthesis_ids = [response['_id']]
             if concatenation is not None:
-                for ls_id in livesynthesis_id:
-                    lsretentions = livesynthesisretention_db.find({'livesynthesis': ls_id}).sort(
-                        '_created', pymongo.DESCENDING)
-                num = 0
-                for lsretention in lsretentions:
-                    for prop in lsretention:
-                        if not prop.startswith('_') and prop != 'livesynthesis':
-                            response['history'][num][prop] += lsretention[prop]
-                    num += 1
+                livesynthesis_ids += [lives['_id'] for lives in livesynthesis_db.find(
+                    {'_realm': {'$in': all_realms}, '_id': {'$ne': response['_id']}}, {'_id': 1})]
+            columns = LivesynthesisRetention.get_columns(livesynthesis_ids, date_from, date_to,
+                                                         resolution)
+            if history == 'columns':
+                response['history'] = columns
+            else:
+                response['history'] = LivesynthesisRetention.get_rows(columns)
@@ -0,0 +1,557 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.livesynthesisretention`` module
+
+    This module manages the history of the livesynthesis
+"""
+from __future__ import print_function
+import calendar
+from datetime import datetime, timedelta
+from future.utils import iteritems, string_types
+from eve.utils import str_to_date
+from flask import current_app
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from alignak_backend.models import livesynthesis
+
+
+class LivesynthesisRetention(object):
+    """
+        LivesynthesisRetention class
+
+        The history of a live synthesis is stored in buckets: one document per live synthesis,
+        per resolution and per period of 60 samples, with an array of 60 integers for each
+        counter. A sample is written with a $set at its offset in its bucket.
+
+        The samples of the cron (one per minute) are the first tier of the history, the other
+        tiers (LIVESYNTHESIS_HISTORY_TIERS) have a lower resolution: their samples are computed
+        from the samples of the previous tier by rollup, with the last, minimum and maximum
+        value of each counter.
+
+        The former documents (one per live synthesis and per minute) are moved to the buckets
+        by migrate.
+    """
+    # pylint: disable=too-many-public-methods
+    # Duration of a sample of the first tier (seconds)
+    resolution = 60
+    # Number of samples in a bucket
+    slots = 60
+
+    @staticmethod
+    def get_counters_names():
+        """
+        Get the names of the live synthesis counters
+
+        :return: sorted names of the counters
+        :rtype: list
+        """
+        return sorted([name for name in livesynthesis.get_schema()['schema']
+                       if not name.startswith('_')])
+
+    @staticmethod
+    def get_tiers():
+        """
+        Get the history tiers: the first one (a sample each minute, kept
+        SCHEDULER_LIVESYNTHESIS_HISTORY minutes) and the LIVESYNTHESIS_HISTORY_TIERS ones
+
+        :return: list of (resolution, retention) in seconds, the finest resolution first
+        :rtype: list
+        """
+        tiers = [(LivesynthesisRetention.resolution,
+                  current_app.config.get('SCHEDULER_LIVESYNTHESIS_HISTORY', 0) * 60)]
+        for resolution, minutes in current_app.config.get('LIVESYNTHESIS_HISTORY_TIERS', []):
+            tiers.append((int(resolution), int(minutes) * 60))
+        return sorted(tiers)
+
+    @staticmethod
+    def get_timestamp(date):
+        """
+        Get the timestamp of an UTC date
+
+        :param date: the date
+        :type date: datetime
+        :return: number of seconds since the epoch
+        :rtype: int
+        """
+        return calendar.timegm(date.utctimetuple())
+
+    @staticmethod
+    def get_bucket(date, resolution=None):
+        """
+        Get the bucket of a sample date
+
+        :param date: date of the sample
+        :type date: datetime
+        :param resolution: resolution of the samples (seconds)
+        :type resolution: int
+        :return: start date of the bucket, offset of the sample in the bucket
+        :rtype: tuple
+        """
+        resolution = resolution or LivesynthesisRetention.resolution
+        span = resolution * LivesynthesisRetention.slots
+        timestamp = LivesynthesisRetention.get_timestamp(date)
+        start = timestamp - timestamp % span
+        return datetime.utcfromtimestamp(start), (timestamp - start) // resolution
+
+    @staticmethod
+    def create_indexes():
+        """
+        Create the indexes of the buckets: to get the history and to expire the buckets
+
+        :return: None
+        """
+        retention_db = current_app.data.driver.db['livesynthesisretention']
+        retention_db.create_index(
+            [('livesynthesis', ASCENDING), ('resolution', ASCENDING), ('start', ASCENDING)])
+        retention_db.create_index([('resolution', ASCENDING), ('end', ASCENDING)])
+
+    @staticmethod
+    def add(samples, resolution=None):
+        """
+        Write some samples in their buckets with one bulk write
+
+        The samples of the rollup tiers have the minimum and maximum values of the counters.
+
+        :param samples: list of (livesynthesis id, date, counters values) or
+                        (livesynthesis id, date, last values, minimum values, maximum values)
+        :type samples: list
+        :param resolution: resolution of the samples (seconds), the first tier if None
+        :type resolution: int
+        :return: number of written samples
+        :rtype: int
+        """
+        resolution = resolution or LivesynthesisRetention.resolution
+        names = LivesynthesisRetention.get_counters_names()
+        slots = LivesynthesisRetention.slots
+        requests = []
+        for sample in samples:
+            start, offset = LivesynthesisRetention.get_bucket(sample[1], resolution)
+            search = {'livesynthesis': sample[0], 'resolution': resolution, 'start': start}
+            # Create the bucket with the arrays of all the counters
+            bucket = {
+                'end': start + timedelta(seconds=resolution * slots),
+                'samples': [],
+                'counters': dict((name, [0] * slots) for name in names)
+            }
+            fields = [('counters', sample[2])]
+            if resolution != LivesynthesisRetention.resolution:
+                bucket['min'] = dict((name, [0] * slots) for name in names)
+                bucket['max'] = dict((name, [0] * slots) for name in names)
+                fields += [('min', sample[3]), ('max', sample[4])]
+            requests.append(UpdateOne(search, {'$setOnInsert': bucket}, upsert=True))
+            values = {}
+            for field, field_values in fields:
+                values.update(('%s.%s.%d' % (field, name, offset), int(field_values.get(name, 0)))
+                              for name in names)
+            requests.append(UpdateOne(search, {'$set': values,
+                                               '$addToSet': {'samples': offset}}))
+        if requests:
+            current_app.data.driver.db['livesynthesisretention'].bulk_write(requests,
+                                                                            ordered=True)
+        return len(samples)
+
+    @staticmethod
+    def get_samples(search, date_from=None, date_to=None):
+        """
+        Get the samples of the buckets
+
+        :param search: search of the buckets
+        :type search: dict
+        :param date_from: date of the first sample
+        :type date_from: datetime
+        :param date_to: date after the last sample
+        :type date_to: datetime
+        :return: list of (livesynthesis id, date, bucket, offset), the most recent first
+        :rtype: list
+        """
+        search = dict(search)
+        if date_from is not None:
+            search['end'] = {'$gt': date_from}
+        if date_to is not None:
+            search['start'] = {'$lt': date_to}
+        samples = []
+        retention_db = current_app.data.driver.db['livesynthesisretention']
+        for bucket in retention_db.find(search).sort('start', DESCENDING):
+            start = bucket['start'].replace(tzinfo=None)
+            for offset in sorted(bucket['samples'], reverse=True):
+                date = start + timedelta(seconds=offset * bucket['resolution'])
+                if (date_from is None or date >= date_from) and \
+                        (date_to is None or date < date_to):
+                    samples.append((bucket['livesynthesis'], date, bucket, offset))
+        return samples
+
+    @staticmethod
+    def get_columns(livesynthesis_ids, date_from=None, date_to=None, resolution=None):
+        """
+        Get the history of a live synthesis, the most recent sample first, with the sum of the
+        history of some other live synthesis (concatenation of the sub-realms)
+
+        The tier of the history is the finest one with a resolution of at least resolution
+        and keeping the samples since date_from. The samples of the former documents which
+        are not migrated yet are included in the first tier.
+
+        The buckets of all the live synthesis are got with one query, see get_buckets and
+        concatenate.
+
+        :param livesynthesis_ids: id of the live synthesis, then the ids of the added ones
+        :type livesynthesis_ids: list
+        :param date_from: date of the first sample, all the samples if None
+        :type date_from: datetime
+        :param date_to: date after the last sample, until now if None
+        :type date_to: datetime
+        :param resolution: minimum duration of a sample (seconds)
+        :type resolution: int
+        :return: dates of the samples (_created) and an array of values for each counter,
+                 with the minimum (_min) and maximum (_max) values for the rollup tiers
+        :rtype: dict
+        """
+        resolution = LivesynthesisRetention.get_resolution(date_from, resolution)
+        fields = ['counters']
+        if resolution != LivesynthesisRetention.resolution:
+            fields += ['min', 'max']
+        buckets = LivesynthesisRetention.get_buckets(livesynthesis_ids, resolution, date_from,
+                                                     date_to)
+        return LivesynthesisRetention.concatenate(buckets, livesynthesis_ids, fields,
+                                                  resolution, (date_from, date_to))
+
+    @staticmethod
+    def get_buckets(livesynthesis_ids, resolution, date_from=None, date_to=None):
+        """
+        Get the buckets of the history of some live synthesis with one query
+
+        The samples of the former history documents which are not migrated yet are put in
+        buckets of the first tier.
+
+        :param livesynthesis_ids: ids of the live synthesis
+        :type livesynthesis_ids: list
+        :param resolution: resolution of the history (seconds)
+        :type resolution: int
+        :param date_from: date of the first sample
+        :type date_from: datetime
+        :param date_to: date after the last sample
+        :type date_to: datetime
+        :return: for each bucket start (timestamp), the bucket of each live synthesis
+        :rtype: dict
+        """
+        search = {'livesynthesis': {'$in': list(livesynthesis_ids)}, 'resolution': resolution}
+        if date_from is not None:
+            search['end'] = {'$gt': date_from}
+        if date_to is not None:
+            search['start'] = {'$lt': date_to}
+        buckets = {}
+        retention_db = current_app.data.driver.db['livesynthesisretention']
+        for bucket in retention_db.find(search):
+            start = LivesynthesisRetention.get_timestamp(bucket['start'])
+            buckets.setdefault(start, {})[bucket['livesynthesis']] = bucket
+        if resolution == LivesynthesisRetention.resolution:
+            LivesynthesisRetention.add_former_samples(buckets, livesynthesis_ids, date_from,
+                                                      date_to)
+        return buckets
+
+    @staticmethod
+    def add_former_samples(buckets, livesynthesis_ids, date_from=None, date_to=None):
+        """
+        Put the samples of the former history documents which are not migrated yet in buckets
+        of the first tier
+
+        :param buckets: for each bucket start (timestamp), the bucket of each live synthesis
+        :type buckets: dict
+        :param livesynthesis_ids: ids of the live synthesis
+        :type livesynthesis_ids: list
+        :param date_from: date of the first sample
+        :type date_from: datetime
+        :param date_to: date after the last sample
+        :type date_to: datetime
+        :return: None
+        """
+        names = LivesynthesisRetention.get_counters_names()
+        for ls_id, date, values in LivesynthesisRetention.get_former_samples(
+                livesynthesis_ids, date_from, date_to):
+            start, offset = LivesynthesisRetention.get_bucket(date)
+            bucket = buckets.setdefault(LivesynthesisRetention.get_timestamp(start), {}) \
+                .setdefault(ls_id, {'samples': [], 'counters': dict(
+                    (name, [0] * LivesynthesisRetention.slots) for name in names)})
+            bucket['samples'].append(offset)
+            for name, value in zip(names, values):
+                bucket['counters'][name][offset] = value
+
+    @staticmethod
+    def get_former_samples(livesynthesis_ids, date_from=None, date_to=None):
+        """
+        Get the samples of the former history documents which are not migrated yet
+
+        :param livesynthesis_ids: ids of the live synthesis
+        :type livesynthesis_ids: list
+        :param date_from: date of the first sample
+        :type date_from: datetime
+        :param date_to: date after the last sample
+        :type date_to: datetime
+        :return: list of (livesynthesis id, date, values of the counters)
+        :rtype: list
+        """
+        names = LivesynthesisRetention.get_counters_names()
+        samples = []
+        retention_db = current_app.data.driver.db['livesynthesisretention']
+        for item in retention_db.find({'livesynthesis': {'$in': list(livesynthesis_ids)},
+                                       'start': {'$exists': False}}):
+            date = LivesynthesisRetention.get_created(item)
+            if (date_from is None or date >= date_from) and (date_to is None or date < date_to):
+                samples.append((item['livesynthesis'], date,
+                                [int(item.get(name, 0)) for name in names]))
+        return samples
+
+    @staticmethod
+    def concatenate(buckets, livesynthesis_ids, fields, resolution, period=(None, None)):
+        """
+        Get the history of the first live synthesis, with the sum of the history of the other
+        ones
+
+        The buckets of all the live synthesis start at the same dates, so the samples at the
+        same offset are at the same date: for each bucket of the first live synthesis, the
+        arrays of the other buckets starting at the same date are summed, and the sums are
+        read at the offsets of the samples of the first live synthesis. The counters of a
+        bucket are 0 where it has no sample.
+
+        :param buckets: for each bucket start (timestamp), the bucket of each live synthesis
+        :type buckets: dict
+        :param livesynthesis_ids: id of the live synthesis, then the ids of the added ones
+        :type livesynthesis_ids: list
+        :param fields: fields of the buckets (counters, and min and max for the rollup tiers)
+        :type fields: list
+        :param resolution: resolution of the history (seconds)
+        :type resolution: int
+        :param period: date of the first sample and date after the last sample, None for no
+                       limit
+        :type period: tuple
+        :return: dates of the samples (_created) and an array of values for each counter,
+                 with the minimum (_min) and maximum (_max) values for the rollup tiers
+        :rtype: dict
+        """
+        # pylint: disable=too-many-locals
+        names = LivesynthesisRetention.get_counters_names()
+        period = [LivesynthesisRetention.get_timestamp(date) if date is not None else None
+                  for date in period]
+        zeros = [0] * LivesynthesisRetention.slots
+
+        dates = []
+        totals = dict((field, dict((name, []) for name in names)) for field in fields)
+        for start in sorted(buckets, reverse=True):
+            if livesynthesis_ids[0] not in buckets[start]:
+                continue
+            offsets = LivesynthesisRetention.get_offsets(buckets[start][livesynthesis_ids[0]],
+                                                         start, resolution, period)
+            if not offsets:
+                continue
+            dates.extend(datetime.utcfromtimestamp(start + offset * resolution)
+                         for offset in offsets)
+            items = [buckets[start][ls_id] for ls_id in livesynthesis_ids
+                     if ls_id in buckets[start]]
+            for field in fields:
+                for name in names:
+                    sums = LivesynthesisRetention.add_arrays(
+                        [item.get(field, {}).get(name) or zeros for item in items])
+                    totals[field][name].extend(int(sums[offset]) for offset in offsets)
+
+        columns = {'_created': dates}
+        columns.update(totals['counters'])
+        for field in fields[1:]:
+            columns['_%s' % field] = totals[field]
+        return columns
+
+    @staticmethod
+    def get_offsets(bucket, start, resolution, period):
+        """
+        Get the offsets of the samples of a bucket in a period, the most recent first
+
+        :param bucket: the bucket
+        :type bucket: dict
+        :param start: start of the bucket (timestamp)
+        :type start: int
+        :param resolution: resolution of the history (seconds)
+        :type resolution: int
+        :param period: timestamp of the first sample and timestamp after the last sample,
+                       None for no limit
+        :type period: list
+        :return: the offsets
+        :rtype: list
+        """
+        return [offset for offset in sorted(set(bucket['samples']), reverse=True)
+                if (period[0] is None or start + offset * resolution >= period[0]) and
+                (period[1] is None or start + offset * resolution < period[1])]
+
+    @staticmethod
+    def add_arrays(arrays):
+        """
+        Sum some arrays of values, element-wise
+
+        :param arrays: arrays of the same length
+        :type arrays: list
+        :return: the sums
+        :rtype: list
+        """
+        if len(arrays) == 1:
+            return arrays[0]
+        return [sum(values) for values in zip(*arrays)]
+
+    @staticmethod
+    def get_resolution(date_from=None, resolution=None):
+        """
+        Get the resolution of the tier to use for an history since date_from: the finest tier
+        with a resolution of at least resolution which keeps the samples since date_from, or
+        the tier with the longest retention
+
+        :param date_from: date of the first sample
+        :type date_from: datetime
+        :param resolution: minimum duration of a sample (seconds)
+        :type resolution: int
+        :return: resolution of the tier
+        :rtype: int
+        """
+        tiers = LivesynthesisRetention.get_tiers()
+        candidates = [tier for tier in tiers if tier[0] >= (resolution or 0)] or tiers[-1:]
+        if date_from is not None:
+            age = (datetime.utcnow() - date_from).total_seconds()
+            covering = [tier for tier in candidates if not tier[1] or tier[1] >= age]
+            if not covering:
+                return max(candidates, key=lambda tier: tier[1])[0]
+            candidates = covering
+        return candidates[0][0]
+
+    @staticmethod
+    def rollup(now=None):
+        """
+        Compute the samples of the rollup tiers (current and previous period) from the samples
+        of the previous tier, with one query and one bulk write for each tier
+
+        :param now: current date
+        :type now: datetime
+        :return: number of written samples
+        :rtype: int
+        """
+        now = now or datetime.utcnow()
+        tiers = LivesynthesisRetention.get_tiers()
+        count = 0
+        for (source, _), (resolution, _) in zip(tiers[:-1], tiers[1:]):
+            timestamp = LivesynthesisRetention.get_timestamp(now)
+            periods = {}
+            for ls_id, date, bucket, offset in LivesynthesisRetention.get_samples(
+                    {'resolution': source},
+                    datetime.utcfromtimestamp(timestamp - timestamp % resolution - resolution)):
+                timestamp = LivesynthesisRetention.get_timestamp(date)
+                period = periods.setdefault((ls_id, timestamp - timestamp % resolution), [])
+                period.append((bucket, offset))
+
+            samples = []
+            for (ls_id, period), items in iteritems(periods):
+                samples.append((ls_id, datetime.utcfromtimestamp(period)) +
+                               LivesynthesisRetention.get_rollup_values(items))
+            count += LivesynthesisRetention.add(samples, resolution)
+        return count
+
+    @staticmethod
+    def get_rollup_values(items):
+        """
+        Get the last, minimum and maximum values of the counters of some samples
+
+        :param items: list of (bucket, offset) of the samples, the most recent first
+        :type items: list
+        :return: last values, minimum values, maximum values
+        :rtype: tuple
+        """
+        names = LivesynthesisRetention.get_counters_names()
+        last = dict((name, items[0][0]['counters'][name][items[0][1]]) for name in names)
+        minimum = {}
+        maximum = {}
+        for name in names:
+            minimum[name] = min(bucket.get('min', bucket['counters'])[name][offset]
+                                for bucket, offset in items)
+            maximum[name] = max(bucket.get('max', bucket['counters'])[name][offset]
+                                for bucket, offset in items)
+        return last, minimum, maximum
+
+    @staticmethod
+    def expire(now=None):
+        """
+        Delete the buckets whose all samples are older than the history of their tier, with one
+        delete using the (resolution, end) index
+
+        The former history documents are not deleted here: they are moved to the buckets by
+        migrate when the backend starts, and searching them has no index.
+
+        :param now: current date
+        :type now: datetime
+        :return: number of deleted documents
+        :rtype: int
+        """
+        now = now or datetime.utcnow()
+        search = []
+        for resolution, retention in LivesynthesisRetention.get_tiers():
+            if retention <= 0:
+                continue
+            search.append({'resolution': resolution,
+                           'end': {'$lt': now - timedelta(seconds=retention)}})
+        if not search:
+            return 0
+        return current_app.data.driver.db['livesynthesisretention'].delete_many(
+            {'$or': search}).deleted_count
+
+    @staticmethod
+    def get_rows(columns):
+        """
+        Get the samples of a columnar history
+
+        :param columns: dates of the samples (_created) and values of each counter
+        :type columns: dict
+        :return: list of samples, each one with its date and the value of each counter (and
+                 the minimum and maximum values for the rollup tiers)
+        :rtype: list
+        """
+        names = [name for name in columns if not name.startswith('_')]
+        rows = []
+        for index, date in enumerate(columns['_created']):
+            row = dict([('_created', date)] + [(name, columns[name][index]) for name in names])
+            for field in ['_min', '_max']:
+                if field in columns:
+                    row[field] = dict((name, columns[field][name][index]) for name in names)
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def get_created(item):
+        """
+        Get the date of a former history document
+
+        :param item: the history document
+        :type item: dict
+        :return: the creation date
+        :rtype: datetime
+        """
+        created = item.get('_created')
+        if isinstance(created, string_types):
+            created = str_to_date(created)
+        return (created or datetime.utcnow()).replace(tzinfo=None)
+
+    @staticmethod
+    def migrate(batch=1000):
+        """
+        Move the former history documents (one per live synthesis and per minute) to the
+        buckets
+
+        :param batch: number of documents moved at once
+        :type batch: int
+        :return: number of moved documents
+        :rtype: int
+        """
+        retention_db = current_app.data.driver.db['livesynthesisretention']
+        LivesynthesisRetention.create_indexes()
+        count = 0
+        while True:
+            items = list(retention_db.find({'start': {'$exists': False}}).limit(batch))
+            if not items:
+                return count
+            LivesynthesisRetention.add([(item['livesynthesis'],
+                                         LivesynthesisRetention.get_created(item), item)
+                                        for item in items if item.get('livesynthesis')])
+            retention_db.delete_many({'_id': {'$in': [item['_id'] for item in items]}})
+            count += len(items)
@@ -1,16 +1,37 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-Main
+Usage:
+    alignak-backend
+    alignak-backend <command> [--full]
+    alignak-backend -h | --help
+
+Without command, the backend is started.
+
+Options:
+    --full                   Rewrite all the computed data (livesynthesis_recalculate command)
+
+Commands:
+%s
 """
-from alignak_backend.app import app
+import sys
+from docopt import docopt
+from alignak_backend.app import app, _subcommands
 
 
 def main():
     """
     Main function
     """
-    app.run()
+    usage = __doc__ % '\n'.join(['    %-24s %s' % (name, description)
+                                 for name, (description, _) in _subcommands.items()])
+    args = docopt(usage)
+    if args['<command>'] is None:
+        app.run()
+    elif args['<command>'] in _subcommands:
+        _subcommands[args['<command>']][1](args)
+    else:
+        sys.exit(usage)
 
 if __name__ == "__main__":  # pragma: no cover
     main()
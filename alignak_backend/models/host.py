@@ -552,6 +552,12 @@ def get_schema():
                 'type': 'integer',
                 'default': 3
             },
+            # Number of the host services in an HARD state for each overall state
+            '_overall_state_services': {
+                'type': 'dict',
+                'readonly': True,
+                'default': {'0': 0, '1': 0, '2': 0, '3': 0, '4': 0}
+            },
 
             '_realm': {
                 'type': 'objectid',
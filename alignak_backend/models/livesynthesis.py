@@ -136,6 +136,11 @@ def get_schema():
                 'type': 'integer',
                 'default': 0
             },
+            # Counters of the realm and its sub-realms
+            '_all_counters': {
+                'type': 'dict',
+                'default': {}
+            },
             '_realm': {
                 'type': 'objectid',
                 'data_relation': {
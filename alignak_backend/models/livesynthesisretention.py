@@ -19,13 +19,16 @@ def get_schema():
     """
     Schema structure of this resource
 
-    For an element type and a state, store values computed from the hosts/services livestate:
-    - a counter containing the number of element_type in the state
-    - a percentage of element_type in the state
-    - a counter containing the number of element_type in the state and acknowledged
-    - a counter containing the number of element_type in the state and in downtime
-    - a counter containing the number of element_type in the state and flapping
-    - the maximum business impact of the element_type in the state
+    The history of a live synthesis is stored in buckets: one document for each history tier
+    and each period of 60 samples of the tier resolution (one hour for the first tier, with a
+    sample each minute):
+    - start and end dates of the bucket
+    - resolution: duration of a sample (seconds)
+    - samples: offsets of the recorded samples in the bucket
+    - counters: an array of integers for each live synthesis counter, the value of a sample is
+      at its offset
+    - min, max: for the rollup tiers, an array of integers for each live synthesis counter with
+      the minimum and maximum values of the samples of the previous tier
 
     :return: schema dictionary
     :rtype: dict
@@ -33,116 +36,41 @@ def get_schema():
     return {
         'internal_resource': True,
         'schema': {
-            'hosts_total': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'hosts_up_hard': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'hosts_up_soft': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'hosts_down_hard': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'hosts_down_soft': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'hosts_unreachable_hard': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'hosts_unreachable_soft': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'hosts_acknowledged': {
-                'type': 'integer',
-                'default': 0
-            },
-            'hosts_in_downtime': {
-                'type': 'integer',
-                'default': 0
-            },
-            'hosts_flapping': {
-                'type': 'integer',
-                'default': 0
-            },
-            'hosts_business_impact': {
-                'type': 'integer',
-                'default': 0
-            },
-            'services_total': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'services_ok_hard': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'services_ok_soft': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'services_warning_hard': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'services_warning_soft': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'services_critical_hard': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'services_critical_soft': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'services_unknown_hard': {
-                'type': 'integer',
-                'default': 0,
-            },
-            'services_unknown_soft': {
-                'type': 'integer',
-                'default': 0,
+            'livesynthesis': {
+                'type': 'objectid',
+                'data_relation': {
+                    'resource': 'livesynthesis',
+                },
+                'required': True,
             },
-            'services_unreachable_hard': {
-                'type': 'integer',
-                'default': 0,
+            'start': {
+                'type': 'datetime',
+                'required': True,
             },
-            'services_unreachable_soft': {
-                'type': 'integer',
-                'default': 0,
+            'end': {
+                'type': 'datetime',
+                'required': True,
             },
-            'services_acknowledged': {
+            'resolution': {
                 'type': 'integer',
-                'default': 0
+                'default': 60
             },
-            'services_in_downtime': {
-                'type': 'integer',
-                'default': 0
+            'samples': {
+                'type': 'list',
+                'schema': {
+                    'type': 'integer'
+                },
+                'default': []
             },
-            'services_flapping': {
-                'type': 'integer',
-                'default': 0
+            'counters': {
+                'type': 'dict',
+                'default': {}
             },
-            'services_business_impact': {
-                'type': 'integer',
-                'default': 0
+            'min': {
+                'type': 'dict'
             },
-            'livesynthesis': {
-                'type': 'objectid',
-                'data_relation': {
-                    'resource': 'livesynthesis',
-                },
-                'required': True,
+            'max': {
+                'type': 'dict'
             }
         }
     }
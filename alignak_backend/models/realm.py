@@ -106,6 +106,16 @@ def get_schema():
                 },
                 'default': []
             },
+            # Worst overall state of the hosts of the realm and its sub-realms
+            '_overall_state_id': {
+                'type': 'integer',
+                'default': 0
+            },
+            # Number of the hosts of the realm and its sub-realms for each overall state
+            '_overall_state_counts': {
+                'type': 'dict',
+                'default': {'0': 0, '1': 0, '2': 0, '3': 0, '4': 0}
+            },
             '_children': {
                 'type': 'list',
                 'schema': {
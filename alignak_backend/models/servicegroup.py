@@ -98,6 +98,16 @@ def get_schema():
                 },
                 'default': []
             },
+            # Worst overall state of the services of the group and its sub-groups
+            '_overall_state_id': {
+                'type': 'integer',
+                'default': 0
+            },
+            # Number of the services of the group and its sub-groups for each overall state
+            '_overall_state_counts': {
+                'type': 'dict',
+                'default': {'0': 0, '1': 0, '2': 0, '3': 0, '4': 0}
+            },
             '_realm': {
                 'type': 'objectid',
                 'data_relation': {
@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.overallstate`` module
+
+    This module manages the overall state of the realms, hostgroups and servicegroups
+"""
+from __future__ import print_function
+from future.utils import iteritems
+from flask import current_app
+from pymongo import UpdateOne
+
+
+class OverallState(object):
+    """
+        OverallState class
+
+        The realms, hostgroups and servicegroups count their hosts / services for each overall
+        state in the _overall_state_counts field, and their _overall_state_id is the worst
+        overall state of their hosts / services. The hosts / services of the sub-realms and
+        sub-groups are counted in all their parents (_tree_parents).
+
+        The counters are updated with $inc when the overall state of an host / service changes
+        and when the members of a group change. The recalculate method computes them again from
+        the hosts and services.
+    """
+    # pylint: disable=too-many-public-methods
+    # Groups of each resource: group resource, field of the group with its members
+    # (None for the realm of the item)
+    groups = {
+        'host': [('realm', None), ('hostgroup', 'hosts')],
+        'service': [('servicegroup', 'services')],
+    }
+
+    @staticmethod
+    def empty_counts():
+        """
+        Get the _overall_state_counts of a group without hosts / services
+
+        :return: a zero counter for each overall state
+        :rtype: dict
+        """
+        return dict((str(state), 0) for state in range(5))
+
+    @staticmethod
+    def get_overall_state(counts):
+        """
+        Get the overall state of a group: the worst overall state of its hosts / services
+
+        :param counts: number of hosts / services for each overall state
+        :type counts: dict
+        :return: the overall state, 0 if the group is empty
+        :rtype: int
+        """
+        for state in range(4, 0, -1):
+            if counts.get(str(state), 0) > 0:
+                return state
+        return 0
+
+    @staticmethod
+    def add(counters, group_resource, group, state, value):
+        """
+        Count an host / service in a group and in all its parents
+
+        :param counters: counters delta for each group of each group resource
+        :type counters: dict
+        :param group_resource: realm, hostgroup or servicegroup
+        :type group_resource: str
+        :param group: the group (with its _tree_parents)
+        :type group: dict
+        :param state: overall state of the host / service
+        :type state: int
+        :param value: 1 to add the host / service, -1 to remove it
+        :type value: int
+        :return: None
+        """
+        name = '_overall_state_counts.%s' % state
+        resource_counters = counters.setdefault(group_resource, {})
+        for group_id in [group['_id']] + group.get('_tree_parents', []):
+            group_counters = resource_counters.setdefault(group_id, {})
+            group_counters[name] = group_counters.get(name, 0) + value
+
+    @staticmethod
+    def update(resource, changes):
+        """
+        Update the counters of the groups of some hosts / services
+
+        An overall state change is the removal of the original item with its old state and
+        the addition of the updated item with its new state.
+
+        :param resource: host or service
+        :type resource: str
+        :param changes: list of (item, overall state, 1 to add it / -1 to remove it)
+        :type changes: list
+        :return: None
+        """
+        changes = [(item, state, value) for item, state, value in changes
+                   if state is not None and not item.get('_is_template', False)]
+        if not changes:
+            return
+        db = current_app.data.driver.db
+        counters = {}
+        for group_resource, field in OverallState.groups[resource]:
+            projection = {'_tree_parents': 1}
+            if field is None:
+                search = {'_id': {'$in': list({item.get('_realm') for item, _, _ in changes})}}
+            else:
+                projection[field] = 1
+                search = {field: {'$in': list({item['_id'] for item, _, _ in changes})}}
+            groups = list(db[group_resource].find(search, projection))
+            for item, state, value in changes:
+                for group in groups:
+                    if (field is None and group['_id'] == item.get('_realm')) or \
+                            (field is not None and item['_id'] in group.get(field, [])):
+                        OverallState.add(counters, group_resource, group, state, value)
+        OverallState.write(counters)
+
+    @staticmethod
+    def update_members(group_resource, group, members, value):
+        """
+        Count (or no more count) some hosts / services in a group and its parents
+
+        :param group_resource: hostgroup or servicegroup
+        :type group_resource: str
+        :param group: the group (with its _tree_parents)
+        :type group: dict
+        :param members: ids of the hosts / services
+        :type members: list
+        :param value: 1 to add the hosts / services, -1 to remove them
+        :type value: int
+        :return: None
+        """
+        if not members:
+            return
+        resource = 'host' if group_resource == 'hostgroup' else 'service'
+        counters = {}
+        search = {'_id': {'$in': list(members)}, '_is_template': False}
+        for item in current_app.data.driver.db[resource].find(search, {'_overall_state_id': 1}):
+            OverallState.add(counters, group_resource, group, item['_overall_state_id'], value)
+        OverallState.write(counters)
+
+    @staticmethod
+    def write(counters):
+        """
+        Increment the counters of the groups, then set the overall state of the groups whose
+        worst state changed
+
+        :param counters: counters delta for each group of each group resource
+        :type counters: dict
+        :return: None
+        """
+        db = current_app.data.driver.db
+        for group_resource, resource_counters in iteritems(counters):
+            requests = []
+            for group_id, group_counters in iteritems(resource_counters):
+                inc = dict((name, value) for name, value in iteritems(group_counters) if value)
+                if inc:
+                    requests.append(UpdateOne({'_id': group_id}, {'$inc': inc}))
+            if not requests:
+                continue
+            db[group_resource].bulk_write(requests, ordered=False)
+
+            requests = []
+            search = {'_id': {'$in': list(resource_counters)}}
+            projection = {'_overall_state_id': 1, '_overall_state_counts': 1}
+            for group in db[group_resource].find(search, projection):
+                overall_state = OverallState.get_overall_state(
+                    group.get('_overall_state_counts') or {})
+                if overall_state != group.get('_overall_state_id'):
+                    requests.append(UpdateOne({'_id': group['_id']},
+                                              {'$set': {'_overall_state_id': overall_state}}))
+            if requests:
+                db[group_resource].bulk_write(requests, ordered=False)
+
+    @staticmethod
+    def get_members_counts(resource, field, groups):
+        """
+        Count the hosts / services of each group (without its sub-groups) for each overall
+        state. The hosts / services of the realms are counted with an aggregation.
+
+        :param resource: host or service
+        :type resource: str
+        :param field: field of the group with its members, None for the realm
+        :type field: str or None
+        :param groups: the groups
+        :type groups: list
+        :return: number of hosts / services for each overall state of each group
+        :rtype: dict
+        """
+        db = current_app.data.driver.db
+        counts = {}
+        if field is None:
+            pipeline = [
+                {'$match': {'_is_template': False}},
+                {'$group': {'_id': {'realm': '$_realm', 'state': '$_overall_state_id'},
+                            'count': {'$sum': 1}}}
+            ]
+            for group in db[resource].aggregate(pipeline):
+                group_counts = counts.setdefault(group['_id']['realm'], {})
+                group_counts[group['_id']['state']] = group['count']
+            return counts
+
+        states = dict((item['_id'], item['_overall_state_id']) for item in
+                      db[resource].find({'_is_template': False}, {'_overall_state_id': 1}))
+        for group in groups:
+            group_counts = counts.setdefault(group['_id'], {})
+            for item_id in group.get(field) or []:
+                if item_id in states:
+                    group_counts[states[item_id]] = group_counts.get(states[item_id], 0) + 1
+        return counts
+
+    @staticmethod
+    def get_totals(groups, members_counts):
+        """
+        Get the counters of the groups: the members of a group are counted in the group and
+        in all its parents
+
+        :param groups: the groups
+        :type groups: list
+        :param members_counts: number of members for each overall state of each group
+        :type members_counts: dict
+        :return: _overall_state_counts of each group
+        :rtype: dict
+        """
+        totals = dict((group['_id'], OverallState.empty_counts()) for group in groups)
+        for group in groups:
+            for state, state_count in iteritems(members_counts.get(group['_id'], {})):
+                for group_id in [group['_id']] + group.get('_tree_parents', []):
+                    if group_id in totals:
+                        totals[group_id][str(state)] += state_count
+        return totals
+
+    @staticmethod
+    def recalculate(group_resources=None):
+        """
+        Compute the counters and the overall state of the groups from the hosts / services
+
+        :param group_resources: realm, hostgroup and / or servicegroup, all if None
+        :type group_resources: list
+        :return: number of updated groups
+        :rtype: int
+        """
+        db = current_app.data.driver.db
+        count = 0
+        for resource, groups in sorted(iteritems(OverallState.groups)):
+            for group_resource, field in groups:
+                if group_resources is not None and group_resource not in group_resources:
+                    continue
+                projection = {'_tree_parents': 1}
+                if field is not None:
+                    projection[field] = 1
+                all_groups = list(db[group_resource].find({}, projection))
+                totals = OverallState.get_totals(
+                    all_groups, OverallState.get_members_counts(resource, field, all_groups))
+                requests = [UpdateOne({'_id': group_id},
+                                      {'$set': {'_overall_state_counts': counts,
+                                                '_overall_state_id':
+                                                OverallState.get_overall_state(counts)}})
+                            for group_id, counts in iteritems(totals)]
+                if requests:
+                    db[group_resource].bulk_write(requests, ordered=False)
+                count += len(requests)
+        return count
+
+    @staticmethod
+    def on_inserted_host(items):
+        """
+            What to do when some hosts are inserted ...
+        """
+        OverallState.update('host', [(item, item.get('_overall_state_id'), 1)
+                                     for item in items])
+
+    @staticmethod
+    def on_inserted_service(items):
+        """
+            What to do when some services are inserted ...
+        """
+        OverallState.update('service', [(item, item.get('_overall_state_id'), 1)
+                                        for item in items])
+
+    @staticmethod
+    def on_updated_host(updates, original):
+        """
+            What to do when an host is updated ...
+        """
+        OverallState.on_updated_item('host', updates, original)
+
+    @staticmethod
+    def on_updated_service(updates, original):
+        """
+            What to do when a service is updated ...
+        """
+        OverallState.on_updated_item('service', updates, original)
+
+    @staticmethod
+    def on_updated_item(resource, updates, original):
+        """
+        Update the counters of the groups if the overall state or the realm of an host /
+        service changed
+
+        :param resource: host or service
+        :type resource: str
+        :param updates: updated fields
+        :type updates: dict
+        :param original: original fields
+        :type original: dict
+        :return: None
+        """
+        item = dict(original)
+        item.update(updates)
+        if item.get('_overall_state_id') != original.get('_overall_state_id') or \
+                item.get('_realm') != original.get('_realm'):
+            OverallState.update(resource, [(original, original.get('_overall_state_id'), -1),
+                                           (item, item.get('_overall_state_id'), 1)])
+
+    @staticmethod
+    def on_deleted_item_host(item):
+        """
+            What to do when an host is deleted ...
+        """
+        OverallState.update('host', [(item, item.get('_overall_state_id'), -1)])
+
+    @staticmethod
+    def on_deleted_item_service(item):
+        """
+            What to do when a service is deleted ...
+        """
+        OverallState.update('service', [(item, item.get('_overall_state_id'), -1)])
+
+    @staticmethod
+    def on_deleted_resource_host():
+        """
+            What to do when all the hosts are deleted ...
+        """
+        OverallState.recalculate(['realm', 'hostgroup'])
+
+    @staticmethod
+    def on_deleted_resource_service():
+        """
+            What to do when all the services are deleted ...
+        """
+        OverallState.recalculate(['servicegroup'])
+
+    @staticmethod
+    def on_inserted_hostgroup(items):
+        """
+            What to do when some hostgroups are inserted ...
+        """
+        for item in items:
+            OverallState.update_members('hostgroup', item, item.get('hosts'), 1)
+
+    @staticmethod
+    def on_inserted_servicegroup(items):
+        """
+            What to do when some servicegroups are inserted ...
+        """
+        for item in items:
+            OverallState.update_members('servicegroup', item, item.get('services'), 1)
+
+    @staticmethod
+    def on_updated_hostgroup(updates, original):
+        """
+            What to do when an hostgroup is updated ...
+        """
+        OverallState.on_updated_group('hostgroup', 'hosts', updates, original)
+
+    @staticmethod
+    def on_updated_servicegroup(updates, original):
+        """
+            What to do when a servicegroup is updated ...
+        """
+        OverallState.on_updated_group('servicegroup', 'services', updates, original)
+
+    @staticmethod
+    def on_updated_group(group_resource, field, updates, original):
+        """
+        Update the counters of a group and its parents if its members changed, or compute
+        the counters of all the groups again if the group moved in the groups tree
+
+        :param group_resource: hostgroup or servicegroup
+        :type group_resource: str
+        :param field: field of the group with its members
+        :type field: str
+        :param updates: updated fields
+        :type updates: dict
+        :param original: original fields
+        :type original: dict
+        :return: None
+        """
+        # The pre-patch hooks modify the _tree_parents of the original, so check the _parent
+        if '_parent' in updates and updates['_parent'] != original.get('_parent'):
+            OverallState.recalculate([group_resource])
+            return
+        if field in updates:
+            old_members = set(original.get(field) or [])
+            new_members = set(updates[field] or [])
+            OverallState.update_members(group_resource, original,
+                                        list(old_members - new_members), -1)
+            OverallState.update_members(group_resource, original,
+                                        list(new_members - old_members), 1)
+
+    @staticmethod
+    def on_deleted_item_hostgroup(item):
+        """
+            What to do when an hostgroup is deleted ...
+        """
+        # pylint: disable=unused-argument
+        OverallState.recalculate(['hostgroup'])
+
+    @staticmethod
+    def on_deleted_item_servicegroup(item):
+        """
+            What to do when a servicegroup is deleted ...
+        """
+        # pylint: disable=unused-argument
+        OverallState.recalculate(['servicegroup'])
+
+    @staticmethod
+    def on_updated_realm(updates, original):
+        """
+            What to do when a realm is updated ...
+
+            When the realm moved in the tree, compute the counters of all the realms again
+        """
+        if '_parent' in updates and updates['_parent'] != original.get('_parent'):
+            OverallState.recalculate(['realm'])
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.passwordhash`` module
+
+    This module manages the hash of the users passwords
+"""
+from __future__ import print_function
+import multiprocessing
+import os
+import threading
+from flask import current_app, abort
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHash(object):
+    """
+        PasswordHash class
+
+        The passwords are hashed and checked in a pool of processes, so the backend workers are
+        not blocked by the hash computing. The number of hashes waiting for the pool is limited,
+        when the limit is reached the request is rejected with a 503 error.
+    """
+    pool = None
+    pool_pid = None
+    pending = 0
+    lock = threading.Lock()
+
+    @staticmethod
+    def get_method():
+        """
+        Get the hash method with the configured cost
+
+        :return: the hash method, like pbkdf2:sha256:50000
+        :rtype: str
+        """
+        return 'pbkdf2:sha256:%d' % current_app.config.get('PASSWORD_HASH_ITERATIONS', 50000)
+
+    @staticmethod
+    def run(func, *args):
+        """
+        Run a hash function in the pool of processes
+
+        :param func: function to run
+        :type func: function
+        :param args: arguments of the function
+        :type args: tuple
+        :return: result of the function
+        """
+        workers = current_app.config.get('PASSWORD_HASH_WORKERS', 2)
+        if not workers:
+            return func(*args)
+
+        with PasswordHash.lock:
+            if PasswordHash.pending >= current_app.config.get('PASSWORD_HASH_QUEUE', 32):
+                abort(503, description='Too many password hashes in progress, retry later')
+            # The pool is not shared with the forked processes
+            if PasswordHash.pool is None or PasswordHash.pool_pid != os.getpid():
+                PasswordHash.pool = multiprocessing.Pool(workers)
+                PasswordHash.pool_pid = os.getpid()
+            pool = PasswordHash.pool
+            PasswordHash.pending += 1
+        try:
+            return pool.apply_async(func, args).get(
+                current_app.config.get('PASSWORD_HASH_TIMEOUT', 10))
+        except multiprocessing.TimeoutError:
+            abort(503, description='Password hash took too long, retry later')
+        finally:
+            with PasswordHash.lock:
+                PasswordHash.pending -= 1
+
+    @staticmethod
+    def generate(password):
+        """
+        Hash a password with the configured cost
+
+        :param password: the password
+        :type password: str
+        :return: the password hash
+        :rtype: str
+        """
+        return PasswordHash.run(generate_password_hash, password, PasswordHash.get_method())
+
+    @staticmethod
+    def check(pwhash, password):
+        """
+        Check a password against its hash
+
+        :param pwhash: the password hash
+        :type pwhash: str
+        :param password: the password
+        :type password: str
+        :return: True if the password is right
+        :rtype: bool
+        """
+        return PasswordHash.run(check_password_hash, pwhash, password)
+
+    @staticmethod
+    def needs_rehash(pwhash):
+        """
+        Check if a password hash was not computed with the configured method and cost
+
+        :param pwhash: the password hash
+        :type pwhash: str
+        :return: True if the password must be hashed again
+        :rtype: bool
+        """
+        return pwhash.split('$', 1)[0] != PasswordHash.get_method()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.realmpath`` module
+
+    This module manages the realm materialized path denormalized on the realm-scoped documents
+"""
+from __future__ import print_function
+from future.utils import iteritems
+from flask import current_app
+from alignak_backend.realmtree import RealmTree
+
+
+class RealmPath(object):
+    """
+        RealmPath class
+
+        Each document of a resource having a _realm field gets a _realm_path field: the ids of
+        the realm tree parents and of the realm, separated by /. The documents of a realm and of
+        all its sub-realms are then found with an indexed prefix search on _realm_path.
+    """
+
+    @staticmethod
+    def get_resources():
+        """
+        Get the resources having a _realm field
+
+        :return: list of the resources names
+        :rtype: list
+        """
+        return [resource for resource, definition in iteritems(current_app.config['DOMAIN'])
+                if '_realm' in definition['schema']]
+
+    @staticmethod
+    def on_insert(items):
+        """
+            What to do when some realm-scoped items will be inserted ...
+        """
+        id_paths = RealmTree.get().id_paths
+        for _, item in enumerate(items):
+            if item.get('_realm') in id_paths:
+                item['_realm_path'] = id_paths[item['_realm']]
+
+    @staticmethod
+    def on_update(updates, original):
+        """
+            What to do when a realm-scoped item will be updated ...
+        """
+        # pylint: disable=unused-argument
+        if '_realm' in updates:
+            id_paths = RealmTree.get().id_paths
+            if updates['_realm'] in id_paths:
+                updates['_realm_path'] = id_paths[updates['_realm']]
+
+    @staticmethod
+    def on_replace(document, original):
+        """
+            What to do when a realm-scoped item will be replaced ...
+        """
+        # pylint: disable=unused-argument
+        RealmPath.on_insert([document])
+
+    @staticmethod
+    def on_updated_realm(updates, original):
+        """
+            What to do when a realm is updated ...
+
+            When the realm moved in the tree, update the path of the documents of the realm and
+            of all its sub-realms
+        """
+        if '_tree_parents' in updates or '_parent' in updates:
+            realm_tree = RealmTree.get()
+            RealmPath.update_realms([original['_id']] +
+                                    list(realm_tree.all_children.get(original['_id'], [])))
+
+    @staticmethod
+    def update_realms(realm_ids):
+        """
+        Update the path of the documents of some realms
+
+        :param realm_ids: list of the realms id
+        :type realm_ids: list
+        :return: number of updated documents
+        :rtype: int
+        """
+        id_paths = RealmTree.get().id_paths
+        count = 0
+        for resource in RealmPath.get_resources():
+            collection = current_app.data.driver.db[resource]
+            for realm_id in realm_ids:
+                if realm_id not in id_paths:
+                    continue
+                result = collection.update_many(
+                    {'_realm': realm_id, '_realm_path': {'$ne': id_paths[realm_id]}},
+                    {'$set': {'_realm_path': id_paths[realm_id]}})
+                count += result.modified_count
+        return count
+
+    @staticmethod
+    def backfill():
+        """
+        Create the _realm_path index and set the path of all the realm-scoped documents
+
+        :return: number of updated documents
+        :rtype: int
+        """
+        for resource in RealmPath.get_resources():
+            current_app.data.driver.db[resource].create_index('_realm_path')
+        return RealmPath.update_realms(list(RealmTree.get().id_paths))
+
+    @staticmethod
+    def get_lookup(realms, paths):
+        """
+        Get the lookup to search the documents of some realms and of some realms trees
+
+        :param realms: list of realms id
+        :type realms: list
+        :param paths: list of realms path (the realm and all its sub-realms)
+        :type paths: list
+        :return: list of conditions for an $or lookup
+        :rtype: list
+        """
+        lookup = []
+        if realms:
+            lookup.append({'_realm': {'$in': realms}})
+        for path in paths:
+            lookup.append({'_realm_path': {'$regex': '^' + path}})
+        return lookup
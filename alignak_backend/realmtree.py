@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.realmtree`` module
+
+    This module manages an in-memory snapshot of the realms tree
+"""
+from __future__ import print_function
+import threading
+from flask import current_app, g
+
+
+class RealmTree(object):
+    """
+        RealmTree class
+
+        A RealmTree object is an immutable snapshot of the realms tree. The current snapshot is
+        shared by all the requests of a process and it is reloaded when the realms generation
+        stored in the database changes (the generation is bumped by the realm hooks).
+    """
+    current = None
+    lock = threading.Lock()
+
+    def __init__(self, realms, generation):
+        """
+        Build the snapshot from the realms documents
+
+        :param realms: all the realms (from mongo)
+        :type realms: list
+        :param generation: realms generation when the realms were read
+        :type generation: int
+        """
+        self.generation = generation
+        self.names = {}
+        self.level = {}
+        self.parent = {}
+        self.parents = {}
+        self.children = {}
+        self.all_children = {}
+        for realm in realms:
+            self.names[realm['_id']] = realm['name']
+            self.level[realm['_id']] = realm['_level']
+            self.parent[realm['_id']] = realm.get('_parent')
+            self.parents[realm['_id']] = tuple(realm['_tree_parents'])
+            self.children[realm['_id']] = tuple(realm['_children'])
+            self.all_children[realm['_id']] = tuple(realm['_all_children'])
+
+        # Realm path since first level: realms name separated by . and
+        # materialized path: realms id separated by / (a realm path is a prefix of the path
+        # of all its sub-realms)
+        self.paths = {}
+        self.id_paths = {}
+        for realm_id in self.names:
+            self.get_paths(realm_id)
+
+    def get_paths(self, realm_id):
+        """
+        Compute the paths of a realm from the paths of its parent
+
+        :param realm_id: id of the realm
+        :type realm_id: ObjectId
+        :return: names path and ids path of the realm
+        :rtype: tuple
+        """
+        if realm_id not in self.paths:
+            self.paths[realm_id] = self.names[realm_id]
+            self.id_paths[realm_id] = '%s/' % realm_id
+            parent = self.parent.get(realm_id)
+            if parent in self.names:
+                names_path, ids_path = self.get_paths(parent)
+                self.paths[realm_id] = names_path + '.' + self.paths[realm_id]
+                self.id_paths[realm_id] = ids_path + self.id_paths[realm_id]
+        return self.paths[realm_id], self.id_paths[realm_id]
+
+    @staticmethod
+    def get_generation():
+        """
+        Get the realms generation stored in the database
+
+        :return: the generation number
+        :rtype: int
+        """
+        generation = current_app.data.driver.db['generation'].find_one({'_id': 'realm'})
+        if generation is None:
+            return 0
+        return generation['value']
+
+    @staticmethod
+    def get():
+        """
+        Get the realms tree snapshot
+
+        The database generation is checked once per request, the snapshot is reloaded only if
+        the generation changed.
+
+        :return: the realms tree snapshot
+        :rtype: RealmTree
+        """
+        tree = g.get('realm_tree')
+        if tree is not None:
+            return tree
+
+        generation = RealmTree.get_generation()
+        with RealmTree.lock:
+            tree = RealmTree.current
+            if tree is None or tree.generation != generation:
+                realms = current_app.data.driver.db['realm'].find()
+                tree = RealmTree(realms, generation)
+                RealmTree.current = tree
+        g.realm_tree = tree
+        return tree
+
+    @staticmethod
+    def bump():
+        """
+        Bump the realms generation because the realms tree changed
+
+        :return: None
+        """
+        current_app.data.driver.db['generation'].update({'_id': 'realm'},
+                                                        {'$inc': {'value': 1}}, upsert=True)
+        with RealmTree.lock:
+            RealmTree.current = None
+        g.pop('realm_tree', None)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.rightscheck`` module
+
+    This module checks the rights of the authenticated user on some items
+"""
+from __future__ import print_function
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from future.utils import string_types
+from flask import current_app, g
+from alignak_backend.realmpath import RealmPath
+
+
+class RightsCheck(object):
+    """
+        RightsCheck class
+
+        The read rights are checked with the same conditions as the lookup added in the GET
+        requests (see get_lookup), the update and delete rights with the resources_patch and
+        resources_delete rights of the user.
+    """
+    # Method, rights dictionary, custom rights dictionary, users field of the custom right
+    methods = {
+        'PATCH': ('resources_patch', 'resources_patch_custom', '_users_update'),
+        'DELETE': ('resources_delete', 'resources_delete_custom', '_users_delete'),
+    }
+
+    @staticmethod
+    def get_lookup(resource):
+        """
+        Get the conditions on the items the user can read
+
+        :param resource: name of the resource
+        :type resource: str
+        :return: list of conditions for an $or lookup, None if the user can't read any item
+        :rtype: list or None
+        """
+        resources_get = g.get('resources_get', {})
+        resources_get_parents = g.get('resources_get_parents', {})
+        resources_get_custom = g.get('resources_get_custom', {})
+        users_id = g.get('users_id', {})
+
+        if resource not in resources_get and resource not in resources_get_custom:
+            return None
+        if resource in ['realm']:
+            return [{'_id': {'$in': resources_get.get(resource, [])}}]
+        if current_app.config.get('REALM_PATH_FILTER', False):
+            # Realms with sub-realms are searched with their path rather than with the
+            # list of all their sub-realms
+            lookup = RealmPath.get_lookup(
+                g.get('resources_get_direct', {}).get(resource, []),
+                g.get('resources_get_paths', {}).get(resource, []))
+        elif resources_get.get(resource):
+            lookup = [{'_realm': {'$in': resources_get[resource]}}]
+        else:
+            lookup = []
+        # Only the conditions which may find some items
+        if resources_get_parents.get(resource):
+            lookup.append({'$and': [{'_sub_realm': True},
+                                    {'_realm': {'$in': resources_get_parents[resource]}}]})
+        if resources_get_custom.get(resource):
+            lookup.append({'$and': [{'_users_read': users_id},
+                                    {'_realm': {'$in': resources_get_custom[resource]}}]})
+        return lookup or None
+
+    @staticmethod
+    def can_read(resource, item):
+        """
+        Check if the user can read an item (same conditions as the lookup of get_lookup)
+
+        :param resource: name of the resource
+        :type resource: str
+        :param item: the item (from mongo)
+        :type item: dict
+        :return: True if the user can read the item
+        :rtype: bool
+        """
+        if resource in ['user']:
+            return True
+        resources_get = g.get('resources_get', {})
+        if resource in ['realm']:
+            return item['_id'] in resources_get.get(resource, [])
+        realm = item.get('_realm')
+        if realm in resources_get.get(resource, []):
+            return True
+        if item.get('_sub_realm', False) \
+                and realm in g.get('resources_get_parents', {}).get(resource, []):
+            return True
+        return g.get('users_id') in item.get('_users_read', []) \
+            and realm in g.get('resources_get_custom', {}).get(resource, [])
+
+    @staticmethod
+    def can_write(resource, item, method):
+        """
+        Check if the user can update or delete an item
+
+        :param resource: name of the resource
+        :type resource: str
+        :param item: the item (from mongo)
+        :type item: dict
+        :param method: PATCH | DELETE
+        :type method: str
+        :return: True if the user can update / delete the item
+        :rtype: bool
+        """
+        name, custom_name, users_field = RightsCheck.methods[method]
+        realm = item['_id'] if resource in ['realm'] else item.get('_realm')
+        if realm in g.get(name, {}).get(resource, []):
+            return True
+        return g.get('users_id') in item.get(users_field, []) \
+            and realm in g.get(custom_name, {}).get(resource, [])
+
+    @staticmethod
+    def check(checks):
+        """
+        Check the rights of the user for a list of (resource, item id, method)
+
+        The items are searched with one request for each resource.
+
+        :param checks: list of (resource, item id, method)
+        :type checks: list
+        :return: True / False for each check
+        :rtype: list
+        """
+        domain = current_app.config['DOMAIN']
+        requested = {}
+        for resource, item_id, _ in checks:
+            if resource in domain:
+                requested.setdefault(resource, set()).add(item_id)
+
+        items = {}
+        projection = {'_realm': 1, '_sub_realm': 1,
+                      '_users_read': 1, '_users_update': 1, '_users_delete': 1}
+        for resource, item_ids in requested.items():
+            items[resource] = {}
+            search = {'_id': {'$in': list(item_ids)}}
+            for item in current_app.data.driver.db[resource].find(search, projection):
+                items[resource][item['_id']] = item
+
+        results = []
+        for resource, item_id, method in checks:
+            item = items.get(resource, {}).get(item_id)
+            if item is None or (method != 'GET' and method not in RightsCheck.methods):
+                results.append(False)
+            elif g.get('back_role_super_admin', False):
+                results.append(True)
+            elif method == 'GET':
+                results.append(RightsCheck.can_read(resource, item))
+            else:
+                results.append(RightsCheck.can_write(resource, item, method))
+        return results
+
+    @staticmethod
+    def parse(data):
+        """
+        Get the list of (resource, item id, method) from the posted data
+
+        Each check is either a list [resource, item id, method] or a dictionary with the
+        resource, item_id and method keys.
+
+        :param data: posted checks
+        :type data: list
+        :return: list of (resource, item id, method), None if the data are not valid
+        :rtype: list or None
+        """
+        if not isinstance(data, list):
+            return None
+        checks = []
+        for check in data:
+            if isinstance(check, dict):
+                check = [check.get('resource'), check.get('item_id'), check.get('method')]
+            if not isinstance(check, list) or len(check) != 3:
+                return None
+            resource, item_id, method = check
+            if not isinstance(resource, string_types):
+                return None
+            try:
+                item_id = ObjectId(item_id)
+            except (InvalidId, TypeError):
+                # Not an ObjectId, the item will not be found
+                item_id = str(item_id)
+            checks.append((resource, item_id, str(method).upper()))
+        return checks
@@ -7,6 +7,20 @@
     This module manages the scheduler jobs
 """
 import alignak_backend.app
+from alignak_backend.lease import Lease
+
+
+def hold_lease():
+    """
+    Check if this backend process runs the scheduler jobs: it gets (or renews) the scheduler
+    lease. The jobs of the other backend processes and nodes do nothing.
+
+    :return: True if the jobs must run in this process
+    :rtype: bool
+    """
+    app = alignak_backend.app.app
+    with app.test_request_context():
+        return Lease.acquire('scheduler', app.config.get('SCHEDULER_LEASE', 60))
 
 
 def cron_cache():
@@ -17,7 +31,8 @@ def cron_cache():
     :return: None
     """
     # test communication and see if data in cache
-    alignak_backend.app.cron_timeseries()
+    if hold_lease():
+        alignak_backend.app.cron_timeseries()
 
 
 def cron_grafana():
@@ -26,7 +41,8 @@ def cron_grafana():
 
     :return: None
     """
-    alignak_backend.app.cron_grafana()
+    if hold_lease():
+        alignak_backend.app.cron_grafana()
 
 
 def cron_livesynthesis_history():
@@ -35,4 +51,5 @@ def cron_livesynthesis_history():
 
     :return: None
     """
-    alignak_backend.app.cron_livesynthesis_history()
+    if hold_lease():
+        alignak_backend.app.cron_livesynthesis_history()
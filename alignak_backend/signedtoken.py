@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.signedtoken`` module
+
+    This module manages the signed (stateless) authentication tokens
+"""
+from __future__ import print_function
+import base64
+import hashlib
+import hmac
+import json
+import time
+from flask import current_app
+
+
+class SignedToken(object):
+    """
+        SignedToken class
+
+        A signed token is made of a base64 encoded payload and of its HMAC-SHA256 signature,
+        separated by a dot. The payload contains:
+        - u: the user id
+        - e: the token expiry timestamp
+        - v: the version of the user rights when the token was generated
+    """
+
+    @staticmethod
+    def encode(data):
+        """
+        Encode bytes in url-safe base64 without padding
+
+        :param data: data to encode
+        :type data: bytes
+        :return: encoded data
+        :rtype: str
+        """
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode(data):
+        """
+        Decode url-safe base64 without padding
+
+        :param data: data to decode
+        :type data: str
+        :return: decoded data
+        :rtype: bytes
+        """
+        data = str(data)
+        return base64.urlsafe_b64decode((data + '=' * (-len(data) % 4)).encode('ascii'))
+
+    @staticmethod
+    def sign(payload):
+        """
+        Get the signature of an encoded payload
+
+        :param payload: encoded payload
+        :type payload: str
+        :return: encoded signature
+        :rtype: str
+        """
+        secret = current_app.config['AUTH_TOKEN_SECRET'].encode('utf-8')
+        return SignedToken.encode(hmac.new(secret, payload.encode('ascii'),
+                                           hashlib.sha256).digest())
+
+    @staticmethod
+    def generate(user, version):
+        """
+        Generate a signed token for a user
+
+        :param user: the user (from mongo)
+        :type user: dict
+        :param version: version of the user rights
+        :type version: int
+        :return: the token
+        :rtype: str
+        """
+        payload = {
+            'u': str(user['_id']),
+            'e': int(time.time()) + current_app.config.get('AUTH_TOKEN_LIFETIME', 86400),
+            'v': version
+        }
+        payload = SignedToken.encode(json.dumps(payload, separators=(',', ':'))
+                                     .encode('utf-8'))
+        return payload + '.' + SignedToken.sign(payload)
+
+    @staticmethod
+    def verify(token):
+        """
+        Check the signature and the expiry of a token
+
+        :param token: the token
+        :type token: str
+        :return: the token payload if the token is valid, otherwise None
+        :rtype: dict or None
+        """
+        if not current_app.config.get('AUTH_TOKEN_SIGNED', False) or token.count('.') != 1:
+            return None
+
+        payload, signature = token.split('.')
+        try:
+            # Compare bytes: the token is provided by the client and may not be ASCII
+            if not hmac.compare_digest(SignedToken.sign(payload).encode('ascii'),
+                                       signature.encode('ascii')):
+                return None
+        except (UnicodeError, TypeError):
+            return None
+        try:
+            payload = json.loads(SignedToken.decode(payload).decode('utf-8'))
+        except (TypeError, ValueError):
+            return None
+        if payload['e'] < time.time():
+            return None
+        return payload
@@ -76,6 +76,8 @@ class Template(object):
                 del putdata['_etag']
                 del putdata['_updated']
                 del putdata['_created']
+                # The realm path is not in the schema, it will be set again
+                putdata.pop('_realm_path', None)
                 response = put_internal('host', putdata, False, False, **lookup)
                 updates['_etag'] = response[0]['_etag']
                 original['_etag'] = response[0]['_etag']
@@ -263,6 +265,8 @@ class Template(object):
                 del putdata['_etag']
                 del putdata['_updated']
                 del putdata['_created']
+                # The realm path is not in the schema, it will be set again
+                putdata.pop('_realm_path', None)
                 response = put_internal('service', putdata, False, False, **lookup)
                 updates['_etag'] = response[0]['_etag']
                 original['_etag'] = response[0]['_etag']
@@ -341,6 +345,8 @@ class Template(object):
                 del putdata['_etag']
                 del putdata['_updated']
                 del putdata['_created']
+                # Materialized rights are not in the schema, they will be computed again
+                putdata.pop('_user_rights', None)
                 response = put_internal('user', putdata, False, False, **lookup)
                 updates['_etag'] = response[0]['_etag']
                 original['_etag'] = response[0]['_etag']
@@ -382,7 +388,8 @@ class Template(object):
         """
         host = current_app.data.driver.db['host']
         ignore_fields = ['_id', '_etag', '_updated', '_created', '_template_fields', '_templates',
-                         '_is_template', 'realm', '_templates_with_services']
+                         '_is_template', 'realm', '_templates_with_services', '_realm_path',
+                         '_overall_state_services']
         fields_not_update = []
         for (field_name, field_value) in iteritems(item):
             fields_not_update.append(field_name)
@@ -399,7 +406,7 @@ class Template(object):
                             item['_template_fields'][field_name] = host_template
             schema = host_schema()
             ignore_schema_fields = ['realm', '_template_fields', '_templates', '_is_template',
-                                    '_templates_with_services']
+                                    '_templates_with_services', '_overall_state_services']
             for key in schema['schema']:
                 if key not in ignore_schema_fields:
                     if key not in item:
@@ -442,7 +449,8 @@ class Template(object):
         """
         service = current_app.data.driver.db['service']
         ignore_fields = ['_id', '_etag', '_updated', '_created', '_template_fields', '_templates',
-                         '_is_template', '_realm', 'host', '_templates_from_host_template']
+                         '_is_template', '_realm', 'host', '_templates_from_host_template',
+                         '_realm_path']
         fields_not_update = []
         for (field_name, field_value) in iteritems(item):
             fields_not_update.append(field_name)
@@ -517,6 +525,7 @@ class Template(object):
             del item['_status']
         if '_links' in item:
             del item['_links']
+        item.pop('_realm_path', None)
         item['_is_template'] = False
         item['_templates_from_host_template'] = True
         item['_template_fields'] = {}
@@ -536,7 +545,7 @@ class Template(object):
         """
         user = current_app.data.driver.db['user']
         ignore_fields = ['_id', '_etag', '_updated', '_created', '_template_fields', '_templates',
-                         '_is_template', 'realm']
+                         '_is_template', 'realm', '_user_rights']
         fields_not_update = []
         for (field_name, field_value) in iteritems(item):
             fields_not_update.append(field_name)
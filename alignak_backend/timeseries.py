@@ -8,25 +8,46 @@
 """
 from __future__ import print_function
 import re
+import time
 from flask import current_app, g
-from influxdb import InfluxDBClient
-import statsd
 
 from eve.methods.post import post_internal
-from alignak_backend.carboniface import CarbonIface
+from pymongo import ASCENDING
+from alignak_backend.circuitbreaker import CircuitBreaker
+from alignak_backend.jobqueue import JobQueue
 from alignak_backend.perfdata import PerfDatas
+from alignak_backend.realmtree import RealmTree
+from alignak_backend.timeseriesbatch import TimeseriesBatch
+from alignak_backend.timeseriesclients import TimeseriesClients
+from alignak_backend.timeseriesspool import TimeseriesSpool
+from alignak_backend.timeseriesstats import TimeseriesStats
 
 
 class Timeseries(object):
     """
         Timeseries class
     """
+    # The remaining perfdata of the retention are counted up to this number of chunks
+    replay_count_limit = 100
 
     @staticmethod
-    def after_inserted_logcheckresult(items):
+    def on_inserted_logcheckresult(items):
         """
         Called by EVE HOOK (app.on_inserted_logcheckresult)
 
+        The perfdata are sent by a background job (see after_inserted_logcheckresult)
+
+        :param items: List of logcheckresult inserted
+        :type items: list
+        :return: None
+        """
+        JobQueue.enqueue('timeseries', items)
+
+    @staticmethod
+    def after_inserted_logcheckresult(items):
+        """
+        Job to send the perfdata of logcheckresult to the timeseries databases
+
         :param items: List of logcheckresult inserted
         :type items: list
         :return: None
@@ -143,15 +164,7 @@ class Timeseries(object):
         :return: realms name separed by .
         :rtype: str
         """
-        prefix_realm = ''
-        realm_db = current_app.data.driver.db['realm']
-        realm_info = realm_db.find_one({'_id': realm_id})
-        if len(realm_info['_tree_parents']) > 0:
-            realms = realm_db.find({'_id': {"$in": realm_info['_tree_parents']}}).sort("_level")
-            for realm in realms:
-                prefix_realm += realm['name'] + "."
-        prefix_realm += realm_info['name']
-        return prefix_realm
+        return RealmTree.get().paths[realm_id]
 
     @staticmethod
     def send_to_timeseries_db(data, item_realm):
@@ -179,40 +192,220 @@ class Timeseries(object):
         """
         graphite_db = current_app.data.driver.db['graphite']
         influxdb_db = current_app.data.driver.db['influxdb']
-        realm_db = current_app.data.driver.db['realm']
 
         searches = [{'_realm': item_realm}]
-        realm_info = realm_db.find_one({'_id': item_realm})
-        for realm in realm_info['_tree_parents']:
+        for realm in RealmTree.get().parents[item_realm]:
             searches.append({'_realm': realm, '_sub_realm': True})
 
         # get graphite servers to send
         for search in searches:
             graphites = graphite_db.find(search)
             for graphite in graphites:
-                if not Timeseries.send_to_timeseries_graphite(data, graphite):
-                    for perf in data:
-                        perf['graphite'] = graphite['_id']
-                        uom = perf['uom']
-                        del perf['uom']
-                    post_internal('timeseriesretention', data)
-                    for perf in data:
-                        del perf['graphite']
-                        perf['uom'] = uom
+                Timeseries.send(data, 'graphite', graphite)
 
         # get influxdb servers to send
         for search in searches:
             influxdbs = influxdb_db.find(search)
             for influxdb in influxdbs:
-                if not Timeseries.send_to_timeseries_influxdb(data, influxdb):
-                    for perf in data:
-                        perf['influxdb'] = influxdb['_id']
-                        uom = perf['uom']
-                        del perf['uom']
-                    post_internal('timeseriesretention', data)
-                    for perf in data:
-                        del perf['influxdb']
-                        perf['uom'] = uom
+                Timeseries.send(data, 'influxdb', influxdb)
+
+    @staticmethod
+    def send(data, resource, destination):
+        """
+        Send perfdata to a timeseries database, or add them to its batch if the batches are
+        activated (TIMESERIES_BATCH_SIZE)
+
+        :param data: list of perfdata
+        :type data: list
+        :param resource: graphite or influxdb
+        :type resource: str
+        :param destination: graphite or influxdb properties dictionary
+        :type destination: dict
+        :return: None
+        """
+        if current_app.config.get('TIMESERIES_BATCH_SIZE', 0) > 0:
+            TimeseriesBatch.add(resource, destination, data, Timeseries.send_or_retain)
+        else:
+            Timeseries.send_or_retain(resource, destination, data)
+
+    @staticmethod
+    def send_or_retain(resource, destination, data):
+        """
+        Send perfdata to a timeseries database, if not available (or if its circuit breaker is
+        open, or if the send raised), add them in the timeseries spool if activated, otherwise in
+        the timeseries retention
+
+        :param resource: graphite or influxdb
+        :type resource: str
+        :param destination: graphite or influxdb properties dictionary
+        :type destination: dict
+        :param data: list of perfdata
+        :type data: list
+        :return: True if sent, False if added in the spool / retention
+        :rtype: bool
+        """
+        try:
+            sent = Timeseries.send_now(resource, destination, data)
+        except Exception:  # pylint: disable=W0703
+            # The perfdata are kept as for a failed send
+            sent = False
+        if not sent and not TimeseriesSpool.write(resource, destination['_id'], data):
+            retention = []
+            for perf in data:
+                perf = dict(perf)
+                perf[resource] = destination['_id']
+                del perf['uom']
+                retention.append(perf)
+            post_internal('timeseriesretention', retention)
+        return sent
+
+    @staticmethod
+    def send_now(resource, destination, data):
+        """
+        Send perfdata to a timeseries database, unless its circuit breaker is open
+
+        :param resource: graphite or influxdb
+        :type resource: str
+        :param destination: graphite or influxdb properties dictionary
+        :type destination: dict
+        :param data: list of perfdata
+        :type data: list
+        :return: True if sent
+        :rtype: bool
+        """
+        sent = False
+        if CircuitBreaker.allow(resource, destination['_id']):
+            try:
+                if resource == 'graphite':
+                    sent = Timeseries.send_to_timeseries_graphite(data, destination)
+                else:
+                    sent = Timeseries.send_to_timeseries_influxdb(data, destination)
+            finally:
+                # Also when the send raised, so a half-open breaker does not wait for a probe
+                CircuitBreaker.record(resource, destination['_id'], sent)
+        TimeseriesStats.publish()
+        return sent
+
+    @staticmethod
+    def replay(deadline=None):
+        """
+        Send again the perfdata of the timeseries retention and of the spool files
+
+        The perfdata of the retention are read in _id order for each timeseries database, sent
+        by batches and deleted with one delete_many for each sent batch. The sends are limited
+        to TIMESERIES_REPLAY_RATE points per second (0 for no limit) and stop at deadline.
+
+        :param deadline: time (timestamp) when the replay must stop, None for no limit
+        :type deadline: float
+        :return: for each timeseries database (resource/id), number of sent perfdata and, for
+                 the retention, number of remaining perfdata and estimated time to send them
+        :rtype: dict
+        """
+        rate = current_app.config.get('TIMESERIES_REPLAY_RATE', 0)
+        start = time.time()
+        progress = {'retention': {}, 'spool': {}, 'points': 0}
+
+        def send(resource, destination, data):
+            """
+            Send a batch of perfdata, wait to keep the rate of the replay
+            """
+            if deadline is not None and time.time() >= deadline:
+                return False
+            if not Timeseries.send_now(resource, destination, data):
+                return False
+            progress['points'] += len(data)
+            if rate:
+                delay = progress['points'] / float(rate) - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            return True
+
+        retention_db = current_app.data.driver.db['timeseriesretention']
+        for resource in ['graphite', 'influxdb']:
+            for destination_id in retention_db.distinct(resource):
+                if destination_id is None:
+                    continue
+                destination = current_app.data.driver.db[resource].find_one(
+                    {'_id': destination_id})
+                if destination is None:
+                    # The timeseries database was deleted
+                    retention_db.delete_many({resource: destination_id})
+                    continue
+                progress['retention']['%s/%s' % (resource, destination_id)] = \
+                    Timeseries.replay_retention(resource, destination, send)
+
+        progress['spool'] = TimeseriesSpool.replay(send, Timeseries.get_chunk_size())
+        progress['duration'] = round(time.time() - start, 3)
+        return progress
+
+    @staticmethod
+    def replay_retention(resource, destination, sender):
+        """
+        Send again the perfdata of the timeseries retention of a timeseries database, by
+        batches in _id order, until all are sent or a send fails
+
+        :param resource: graphite or influxdb
+        :type resource: str
+        :param destination: the graphite or influxdb document
+        :type destination: dict
+        :param sender: function sending a batch: sender(resource, destination, data)
+        :type sender: function
+        The remaining perfdata are counted with the (resource, _id) index, up to
+        replay_count_limit chunks: when there are more of them, remaining is this limit and
+        remaining_more is True, so the estimated time is a minimum.
+
+        :return: number of sent and remaining perfdata, estimated time to send them (seconds)
+        :rtype: dict
+        """
+        retention_db = current_app.data.driver.db['timeseriesretention']
+        search = {resource: destination['_id']}
+        progress = {'sent': 0}
+        start = time.time()
+        while True:
+            data = list(retention_db.find(search).sort('_id', 1)
+                        .limit(Timeseries.get_chunk_size()))
+            if not data or not sender(resource, destination, data):
+                break
+            retention_db.delete_many({'_id': {'$in': [perf['_id'] for perf in data]}})
+            search['_id'] = {'$gt': data[-1]['_id']}
+            progress['sent'] += len(data)
+
+        del search['_id']
+        limit = Timeseries.get_chunk_size() * Timeseries.replay_count_limit
+        progress['remaining'] = retention_db.find(search).limit(limit).count(True)
+        progress['remaining_more'] = progress['remaining'] >= limit
+        progress['eta'] = 0
+        if progress['sent'] and progress['remaining']:
+            progress['eta'] = int(progress['remaining'] * (time.time() - start) /
+                                  progress['sent'])
+        if progress['sent'] or progress['remaining']:
+            print("[cron_timeseries] %s %s: %d points sent, %d%s remaining, ETA %d%s seconds"
+                  % (resource, destination['_id'], progress['sent'], progress['remaining'],
+                     '+' if progress['remaining_more'] else '', progress['eta'],
+                     '+' if progress['remaining_more'] else ''))
+        return progress
+
+    @staticmethod
+    def create_indexes():
+        """
+        Create the indexes of the timeseries retention: the perfdata of each timeseries
+        database are searched (distinct, count) and read in _id order by the replay
+
+        :return: None
+        """
+        retention_db = current_app.data.driver.db['timeseriesretention']
+        for resource in ['graphite', 'influxdb']:
+            retention_db.create_index([(resource, ASCENDING), ('_id', ASCENDING)])
+
+    @staticmethod
+    def get_chunk_size():
+        """
+        Get the maximum number of points sent in one message / request
+
+        :return: number of points
+        :rtype: int
+        """
+        return max(current_app.config.get('TIMESERIES_BATCH_SIZE', 0), 1000)
 
     @staticmethod
     def send_to_timeseries_graphite(data, graphite):
@@ -241,12 +434,17 @@ class Timeseries(object):
                 prefix = graphite['prefix'] + '.' + prefix
             send_data.append(('.'.join([prefix, d['name']]),
                               (int(d['timestamp']), d['value'])))
-        carbon = CarbonIface(graphite['carbon_address'], graphite['carbon_port'])
+        carbon = TimeseriesClients.get('graphite', graphite)
+        chunk = Timeseries.get_chunk_size()
         try:
-            carbon.send_data(send_data)
-            return True
+            # One pickle message for each chunk of points
+            if all(carbon.send_data(send_data[index:index + chunk])
+                   for index in range(0, len(send_data), chunk)):
+                return True
         except:  # pylint: disable=W0702
-            return False
+            pass
+        TimeseriesClients.reset('graphite', graphite['_id'])
+        return False
 
     @staticmethod
     def send_to_timeseries_influxdb(data, influxdb):
@@ -278,12 +476,12 @@ class Timeseries(object):
                     "value": float(d['value'])
                 }
             })
-        influxdbs = InfluxDBClient(influxdb['address'], influxdb['port'], influxdb['login'],
-                                   influxdb['password'], influxdb['database'], timeout=1)
+        influxdbs = TimeseriesClients.get('influxdb', influxdb)
         try:
-            influxdbs.write_points(json_body)
+            influxdbs.write_points(json_body, batch_size=Timeseries.get_chunk_size())
             return True
         except:  # pylint: disable=W0702
+            TimeseriesClients.reset('influxdb', influxdb['_id'])
             return False
 
     @staticmethod
@@ -303,18 +501,18 @@ class Timeseries(object):
         :return: True (because statsd not have return error or not)
         :rtype: bool
         """
-        statsd_db = current_app.data.driver.db['statsd']
-        item = statsd_db.find_one({'_id': statsd_id})
-        statsd_inst = statsd.StatsClient(item['address'], item['port'], prefix=prefix)
+        statsd_inst = TimeseriesClients.get_statsd(statsd_id, prefix)
+        if statsd_inst is None:
+            return True
         for d in data:
             if d['service'] == '':
                 prefix = '.'.join([d['realm'], d['host']])
             else:
                 prefix = '.'.join([d['realm'], d['host'], d['service']])
 
-            if d["uom"] in ['s', 'ms']:
+            if d.get("uom") in ['s', 'ms']:
                 statsd_inst.timing('.'.join([prefix, d['name']]), d['value'])
-            elif d["uom"] == 'h':
+            elif d.get("uom") == 'h':
                 statsd_inst.incr('.'.join([prefix, d['name']]), d['value'])
             else:
                 statsd_inst.gauge('.'.join([prefix, d['name']]), d['value'])
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.timeseriesbatch`` module
+
+    This module manages the batches of perfdata sent to the timeseries databases
+"""
+from __future__ import print_function
+import atexit
+import threading
+import time
+from future.utils import iteritems
+from flask import current_app
+
+from alignak_backend.timeseriesstats import TimeseriesStats
+
+
+class TimeseriesBatch(object):
+    """
+        TimeseriesBatch class
+
+        Per-process buffers of the perfdata to send to each timeseries database (graphite or
+        influxdb). A buffer is sent when it has TIMESERIES_BATCH_SIZE points, or by the flush
+        thread when its oldest point waits for TIMESERIES_BATCH_DELAY milliseconds, and when
+        the process stops.
+
+        The buffer is sent by a function (resource, destination, data) which stores the
+        perfdata in the timeseries spool or retention if the send failed or raised. The perfdata
+        are dropped only if this function raises.
+
+        The statistics of the batches are published for all the processes (TimeseriesStats),
+        see aggregate.
+    """
+    buffers = {}
+    stats_counters = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+    thread = None
+
+    @staticmethod
+    def add(resource, destination, data, sender):
+        """
+        Add perfdata to the buffer of a timeseries database, send the buffer if it is full
+
+        :param resource: graphite or influxdb
+        :type resource: str
+        :param destination: the graphite or influxdb document
+        :type destination: dict
+        :param data: list of perfdata
+        :type data: list
+        :param sender: function sending the perfdata: sender(resource, destination, data)
+        :type sender: function
+        :return: None
+        """
+        key = (resource, destination['_id'])
+        size = current_app.config.get('TIMESERIES_BATCH_SIZE', 0)
+        with TimeseriesBatch.lock:
+            batch = TimeseriesBatch.buffers.get(key)
+            if batch is None:
+                batch = TimeseriesBatch.buffers[key] = {'data': [], 'since': time.time()}
+            batch['destination'] = destination
+            batch['sender'] = sender
+            batch['data'].extend(data)
+            if len(batch['data']) < size:
+                batch = None
+            else:
+                del TimeseriesBatch.buffers[key]
+        if batch is not None:
+            TimeseriesBatch.send(key, batch)
+        if size > 0:
+            # Without batches, there is no buffer to flush
+            TimeseriesBatch.start(current_app._get_current_object())  # pylint: disable=W0212
+
+    @staticmethod
+    def send(key, batch):
+        """
+        Send the perfdata of a buffer and count them
+
+        :param key: resource and id of the timeseries database
+        :type key: tuple
+        :param batch: the buffer
+        :type batch: dict
+        :return: None
+        """
+        start = time.time()
+        try:
+            sent = batch['sender'](key[0], batch['destination'], batch['data'])
+            error = False
+        except Exception:  # pylint: disable=W0703
+            sent = False
+            error = True
+        with TimeseriesBatch.lock:
+            stats = TimeseriesBatch.stats_counters.setdefault(
+                '%s/%s' % key, {'batches': 0, 'points': 0, 'last_size': 0, 'max_size': 0,
+                                'retained': 0, 'dropped': 0, 'last_latency': 0,
+                                'max_latency': 0})
+            stats['batches'] += 1
+            stats['points'] += len(batch['data'])
+            stats['last_size'] = len(batch['data'])
+            stats['max_size'] = max(stats['max_size'], len(batch['data']))
+            if error:
+                stats['dropped'] += len(batch['data'])
+            elif not sent:
+                stats['retained'] += len(batch['data'])
+            # Time between the first point added in the buffer and the end of the send (ms)
+            stats['last_latency'] = int((time.time() - batch['since']) * 1000)
+            stats['max_latency'] = max(stats['max_latency'], stats['last_latency'])
+            stats['last_send'] = int((time.time() - start) * 1000)
+        TimeseriesStats.publish()
+
+    @staticmethod
+    def flush(app, delay=0):
+        """
+        Send the buffers whose oldest point waits for at least delay seconds
+
+        :param app: the backend application
+        :type app: Eve
+        :param delay: minimum age of the buffers to send (seconds), 0 to send all the buffers
+        :type delay: float
+        :return: number of sent points
+        :rtype: int
+        """
+        now = time.time()
+        with TimeseriesBatch.lock:
+            batches = [(key, batch) for key, batch in iteritems(TimeseriesBatch.buffers)
+                       if now - batch['since'] >= delay]
+            for key, _ in batches:
+                del TimeseriesBatch.buffers[key]
+        if batches:
+            with app.test_request_context():
+                for key, batch in batches:
+                    TimeseriesBatch.send(key, batch)
+        return sum(len(batch['data']) for _, batch in batches)
+
+    @staticmethod
+    def work(app, delay):
+        """
+        Send the buffers waiting for delay seconds, until the process stops
+
+        :param app: the backend application
+        :type app: Eve
+        :param delay: maximum time a point waits in a buffer (seconds)
+        :type delay: float
+        :return: None
+        """
+        while not TimeseriesBatch.stop.wait(delay / 2.0):
+            TimeseriesBatch.flush(app, delay)
+
+    @staticmethod
+    def start(app):
+        """
+        Start the flush thread of the process if it is not running, and send all the buffers
+        when the process stops
+
+        :param app: the backend application
+        :type app: Eve
+        :return: None
+        """
+        if TimeseriesBatch.thread is not None and TimeseriesBatch.thread.is_alive():
+            return
+        with TimeseriesBatch.lock:
+            if TimeseriesBatch.thread is not None and TimeseriesBatch.thread.is_alive():
+                return
+            first = TimeseriesBatch.thread is None
+            delay = app.config.get('TIMESERIES_BATCH_DELAY', 1000) / 1000.0
+            TimeseriesBatch.thread = threading.Thread(target=TimeseriesBatch.work,
+                                                      args=(app, delay))
+            TimeseriesBatch.thread.daemon = True
+            TimeseriesBatch.thread.start()
+        if first:
+            atexit.register(TimeseriesBatch.shutdown, app)
+
+    @staticmethod
+    def shutdown(app):
+        """
+        Stop the flush thread and send all the buffers
+
+        :param app: the backend application
+        :type app: Eve
+        :return: None
+        """
+        TimeseriesBatch.stop.set()
+        TimeseriesBatch.flush(app)
+
+    @staticmethod
+    def stats():
+        """
+        Get the statistics of the batches of the process
+
+        :return: points waiting in the buffers and, for each timeseries database (resource/id),
+                 number of batches and points sent, size of the batches, number of points
+                 stored in the retention (send failed) and dropped (error), latency (ms)
+        :rtype: dict
+        """
+        with TimeseriesBatch.lock:
+            pending = dict(('%s/%s' % key, len(batch['data']))
+                           for key, batch in iteritems(TimeseriesBatch.buffers))
+            destinations = dict((key, dict(stats))
+                                for key, stats in iteritems(TimeseriesBatch.stats_counters))
+        return {'pending': pending, 'destinations': destinations}
+
+    @staticmethod
+    def aggregate(processes):
+        """
+        Aggregate the statistics of the batches of some processes
+
+        :param processes: statistics of the batches of each process (see stats)
+        :type processes: dict
+        :return: points waiting in the buffers and, for each timeseries database, the sum of
+                 the counters and the maximum size and latency of all the processes, and the
+                 statistics of each process
+        :rtype: dict
+        """
+        pending = {}
+        destinations = {}
+        for stats in processes.values():
+            for key, count in iteritems(stats.get('pending', {})):
+                pending[key] = pending.get(key, 0) + count
+            for key, counters in iteritems(stats.get('destinations', {})):
+                total = destinations.setdefault(key, {})
+                for name, value in iteritems(counters):
+                    if name.startswith('max_'):
+                        total[name] = max(total.get(name, 0), value)
+                    elif not name.startswith('last_'):
+                        total[name] = total.get(name, 0) + value
+        return {'pending': pending, 'destinations': destinations, 'processes': processes}
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.timeseriesclients`` module
+
+    This module manages the clients of the timeseries databases (carbon / influxdb / statsd)
+"""
+from __future__ import print_function
+import threading
+import time
+from flask import current_app
+from influxdb import InfluxDBClient
+import statsd
+
+from alignak_backend.carboniface import CarbonIface
+
+
+class TimeseriesClients(object):
+    """
+        TimeseriesClients class
+
+        Per-process registry of the clients of the timeseries databases, kept open between the
+        sends. A client is identified by the kind and the id of its destination (graphite,
+        influxdb or statsd document) and by the StatsD prefix, and it is created again when
+        the _etag of the destination changes, when the Eve hooks tell us that the destination
+        was modified or deleted, or after a send error (reset).
+
+        The statsd documents are read again every TIMESERIES_CLIENTS_REFRESH seconds.
+    """
+    clients = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def create(resource, destination, prefix=''):
+        """
+        Create the client of a timeseries database
+
+        :param resource: graphite, influxdb or statsd
+        :type resource: str
+        :param destination: the graphite, influxdb or statsd document
+        :type destination: dict
+        :param prefix: prefix of the StatsD client
+        :type prefix: str
+        :return: the client
+        :rtype: object
+        """
+        if resource == 'graphite':
+            return CarbonIface(destination['carbon_address'], destination['carbon_port'],
+                               persistent=True)
+        if resource == 'influxdb':
+            return InfluxDBClient(destination['address'], destination['port'],
+                                  destination['login'], destination['password'],
+                                  destination['database'], timeout=1)
+        return statsd.StatsClient(destination['address'], destination['port'], prefix=prefix)
+
+    @staticmethod
+    def close(client):
+        """
+        Close a client, if it can be closed
+
+        :param client: the client
+        :type client: object
+        :return: None
+        """
+        close = getattr(client, 'close', None)
+        if close is not None:
+            try:
+                close()
+            except Exception:  # pylint: disable=W0703
+                pass
+
+    @staticmethod
+    def get(resource, destination, prefix=''):
+        """
+        Get the client of a timeseries database, create it if it does not exist or if the
+        destination was modified
+
+        :param resource: graphite, influxdb or statsd
+        :type resource: str
+        :param destination: the graphite, influxdb or statsd document
+        :type destination: dict
+        :param prefix: prefix of the StatsD client
+        :type prefix: str
+        :return: the client
+        :rtype: object
+        """
+        key = (resource, destination['_id'], prefix)
+        with TimeseriesClients.lock:
+            entry = TimeseriesClients.clients.get(key)
+            if entry is not None and entry['etag'] == destination.get('_etag'):
+                return entry['client']
+
+        client = TimeseriesClients.create(resource, destination, prefix)
+        with TimeseriesClients.lock:
+            TimeseriesClients.clients[key] = {'etag': destination.get('_etag'),
+                                              'client': client, 'read': time.time()}
+        if entry is not None:
+            TimeseriesClients.close(entry['client'])
+        return client
+
+    @staticmethod
+    def get_statsd(statsd_id, prefix):
+        """
+        Get the client of a StatsD daemon, the statsd document is read only if the client does
+        not exist or was read more than TIMESERIES_CLIENTS_REFRESH seconds ago
+
+        :param statsd_id: id of the statsd document
+        :type statsd_id: ObjectId
+        :param prefix: prefix of the StatsD client
+        :type prefix: str
+        :return: the client, None if the statsd document does not exist
+        :rtype: statsd.StatsClient or None
+        """
+        key = ('statsd', statsd_id, prefix)
+        refresh = current_app.config.get('TIMESERIES_CLIENTS_REFRESH', 60)
+        with TimeseriesClients.lock:
+            entry = TimeseriesClients.clients.get(key)
+            if entry is not None and entry['read'] + refresh > time.time():
+                return entry['client']
+
+        item = current_app.data.driver.db['statsd'].find_one({'_id': statsd_id})
+        if item is None:
+            TimeseriesClients.reset('statsd', statsd_id)
+            return None
+        client = TimeseriesClients.get('statsd', item, prefix)
+        with TimeseriesClients.lock:
+            if key in TimeseriesClients.clients:
+                TimeseriesClients.clients[key]['read'] = time.time()
+        return client
+
+    @staticmethod
+    def reset(resource, destination_id):
+        """
+        Close and remove the clients of a destination, they will be created again when needed
+
+        :param resource: graphite, influxdb or statsd
+        :type resource: str
+        :param destination_id: id of the destination document
+        :type destination_id: ObjectId
+        :return: None
+        """
+        with TimeseriesClients.lock:
+            keys = [key for key in TimeseriesClients.clients
+                    if key[0] == resource and key[1] == destination_id]
+            entries = [TimeseriesClients.clients.pop(key) for key in keys]
+        for entry in entries:
+            TimeseriesClients.close(entry['client'])
+
+    @staticmethod
+    def on_updated_graphite(updates, original):
+        """
+            What to do when a graphite is updated ...
+        """
+        # pylint: disable=unused-argument
+        TimeseriesClients.reset('graphite', original['_id'])
+
+    @staticmethod
+    def on_deleted_item_graphite(item):
+        """
+            What to do when a graphite is deleted ...
+        """
+        TimeseriesClients.reset('graphite', item['_id'])
+
+    @staticmethod
+    def on_updated_influxdb(updates, original):
+        """
+            What to do when an influxdb is updated ...
+        """
+        # pylint: disable=unused-argument
+        TimeseriesClients.reset('influxdb', original['_id'])
+
+    @staticmethod
+    def on_deleted_item_influxdb(item):
+        """
+            What to do when an influxdb is deleted ...
+        """
+        TimeseriesClients.reset('influxdb', item['_id'])
+
+    @staticmethod
+    def on_updated_statsd(updates, original):
+        """
+            What to do when a statsd is updated ...
+        """
+        # pylint: disable=unused-argument
+        TimeseriesClients.reset('statsd', original['_id'])
+
+    @staticmethod
+    def on_deleted_item_statsd(item):
+        """
+            What to do when a statsd is deleted ...
+        """
+        TimeseriesClients.reset('statsd', item['_id'])
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.timeseriesspool`` module
+
+    This module manages the spool files of the perfdata not sent to the timeseries databases
+"""
+from __future__ import print_function
+import atexit
+import json
+import os
+import threading
+import time
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from future.utils import iteritems
+from flask import current_app
+
+
+class TimeseriesSpool(object):
+    """
+        TimeseriesSpool class
+
+        When TIMESERIES_SPOOL is a directory, the perfdata not sent to a timeseries database
+        are appended to spool files rather than stored in the timeseries retention collection.
+
+        The spool of a timeseries database is the directory <resource>-<id>, split in segments:
+        files with one JSON list per perfdata (name, realm, host, service, value, timestamp,
+        uom). Each process writes its own segment (.open), closed (.spool) when it has
+        TIMESERIES_SPOOL_SEGMENT_SIZE bytes, after segment_age seconds or when the process
+        stops. The segments are sent again, oldest first, by the timeseries cron: the offset of
+        the sent perfdata is written in a .ack file and the segment is deleted when all its
+        perfdata are sent.
+    """
+    # Maximum time a segment is written (seconds)
+    segment_age = 60
+    # A segment not closed and not modified for this time belongs to a stopped process
+    stale_age = 300
+    fields = ['name', 'realm', 'host', 'service', 'value', 'timestamp', 'uom']
+
+    writers = {}
+    lock = threading.Lock()
+    counter = 0
+
+    @staticmethod
+    def get_directory(resource, destination_id):
+        """
+        Get the spool directory of a timeseries database
+
+        :param resource: graphite or influxdb
+        :type resource: str
+        :param destination_id: id of the graphite or influxdb
+        :type destination_id: ObjectId
+        :return: path of the directory, None if the spool is not activated
+        :rtype: str or None
+        """
+        spool = current_app.config.get('TIMESERIES_SPOOL', '')
+        if not spool:
+            return None
+        return os.path.join(spool, '%s-%s' % (resource, destination_id))
+
+    @staticmethod
+    def write(resource, destination_id, data):
+        """
+        Append perfdata to the current segment of a timeseries database
+
+        :param resource: graphite or influxdb
+        :type resource: str
+        :param destination_id: id of the graphite or influxdb
+        :type destination_id: ObjectId
+        :param data: list of perfdata
+        :type data: list
+        :return: True if written, False if the spool is not activated
+        :rtype: bool
+        """
+        directory = TimeseriesSpool.get_directory(resource, destination_id)
+        if directory is None:
+            return False
+        records = ''.join([json.dumps([perf.get(field) for field in TimeseriesSpool.fields],
+                                      separators=(',', ':')) + '\n' for perf in data])
+        max_size = current_app.config.get('TIMESERIES_SPOOL_SEGMENT_SIZE', 10485760)
+        with TimeseriesSpool.lock:
+            writer = TimeseriesSpool.writers.get(directory)
+            if writer is not None and (writer['size'] >= max_size or
+                                       time.time() - writer['opened'] >=
+                                       TimeseriesSpool.segment_age):
+                TimeseriesSpool.close(directory)
+                writer = None
+            if writer is None:
+                writer = TimeseriesSpool.open(directory)
+            records = records.encode('utf-8')
+            writer['file'].write(records)
+            writer['file'].flush()
+            writer['size'] += len(records)
+        return True
+
+    @staticmethod
+    def open(directory):
+        """
+        Open a new segment in a spool directory, the lock must be held
+
+        :param directory: the spool directory
+        :type directory: str
+        :return: the segment writer
+        :rtype: dict
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if not TimeseriesSpool.writers and not TimeseriesSpool.counter:
+            atexit.register(TimeseriesSpool.close_all)
+        TimeseriesSpool.counter += 1
+        name = '%015d-%d-%d' % (int(time.time() * 1000), os.getpid(), TimeseriesSpool.counter)
+        path = os.path.join(directory, name)
+        writer = {'path': path, 'file': open(path + '.open', 'ab'), 'size': 0,
+                  'opened': time.time()}
+        TimeseriesSpool.writers[directory] = writer
+        return writer
+
+    @staticmethod
+    def close(directory):
+        """
+        Close the current segment of a spool directory, the lock must be held
+
+        :param directory: the spool directory
+        :type directory: str
+        :return: None
+        """
+        writer = TimeseriesSpool.writers.pop(directory, None)
+        if writer is not None:
+            writer['file'].close()
+            TimeseriesSpool.rename(writer['path'] + '.open')
+
+    @staticmethod
+    def rename(path):
+        """
+        Rename a segment from .open to .spool (closed)
+
+        The segment may have been renamed by the replay if it was not written for a long time,
+        see get_segments.
+
+        :param path: path of the .open segment
+        :type path: str
+        :return: path of the closed segment, None if the segment does not exist anymore
+        :rtype: str or None
+        """
+        closed = path.rsplit('.', 1)[0] + '.spool'
+        try:
+            os.rename(path, closed)
+        except OSError:
+            if not os.path.exists(closed):
+                return None
+        return closed
+
+    @staticmethod
+    def close_all():
+        """
+        Close the current segments of the process
+
+        :return: None
+        """
+        with TimeseriesSpool.lock:
+            for directory in list(TimeseriesSpool.writers):
+                TimeseriesSpool.close(directory)
+
+    @staticmethod
+    def get_segments(directory):
+        """
+        Get the segments of a spool directory which are no more written, oldest first
+
+        A segment still open but not written for stale_age seconds is renamed to .spool before
+        it is replayed: if its process writes again, it opens a new segment (the segment is
+        older than segment_age) and does not rename this one again, so it is not replayed twice.
+
+        :param directory: the spool directory
+        :type directory: str
+        :return: paths of the segments
+        :rtype: list
+        """
+        segments = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if name.endswith('.spool'):
+                segments.append(path)
+            elif name.endswith('.open') and \
+                    time.time() - os.path.getmtime(path) > TimeseriesSpool.stale_age:
+                path = TimeseriesSpool.rename(path)
+                if path is not None:
+                    segments.append(path)
+        return segments
+
+    @staticmethod
+    def replay(sender, batch=1000):
+        """
+        Send again the perfdata of the spool segments, by batches
+
+        :param sender: function sending perfdata: sender(resource, destination, data), returns
+                       True if sent
+        :type sender: function
+        :param batch: number of perfdata sent at once
+        :type batch: int
+        :return: number of sent perfdata for each timeseries database (resource/id)
+        :rtype: dict
+        """
+        spool = current_app.config.get('TIMESERIES_SPOOL', '')
+        if not spool or not os.path.isdir(spool):
+            return {}
+        with TimeseriesSpool.lock:
+            # Close the old segments of this process
+            for directory, writer in list(iteritems(TimeseriesSpool.writers)):
+                if time.time() - writer['opened'] >= TimeseriesSpool.segment_age:
+                    TimeseriesSpool.close(directory)
+
+        counts = {}
+        for name in sorted(os.listdir(spool)):
+            resource, _, destination_id = name.partition('-')
+            if resource not in ['graphite', 'influxdb']:
+                continue
+            try:
+                destination = current_app.data.driver.db[resource].find_one(
+                    {'_id': ObjectId(destination_id)})
+            except InvalidId:
+                continue
+            counts[name.replace('-', '/', 1)] = 0
+            for segment in TimeseriesSpool.get_segments(os.path.join(spool, name)):
+                if destination is None:
+                    # The timeseries database was deleted
+                    TimeseriesSpool.remove(segment)
+                    continue
+                count, done = TimeseriesSpool.replay_segment(segment, resource, destination,
+                                                             sender, batch)
+                counts[name.replace('-', '/', 1)] += count
+                if not done:
+                    break
+        return counts
+
+    @staticmethod
+    def replay_segment(segment, resource, destination, sender, batch):
+        """
+        Send again the perfdata of a segment, since the offset of the sent perfdata
+
+        :param segment: path of the segment
+        :type segment: str
+        :param resource: graphite or influxdb
+        :type resource: str
+        :param destination: the graphite or influxdb document
+        :type destination: dict
+        :param sender: function sending perfdata
+        :type sender: function
+        :param batch: number of perfdata sent at once
+        :type batch: int
+        :return: number of sent perfdata, True if the segment is fully sent (and deleted)
+        :rtype: tuple
+        """
+        ack = segment.rsplit('.', 1)[0] + '.ack'
+        offset = 0
+        if os.path.exists(ack):
+            with open(ack) as ack_file:
+                offset = int(ack_file.read() or 0)
+        count = 0
+        with open(segment, 'rb') as segment_file:
+            segment_file.seek(offset)
+            while True:
+                lines = [line for line in [segment_file.readline() for _ in range(batch)]
+                         if line.endswith(b'\n')]
+                if not lines:
+                    break
+                data = [dict(zip(TimeseriesSpool.fields, json.loads(line.decode('utf-8'))))
+                        for line in lines]
+                if not sender(resource, destination, data):
+                    return count, False
+                offset += sum(len(line) for line in lines)
+                count += len(data)
+                with open(ack, 'w') as ack_file:
+                    ack_file.write(str(offset))
+        TimeseriesSpool.remove(segment)
+        return count, True
+
+    @staticmethod
+    def remove(segment):
+        """
+        Delete a segment and its .ack file
+
+        :param segment: path of the segment
+        :type segment: str
+        :return: None
+        """
+        ack = segment.rsplit('.', 1)[0] + '.ack'
+        for path in [segment, ack]:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.timeseriesstats`` module
+
+    This module shares the statistics of the timeseries sends of all the backend processes
+"""
+from __future__ import print_function
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+from future.utils import iteritems
+from flask import current_app
+from pymongo import ASCENDING
+
+from alignak_backend.lease import Lease
+
+
+class TimeseriesStats(object):
+    """
+        TimeseriesStats class
+
+        The statistics of the timeseries sends (batches, circuit breakers) are kept in each
+        backend process (or jobs worker). Each process publishes them in the timeseriesstats
+        collection, one document per process, at most every `interval` seconds when it sends
+        perfdata, and removes its document when it stops. The endpoints read the documents
+        of all the processes.
+
+        A document not updated for `expiry` seconds (process killed, or which did not send
+        anything) is ignored, then removed by a TTL index.
+    """
+    interval = 10
+    expiry = 3600
+
+    sources = {}
+    lock = threading.Lock()
+    published = 0
+    stopped = False
+
+    @staticmethod
+    def register(name, function):
+        """
+        Register a source of statistics
+
+        :param name: name of the statistics in the published document
+        :type name: str
+        :param function: function returning the statistics of the process
+        :type function: function
+        :return: None
+        """
+        TimeseriesStats.sources[name] = function
+
+    @staticmethod
+    def publish(force=False):
+        """
+        Publish the statistics of the process, if not published for `interval` seconds
+
+        :param force: publish even if published less than `interval` seconds ago
+        :type force: bool
+        :return: True if published
+        :rtype: bool
+        """
+        with TimeseriesStats.lock:
+            if TimeseriesStats.stopped or not TimeseriesStats.sources or \
+                    (not force and time.time() - TimeseriesStats.published <
+                     TimeseriesStats.interval):
+                return False
+            first = not TimeseriesStats.published
+            TimeseriesStats.published = time.time()
+
+        stats_db = current_app.data.driver.db['timeseriesstats']
+        if first:
+            stats_db.create_index([('updated', ASCENDING)],
+                                  expireAfterSeconds=TimeseriesStats.expiry)
+            atexit.register(TimeseriesStats.remove,
+                            current_app._get_current_object())  # pylint: disable=W0212
+        document = {'updated': datetime.utcnow()}
+        for name, function in iteritems(TimeseriesStats.sources):
+            document[name] = function()
+        stats_db.replace_one({'_id': Lease.get_owner()}, document, upsert=True)
+        return True
+
+    @staticmethod
+    def remove(app):
+        """
+        Remove the statistics of the process, when it stops
+
+        :param app: the backend application
+        :type app: Eve
+        :return: None
+        """
+        with TimeseriesStats.lock:
+            TimeseriesStats.stopped = True
+        with app.test_request_context():
+            app.data.driver.db['timeseriesstats'].delete_one({'_id': Lease.get_owner()})
+
+    @staticmethod
+    def get(name):
+        """
+        Get the statistics published by all the backend processes
+
+        :param name: name of the statistics
+        :type name: str
+        :return: statistics of each process
+        :rtype: dict
+        """
+        search = {'updated': {'$gt': datetime.utcnow() -
+                              timedelta(seconds=TimeseriesStats.expiry)},
+                  name: {'$exists': True}}
+        return dict((document['_id'], document[name]) for document in
+                    current_app.data.driver.db['timeseriesstats'].find(search))
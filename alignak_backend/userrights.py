@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    ``alignak_backend.userrights`` module
+
+    This module manages the rights of the users (computed from the userrestrictrole)
+"""
+from __future__ import print_function
+import time
+from flask import current_app, g
+from pymongo import UpdateOne
+from alignak_backend.realmtree import RealmTree
+
+
+class UserRights(object):
+    """
+        UserRights class
+
+        The rights of a user are computed when a userrestrictrole, a user or a realm is modified
+        (once at the end of the request for the realms) and they are stored in the _user_rights
+        field of the user. This field is not in the user schema, so it is not available through
+        the API.
+    """
+    # Right, custom right, name of the rights dictionary
+    rights_map = [
+        ('read', False, 'resources_get'),
+        ('read', True, 'resources_get_custom'),
+        ('create', False, 'resources_post'),
+        ('update', False, 'resources_patch'),
+        ('update', True, 'resources_patch_custom'),
+        ('delete', False, 'resources_delete'),
+        ('delete', True, 'resources_delete_custom'),
+    ]
+
+    @staticmethod
+    def compute(userrestrictroles, realm_tree):
+        """
+        Compute the rights of a user from its userrestrictrole
+
+        The read rights are also stored as the realms without their sub-realms
+        (resources_get_direct) and the paths of the realms with their sub-realms
+        (resources_get_paths), to be used with the _realm_path of the documents.
+
+        :param userrestrictroles: the userrestrictrole of the user (from mongo)
+        :type userrestrictroles: list
+        :param realm_tree: the realms tree
+        :type realm_tree: RealmTree
+        :return: realms for each resource and each right
+        :rtype: dict
+        """
+        # We get all resources we have in the backend for the userrestrictrole with *
+        resource_list = list(current_app.config['DOMAIN'])
+
+        rights = {'version': int(time.time() * 1000)}
+        for _, _, name in UserRights.rights_map:
+            rights[name] = {}
+        get_parents = {}
+        for data in userrestrictroles:
+            for right, custom, name in UserRights.rights_map:
+                UserRights.add_resources_realms(right, data, custom, rights[name],
+                                                resource_list, realm_tree.all_children,
+                                                realm_tree.parents, get_parents)
+
+        rights['resources_get_parents'] = {}
+        resources_get = rights['resources_get']
+        for resource in resources_get:
+            resources_get[resource] = list(set(resources_get[resource]))
+            if resource in rights['resources_get_custom']:
+                rights['resources_get_custom'][resource] = \
+                    list(set(rights['resources_get_custom'][resource]))
+            rights['resources_get_parents'][resource] = [
+                item for item in get_parents[resource] if item not in resources_get[resource]
+            ]
+        for name in ['resources_post', 'resources_patch', 'resources_delete']:
+            for resource in rights[name]:
+                rights[name][resource] = list(set(rights[name][resource]))
+
+        rights['resources_get_direct'] = {}
+        rights['resources_get_paths'] = {}
+        for resource in resources_get:
+            paths = set()
+            for data in userrestrictroles:
+                if 'read' in data['crud'] and data['sub_realm'] \
+                        and data['resource'] in ['*', resource] \
+                        and data['realm'] in realm_tree.id_paths:
+                    paths.add(realm_tree.id_paths[data['realm']])
+            # Only keep the paths which are not in the tree of another path
+            paths = [path for path in paths
+                     if not [other for other in paths if other != path and path.startswith(other)]]
+            rights['resources_get_paths'][resource] = paths
+            rights['resources_get_direct'][resource] = [
+                realm for realm in resources_get[resource]
+                if not [path for path in paths
+                        if realm_tree.id_paths.get(realm, '').startswith(path)]
+            ]
+        return rights
+
+    @staticmethod
+    def add_resources_realms(right, data, custom, resource, resource_list, children_realms,
+                             parent_realms, parents):
+        """
+        Add realms found for rights.
+
+        :param right: right in list: create, read, update, delete
+        :type right: str
+        :param data: data (one record) from userrestrictrole (from mongo)
+        :type data: dict
+        :param custom: True if it's a custom right, otherwise False
+        :type custom: bool
+        :param resource: variable where store realm rights
+        :type resource: dict
+        :param resource_list: list of all resources of the backend
+        :type resource_list: dict
+        :param children_realms: all children of each realm
+        :type children_realms: dict
+        :param parent_realms: tree parents of each realm
+        :type parent_realms: dict
+        :param parents: variable where store parents realms (only used for read right)
+        :type parents: dict
+        :return: None
+        """
+        # pylint: disable=too-many-arguments
+        search_field = right
+        if custom:
+            search_field = 'custom'
+        if data['resource'] == '*':
+            my_resources = resource_list
+        else:
+            my_resources = [data['resource']]
+        if search_field in data['crud']:
+            for my_resource in my_resources:
+                if my_resource not in resource:
+                    resource[my_resource] = []
+                if right == 'read' and not custom and my_resource not in parents:
+                    parents[my_resource] = []
+                resource[my_resource].append(data['realm'])
+                if right == 'read' and not custom:
+                    parents[my_resource].extend(parent_realms.get(data['realm'], []))
+                if data['sub_realm']:
+                    resource[my_resource].extend(children_realms.get(data['realm'], []))
+
+    @staticmethod
+    def get_user_rights(user):
+        """
+        Get the materialized rights of a user, compute and store them if they do not exist
+
+        :param user: the user (from mongo)
+        :type user: dict
+        :return: realms for each resource and each right
+        :rtype: dict
+        """
+        if '_user_rights' in user:
+            return user['_user_rights']
+        return UserRights.update([user['_id']])[user['_id']]
+
+    @staticmethod
+    def update(user_ids=None):
+        """
+        Compute and store the rights of some users, with one bulk write
+
+        :param user_ids: list of the users id, None for all the users
+        :type user_ids: list or None
+        :return: rights of the updated users
+        :rtype: dict
+        """
+        users_drv = current_app.data.driver.db['user']
+        userrestrictroles_drv = current_app.data.driver.db['userrestrictrole']
+        realm_tree = RealmTree.get()
+
+        if user_ids is None:
+            user_ids = [user['_id'] for user in users_drv.find({}, {'_id': 1})]
+            roles_search = {}
+        else:
+            roles_search = {'user': {'$in': user_ids}}
+
+        roles = {}
+        for user_id in user_ids:
+            roles[user_id] = []
+        for role in userrestrictroles_drv.find(roles_search):
+            if role['user'] in roles:
+                roles[role['user']].append(role)
+
+        users_rights = {}
+        requests = []
+        for user_id in user_ids:
+            users_rights[user_id] = UserRights.compute(roles[user_id], realm_tree)
+            requests.append(UpdateOne({'_id': user_id},
+                                      {'$set': {'_user_rights': users_rights[user_id]}}))
+        if requests:
+            users_drv.bulk_write(requests, ordered=False)
+        return users_rights
+
+    @staticmethod
+    def on_inserted_user(items):
+        """
+            What to do when some users are inserted ...
+        """
+        UserRights.update([item['_id'] for item in items])
+
+    @staticmethod
+    def on_inserted_userrestrictrole(items):
+        """
+            What to do when some userrestrictrole are inserted ...
+        """
+        UserRights.update(list({item['user'] for item in items}))
+
+    @staticmethod
+    def on_updated_userrestrictrole(updates, original):
+        """
+            What to do when a userrestrictrole is updated ...
+        """
+        user_ids = [original['user']]
+        if 'user' in updates and updates['user'] != original['user']:
+            user_ids.append(updates['user'])
+        UserRights.update(user_ids)
+
+    @staticmethod
+    def on_deleted_item_userrestrictrole(item):
+        """
+            What to do when a userrestrictrole is deleted ...
+        """
+        UserRights.update([item['user']])
+
+    @staticmethod
+    def on_deleted_resource_userrestrictrole():
+        """
+            What to do when all the userrestrictrole are deleted ...
+        """
+        UserRights.update()
+
+    @staticmethod
+    def on_realm_changed(*args):
+        """
+            What to do when a realm (or a whole resource) is inserted / updated / deleted ...
+
+            The realms tree is used for the rights of all the users, so all the rights are
+            computed again at the end of the request (see flush_request)
+        """
+        # pylint: disable=unused-argument
+        g.dirty_user_rights = True
+
+    @staticmethod
+    def flush_request(response):
+        """
+        Compute the rights of all the users if some realms were modified during the request
+
+        :param response: the response of the request
+        :type response: flask.Response
+        :return: the response
+        :rtype: flask.Response
+        """
+        if g.pop('dirty_user_rights', False):
+            UserRights.update()
+        return response
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test verify the circuit breakers of the timeseries databases
+"""
+
+import time
+import unittest2
+from bson.objectid import ObjectId
+from flask import Flask
+from alignak_backend.circuitbreaker import CircuitBreaker
+
+
+class TestCircuitBreaker(unittest2.TestCase):
+    """
+    This class test the circuit breakers of the timeseries databases
+    """
+
+    def setUp(self):
+        """
+        Create an application with the circuit breakers settings
+
+        :return: None
+        """
+        self.app = Flask(__name__)
+        self.app.config['TIMESERIES_BREAKER_FAILURES'] = 3
+        self.app.config['TIMESERIES_BREAKER_DELAY'] = 10
+        self.app.config['TIMESERIES_BREAKER_DELAY_MAX'] = 35
+        CircuitBreaker.breakers.clear()
+        self.destination_id = ObjectId()
+
+    def tearDown(self):
+        """
+        Delete the circuit breakers
+
+        :return: None
+        """
+        CircuitBreaker.breakers.clear()
+
+    def retry(self):
+        """
+        Simulate the end of the delay of the open breaker
+
+        :return: None
+        """
+        CircuitBreaker.breakers[('graphite', self.destination_id)]['retry'] = time.time() - 1
+
+    def test_open(self):
+        """
+        Test the breaker is open after TIMESERIES_BREAKER_FAILURES consecutive failures
+
+        :return: None
+        """
+        with self.app.test_request_context():
+            assert CircuitBreaker.allow('graphite', self.destination_id)
+            CircuitBreaker.record('graphite', self.destination_id, False)
+            CircuitBreaker.record('graphite', self.destination_id, False)
+            # A success resets the consecutive failures
+            CircuitBreaker.record('graphite', self.destination_id, True)
+            CircuitBreaker.record('graphite', self.destination_id, False)
+            CircuitBreaker.record('graphite', self.destination_id, False)
+            assert CircuitBreaker.allow('graphite', self.destination_id)
+
+            CircuitBreaker.record('graphite', self.destination_id, False)
+            assert not CircuitBreaker.allow('graphite', self.destination_id)
+            assert not CircuitBreaker.allow('graphite', self.destination_id)
+            # The other databases are not concerned
+            assert CircuitBreaker.allow('influxdb', self.destination_id)
+            assert CircuitBreaker.allow('graphite', ObjectId())
+
+        stats = CircuitBreaker.stats()['graphite/%s' % self.destination_id]
+        self.assertEqual('open', stats['state'])
+        self.assertEqual((3, 1, 2), (stats['failures'], stats['opened'], stats['rejected']))
+        assert 9 <= stats['retry_in'] <= 10
+
+        # Breakers disabled
+        self.app.config['TIMESERIES_BREAKER_FAILURES'] = 0
+        with self.app.test_request_context():
+            for _ in range(5):
+                CircuitBreaker.record('influxdb', self.destination_id, False)
+            assert CircuitBreaker.allow('influxdb', self.destination_id)
+
+    def test_half_open(self):
+        """
+        Test a single send is tried after the delay, the breaker is closed if it succeeds
+
+        :return: None
+        """
+        with self.app.test_request_context():
+            for _ in range(3):
+                CircuitBreaker.record('graphite', self.destination_id, False)
+            assert not CircuitBreaker.allow('graphite', self.destination_id)
+
+            self.retry()
+            assert CircuitBreaker.allow('graphite', self.destination_id)
+            self.assertEqual('half-open', CircuitBreaker.stats()[
+                'graphite/%s' % self.destination_id]['state'])
+            # Only one probe
+            assert not CircuitBreaker.allow('graphite', self.destination_id)
+
+            CircuitBreaker.record('graphite', self.destination_id, True)
+            assert CircuitBreaker.allow('graphite', self.destination_id)
+            stats = CircuitBreaker.stats()['graphite/%s' % self.destination_id]
+            self.assertEqual(('closed', 0, 0), (stats['state'], stats['failures'],
+                                                stats['retry_in']))
+
+            # Open again after TIMESERIES_BREAKER_FAILURES failures, with the initial delay
+            for _ in range(2):
+                CircuitBreaker.record('graphite', self.destination_id, False)
+            assert CircuitBreaker.allow('graphite', self.destination_id)
+            CircuitBreaker.record('graphite', self.destination_id, False)
+            assert not CircuitBreaker.allow('graphite', self.destination_id)
+            breaker = CircuitBreaker.breakers[('graphite', self.destination_id)]
+            self.assertEqual((10, 2), (breaker['delay'], breaker['opened']))
+
+    def test_delay(self):
+        """
+        Test the delay is doubled each time the half-open probe fails, up to
+        TIMESERIES_BREAKER_DELAY_MAX
+
+        :return: None
+        """
+        delays = []
+        with self.app.test_request_context():
+            for _ in range(3):
+                CircuitBreaker.record('graphite', self.destination_id, False)
+            breaker = CircuitBreaker.breakers[('graphite', self.destination_id)]
+            delays.append(breaker['delay'])
+            for _ in range(4):
+                self.retry()
+                assert CircuitBreaker.allow('graphite', self.destination_id)
+                CircuitBreaker.record('graphite', self.destination_id, False)
+                self.assertEqual('open', breaker['state'])
+                assert not CircuitBreaker.allow('graphite', self.destination_id)
+                delays.append(breaker['delay'])
+        self.assertEqual([10, 20, 35, 35, 35], delays)
+        assert breaker['retry'] > time.time() + 30
+        # The breaker was open once, the failed probes do not count
+        self.assertEqual(1, breaker['opened'])
+
+    def test_aggregate(self):
+        """
+        Test the aggregation of the state of the breakers of all the processes
+
+        :return: None
+        """
+        key = 'graphite/%s' % self.destination_id
+        processes = {
+            'p1': {key: {'state': 'closed', 'failures': 0, 'opened': 1, 'rejected': 4,
+                         'retry_in': 0}},
+            'p2': {key: {'state': 'half-open', 'failures': 3, 'opened': 2, 'rejected': 1,
+                         'retry_in': 0},
+                   'influxdb/1': {'state': 'closed', 'failures': 1, 'opened': 0,
+                                  'rejected': 0, 'retry_in': 0}},
+            'p3': {key: {'state': 'open', 'failures': 3, 'opened': 1, 'rejected': 2,
+                         'retry_in': 8}},
+        }
+        total = CircuitBreaker.aggregate(processes)
+        self.assertEqual({'state': 'open', 'not_closed': 2, 'opened': 4, 'rejected': 7,
+                          'retry_in': 8}, total['destinations'][key])
+        self.assertEqual('closed', total['destinations']['influxdb/1']['state'])
+        self.assertEqual(processes, total['processes'])
+
+    def test_lost_probe(self):
+        """
+        Test the breaker is open again when the half-open probe does not record its result
+        in time
+
+        :return: None
+        """
+        with self.app.test_request_context():
+            for _ in range(3):
+                CircuitBreaker.record('graphite', self.destination_id, False)
+            self.retry()
+            assert CircuitBreaker.allow('graphite', self.destination_id)
+            breaker = CircuitBreaker.breakers[('graphite', self.destination_id)]
+            self.assertEqual('half-open', breaker['state'])
+            assert breaker['retry'] > time.time() + 9
+            assert not CircuitBreaker.allow('graphite', self.destination_id)
+
+            # The probe raised before recording its result: at the deadline, the breaker is
+            # open again with twice the delay
+            self.retry()
+            assert not CircuitBreaker.allow('graphite', self.destination_id)
+            self.assertEqual(('open', 20, 4), (breaker['state'], breaker['delay'],
+                                               breaker['failures']))
+            assert breaker['retry'] > time.time() + 19
+
+            # Then a new probe
+            self.retry()
+            assert CircuitBreaker.allow('graphite', self.destination_id)
+            CircuitBreaker.record('graphite', self.destination_id, True)
+            self.assertEqual('closed', breaker['state'])
+
+    def test_send_raises(self):
+        """
+        Test a send which raises is recorded as a failure
+
+        :return: None
+        """
+        from alignak_backend.timeseries import Timeseries
+
+        def send(data, destination):
+            """Send which raises"""
+            raise IOError('Connection reset by peer')
+
+        send_graphite = Timeseries.send_to_timeseries_graphite
+        Timeseries.send_to_timeseries_graphite = staticmethod(send)
+        try:
+            with self.app.test_request_context():
+                for _ in range(3):
+                    with self.assertRaises(IOError):
+                        Timeseries.send_now('graphite', {'_id': self.destination_id}, [])
+                assert not CircuitBreaker.allow('graphite', self.destination_id)
+
+                # The half-open probe raises: the breaker is open again at once
+                self.retry()
+                with self.assertRaises(IOError):
+                    Timeseries.send_now('graphite', {'_id': self.destination_id}, [])
+                breaker = CircuitBreaker.breakers[('graphite', self.destination_id)]
+                self.assertEqual(('open', 20), (breaker['state'], breaker['delay']))
+        finally:
+            Timeseries.send_to_timeseries_graphite = staticmethod(send_graphite)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test verify the hosts, services and users of the history items
+"""
+
+import os
+import json
+import time
+import shlex
+import subprocess
+import requests
+import unittest2
+from bson.objectid import ObjectId
+
+
+class TestHistory(unittest2.TestCase):
+    """
+    This class test the hosts, services and users set in the history items
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        This method:
+          * delete mongodb database
+          * start the backend with uwsgi
+          * log in the backend and get the token
+          * create the hosts srv001 and srv002, both with a service ping
+
+        :return: None
+        """
+        # Set test mode for Alignak backend
+        os.environ['TEST_ALIGNAK_BACKEND'] = '1'
+        os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'] = 'alignak-backend-test'
+
+        # Delete used mongo DBs
+        exit_code = subprocess.call(
+            shlex.split(
+                'mongo %s --eval "db.dropDatabase()"' % os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'])
+        )
+        assert exit_code == 0
+
+        cls.p = subprocess.Popen(['uwsgi', '--plugin', 'python', '-w', 'alignakbackend:app',
+                                  '--socket', '0.0.0.0:5000',
+                                  '--protocol=http', '--enable-threads', '--pidfile',
+                                  '/tmp/uwsgi.pid'])
+        time.sleep(3)
+
+        cls.endpoint = 'http://127.0.0.1:5000'
+
+        headers = {'Content-Type': 'application/json'}
+        params = {'username': 'admin', 'password': 'admin', 'action': 'generate'}
+        # get token
+        response = requests.post(cls.endpoint + '/login', json=params, headers=headers)
+        resp = response.json()
+        cls.token = resp['token']
+        cls.auth = requests.auth.HTTPBasicAuth(cls.token, '')
+
+        # get realms and users
+        response = requests.get(cls.endpoint + '/realm', auth=cls.auth)
+        resp = response.json()
+        cls.realm_all = resp['_items'][0]['_id']
+        response = requests.get(cls.endpoint + '/user', params={'where': '{"name": "admin"}'},
+                                auth=cls.auth)
+        resp = response.json()
+        cls.user_admin = resp['_items'][0]['_id']
+
+        # Add command
+        data = json.loads(open('cfg/command_ping.json').read())
+        data['_realm'] = cls.realm_all
+        response = requests.post(cls.endpoint + '/command', json=data, headers=headers,
+                                 auth=cls.auth)
+        command = response.json()['_id']
+
+        # Add the hosts and their service
+        cls.hosts = {}
+        cls.services = {}
+        for name in ['srv001', 'srv002']:
+            data = json.loads(open('cfg/host_srv001.json').read())
+            data['name'] = name
+            data['check_command'] = command
+            del data['realm']
+            data['_realm'] = cls.realm_all
+            response = requests.post(cls.endpoint + '/host', json=data, headers=headers,
+                                     auth=cls.auth)
+            cls.hosts[name] = response.json()['_id']
+
+            data = json.loads(open('cfg/service_srv001_ping.json').read())
+            data['host'] = cls.hosts[name]
+            data['check_command'] = command
+            data['_realm'] = cls.realm_all
+            response = requests.post(cls.endpoint + '/service', json=data, headers=headers,
+                                     auth=cls.auth)
+            cls.services[name] = response.json()['_id']
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Kill uwsgi
+
+        :return: None
+        """
+        subprocess.call(['uwsgi', '--stop', '/tmp/uwsgi.pid'])
+        time.sleep(2)
+
+    @classmethod
+    def tearDown(cls):
+        """
+        Delete the history
+
+        :return: None
+        """
+        requests.delete(cls.endpoint + '/history', auth=cls.auth)
+
+    def test_pre_history_post(self):
+        """
+        Test the hosts, services and users of a batch of history items, given by id or by
+        name, are found
+
+        :return: None
+        """
+        from alignak_backend.app import app, pre_history_post
+
+        srv001 = ObjectId(self.hosts['srv001'])
+        srv002 = ObjectId(self.hosts['srv002'])
+        ping001 = ObjectId(self.services['srv001'])
+        ping002 = ObjectId(self.services['srv002'])
+        admin = ObjectId(self.user_admin)
+        realm_all = ObjectId(self.realm_all)
+        unknown = ObjectId()
+
+        items = [
+            {'host': srv001, 'service': ping001, 'user': admin},
+            {'host_name': 'srv002', 'service_name': 'ping', 'user_name': 'admin'},
+            {'host_name': 'srv001', 'service_name': 'unknown'},
+            {'host': srv002, 'user_name': 'unknown'},
+            {'host_name': 'unknown', 'service_name': 'ping'},
+            {'host': unknown, 'service': ping001},
+            {'service': ping002}
+        ]
+        with app.test_request_context():
+            pre_history_post(items)
+
+        # Host, service and user by id
+        self.assertEqual({'host': srv001, 'host_name': 'srv001',
+                          'service': ping001, 'service_name': 'ping',
+                          'user': admin, 'user_name': 'admin',
+                          '_realm': realm_all}, items[0])
+        # Host, service and user by name: the service of the host
+        self.assertEqual({'host': srv002, 'host_name': 'srv002',
+                          'service': ping002, 'service_name': 'ping',
+                          'user': admin, 'user_name': 'admin',
+                          '_realm': realm_all}, items[1])
+        # Unknown service, no user
+        self.assertEqual({'host': srv001, 'host_name': 'srv001',
+                          'service_name': 'unknown',
+                          'user': None, 'user_name': 'Alignak',
+                          '_realm': realm_all}, items[2])
+        # Unknown user
+        self.assertEqual({'host': srv002, 'host_name': 'srv002',
+                          'user_name': 'unknown',
+                          '_realm': realm_all}, items[3])
+        # Unknown host or no host: the item is skipped
+        self.assertEqual({'host_name': 'unknown', 'service_name': 'ping'}, items[4])
+        self.assertEqual({'host': unknown, 'service': ping001}, items[5])
+        self.assertEqual({'service': ping002}, items[6])
+
+    def test_post_batch(self):
+        """
+        Test a batch of history items posted with hosts and services by id and by name
+
+        :return: None
+        """
+        headers = {'Content-Type': 'application/json'}
+        data = [
+            {'host': self.hosts['srv001'], 'service': self.services['srv001'],
+             'type': 'webui.comment', 'message': 'by id'},
+            {'host_name': 'srv002', 'service_name': 'ping', 'user_name': 'admin',
+             'type': 'webui.comment', 'message': 'by name'},
+            {'host_name': 'srv001', 'type': 'check.result', 'message': 'host'}
+        ]
+        response = requests.post(self.endpoint + '/history', json=data, headers=headers,
+                                 auth=self.auth)
+        self.assertEqual('OK', response.json()['_status'])
+
+        response = requests.get(self.endpoint + '/history', params={'sort': '_id'},
+                                auth=self.auth)
+        histories = response.json()['_items']
+        self.assertEqual(3, len(histories))
+        self.assertEqual([(self.hosts['srv001'], 'srv001', self.services['srv001'], 'ping',
+                           None, 'Alignak', 'by id'),
+                          (self.hosts['srv002'], 'srv002', self.services['srv002'], 'ping',
+                           self.user_admin, 'admin', 'by name'),
+                          (self.hosts['srv001'], 'srv001', None, None,
+                           None, 'Alignak', 'host')],
+                         [(history['host'], history['host_name'], history.get('service'),
+                           history.get('service_name'), history['user'], history['user_name'],
+                           history['message'])
+                          for history in histories])
+        for history in histories:
+            self.assertEqual(self.realm_all, history['_realm'])
@@ -1766,3 +1766,87 @@ class TestHookLivesynthesis(unittest2.TestCase):
         self.assertEqual(r[0]['services_unreachable_soft'], 0)
         self.assertEqual(r[0]['services_acknowledged'], 0)
         self.assertEqual(r[0]['services_in_downtime'], 0)
+
+    def test_all_counters(self):
+        """
+        Test the counters of the realms and their sub-realms (_all_counters) when an host is
+        updated, when its realm is moved in the tree and when its realm is deleted
+
+        :return: None
+        """
+        headers = {'Content-Type': 'application/json'}
+
+        def add_realm(name, parent_id):
+            """Add a realm, get its id"""
+            response = requests.post(self.endpoint + '/realm',
+                                     json={'name': name, '_parent': parent_id},
+                                     headers=headers, auth=self.auth)
+            return response.json()['_id']
+
+        def get_all_counters(realm_id):
+            """Get the counters of a realm and its sub-realms"""
+            response = requests.get(self.endpoint + '/livesynthesis',
+                                    params={'where': json.dumps({'_realm': realm_id})},
+                                    auth=self.auth)
+            items = response.json()['_items']
+            if not items:
+                return None
+            return items[0]['_all_counters']
+
+        # Realms: All > A > C, All > B
+        realm_a = add_realm('All A', self.realm_all)
+        realm_b = add_realm('All B', self.realm_all)
+        realm_c = add_realm('All A C', realm_a)
+
+        # An host in the realm C
+        data = json.loads(open('cfg/command_ping.json').read())
+        data['_realm'] = self.realm_all
+        response = requests.post(self.endpoint + '/command', json=data, headers=headers,
+                                 auth=self.auth)
+        command_id = response.json()['_id']
+        data = json.loads(open('cfg/host_srv001.json').read())
+        data['check_command'] = command_id
+        if 'realm' in data:
+            del data['realm']
+        data['_realm'] = realm_c
+        response = requests.post(self.endpoint + '/host', json=data, headers=headers,
+                                 auth=self.auth)
+        resp = response.json()
+        for realm_id in [self.realm_all, realm_a, realm_c]:
+            self.assertEqual(1, get_all_counters(realm_id)['hosts_total'])
+        self.assertEqual(0, get_all_counters(realm_b)['hosts_total'])
+
+        # The host is DOWN HARD: the counters of the realm C and its parents are incremented
+        headers_patch = {'Content-Type': 'application/json', 'If-Match': resp['_etag']}
+        requests.patch(self.endpoint + '/host/' + resp['_id'],
+                       json={'ls_state': 'DOWN', 'ls_state_id': 1, 'ls_state_type': 'HARD',
+                             'ls_acknowledged': False},
+                       headers=headers_patch, auth=self.auth)
+        for realm_id in [self.realm_all, realm_a, realm_c]:
+            self.assertEqual(1, get_all_counters(realm_id)['hosts_down_hard'])
+        self.assertEqual(0, get_all_counters(realm_b)['hosts_down_hard'])
+
+        # The realm C is moved under the realm B
+        response = requests.get(self.endpoint + '/realm/' + realm_c, auth=self.auth)
+        headers_patch = {'Content-Type': 'application/json',
+                         'If-Match': response.json()['_etag']}
+        response = requests.patch(self.endpoint + '/realm/' + realm_c,
+                                  json={'_parent': realm_b}, headers=headers_patch,
+                                  auth=self.auth)
+        self.assertEqual(response.status_code, 200)
+        for realm_id in [self.realm_all, realm_b, realm_c]:
+            self.assertEqual(1, get_all_counters(realm_id)['hosts_total'])
+            self.assertEqual(1, get_all_counters(realm_id)['hosts_down_hard'])
+        self.assertEqual(0, get_all_counters(realm_a)['hosts_total'])
+        self.assertEqual(0, get_all_counters(realm_a)['hosts_down_hard'])
+
+        # The realm C is deleted: its host is no more counted in its parents
+        response = requests.get(self.endpoint + '/realm/' + realm_c, auth=self.auth)
+        response = requests.delete(self.endpoint + '/realm/' + realm_c,
+                                   headers={'If-Match': response.json()['_etag']},
+                                   auth=self.auth)
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(get_all_counters(realm_c))
+        for realm_id in [self.realm_all, realm_b]:
+            self.assertEqual(0, get_all_counters(realm_id)['hosts_total'])
+            self.assertEqual(0, get_all_counters(realm_id)['hosts_down_hard'])
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test verify the queue of background jobs
+"""
+
+import os
+import time
+import shlex
+import threading
+import subprocess
+from datetime import datetime, timedelta
+import requests
+import unittest2
+from alignak_backend.jobqueue import JobQueue
+
+
+class TestJobQueue(unittest2.TestCase):
+    """
+    This class test the queue of background jobs
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        This method:
+          * delete mongodb database
+          * start the backend with uwsgi
+          * log in the backend and get the token
+
+        :return: None
+        """
+        # Set test mode for Alignak backend
+        os.environ['TEST_ALIGNAK_BACKEND'] = '1'
+        os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'] = 'alignak-backend-test'
+
+        # Delete used mongo DBs
+        exit_code = subprocess.call(
+            shlex.split(
+                'mongo %s --eval "db.dropDatabase()"' % os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'])
+        )
+        assert exit_code == 0
+
+        cls.p = subprocess.Popen(['uwsgi', '--plugin', 'python', '-w', 'alignakbackend:app',
+                                  '--socket', '0.0.0.0:5000',
+                                  '--protocol=http', '--enable-threads', '--pidfile',
+                                  '/tmp/uwsgi.pid'])
+        time.sleep(3)
+
+        cls.endpoint = 'http://127.0.0.1:5000'
+
+        headers = {'Content-Type': 'application/json'}
+        params = {'username': 'admin', 'password': 'admin', 'action': 'generate'}
+        # get token
+        response = requests.post(cls.endpoint + '/login', json=params, headers=headers)
+        resp = response.json()
+        cls.token = resp['token']
+        cls.auth = requests.auth.HTTPBasicAuth(cls.token, '')
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Kill uwsgi
+
+        :return: None
+        """
+        subprocess.call(['uwsgi', '--stop', '/tmp/uwsgi.pid'])
+        time.sleep(2)
+
+    def setUp(self):
+        """
+        Delete the jobs and register the test job
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        self.config = dict(app.config)
+        self.done = []
+        JobQueue.register('test', self.done.append)
+        with app.test_request_context():
+            app.data.driver.db['job'].delete_many({})
+
+    def tearDown(self):
+        """
+        Restore the configuration and unregister the test job
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        app.config.update(self.config)
+        JobQueue.handlers.pop('test', None)
+        JobQueue.stop.clear()
+
+    def test_enqueue(self):
+        """
+        Test a job is processed immediately if the queue is not activated, otherwise it is
+        stored in the queue
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        with app.test_request_context():
+            jobs = app.data.driver.db['job']
+
+            app.config['JOB_QUEUE'] = False
+            JobQueue.enqueue('test', [{'host': 'srv001'}])
+            self.assertEqual([[{'host': 'srv001'}]], self.done)
+            self.assertEqual(0, jobs.count())
+
+            app.config['JOB_QUEUE'] = True
+            JobQueue.enqueue('test', [{'host': 'srv002'}])
+            self.assertEqual([[{'host': 'srv001'}]], self.done)
+            job = jobs.find_one()
+            self.assertEqual('test', job['name'])
+            self.assertEqual([{'host': 'srv002'}], job['data'])
+            self.assertEqual('pending', job['status'])
+            self.assertEqual(0, job['attempts'])
+
+    def test_take(self):
+        """
+        Test a job is taken by one worker, taken again when its lease expired and deleted
+        when done
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        app.config['JOB_QUEUE'] = True
+        app.config['JOB_QUEUE_LEASE'] = 60
+        with app.test_request_context():
+            jobs = app.data.driver.db['job']
+            JobQueue.enqueue('test', ['srv001'])
+
+            job = JobQueue.take()
+            self.assertEqual('running', job['status'])
+            self.assertEqual(1, job['attempts'])
+            self.assertGreater(job['locked_until'], datetime.utcnow() + timedelta(seconds=50))
+            # Taken by a worker, not available for the others
+            self.assertIsNone(JobQueue.take())
+
+            # The worker did not finish in time
+            jobs.update_one({'_id': job['_id']},
+                            {'$set': {'locked_until': datetime.utcnow() - timedelta(seconds=1)}})
+            job = JobQueue.take()
+            self.assertEqual('running', job['status'])
+            self.assertEqual(2, job['attempts'])
+
+            self.assertTrue(JobQueue.process(job))
+            self.assertEqual([['srv001']], self.done)
+            self.assertEqual(0, jobs.count())
+            self.assertIsNone(JobQueue.take())
+
+    def test_retry(self):
+        """
+        Test a failed job is retried later with an exponential backoff, then marked as failed
+        after the maximum number of attempts
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        def fail(data):
+            """Job which fails"""
+            raise ValueError(data)
+
+        app.config['JOB_QUEUE'] = True
+        app.config['JOB_QUEUE_MAX_ATTEMPTS'] = 3
+        app.config['JOB_QUEUE_BACKOFF'] = 5
+        app.config['JOB_QUEUE_BACKOFF_MAX'] = 3600
+        JobQueue.register('test', lambda data: False)
+        with app.test_request_context():
+            jobs = app.data.driver.db['job']
+            JobQueue.enqueue('test', ['srv001'])
+
+            for attempt, delay in [(1, 5), (2, 10)]:
+                job = JobQueue.take()
+                self.assertEqual(attempt, job['attempts'])
+                before = datetime.utcnow()
+                self.assertFalse(JobQueue.process(job))
+                job = jobs.find_one()
+                self.assertEqual('pending', job['status'])
+                self.assertEqual('Job failed', job['error'])
+                self.assertNotIn('locked_until', job)
+                self.assertGreaterEqual(job['not_before'],
+                                        before + timedelta(seconds=delay - 1))
+                self.assertLessEqual(job['not_before'],
+                                     datetime.utcnow() + timedelta(seconds=delay))
+                # Not retried before the delay
+                self.assertIsNone(JobQueue.take())
+                jobs.update_one({'_id': job['_id']},
+                                {'$set': {'not_before': datetime.utcnow()}})
+
+            JobQueue.register('test', fail)
+            job = JobQueue.take()
+            self.assertEqual(3, job['attempts'])
+            self.assertFalse(JobQueue.process(job))
+            job = jobs.find_one()
+            self.assertEqual('failed', job['status'])
+            self.assertIn('ValueError', job['error'])
+            self.assertNotIn('locked_until', job)
+            # A failed job is not processed anymore
+            self.assertIsNone(JobQueue.take())
+
+    def test_stats(self):
+        """
+        Test the number of jobs by status and by name in the endpoint /jobqueue
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        now = datetime.utcnow()
+        with app.test_request_context():
+            jobs = app.data.driver.db['job']
+            for name, status, age in [('history', 'pending', 30), ('history', 'pending', 10),
+                                      ('history', 'failed', 60), ('timeseries', 'running', 5)]:
+                jobs.insert_one({'name': name, 'data': [], 'status': status, 'attempts': 0,
+                                 'not_before': now, 'created': now - timedelta(seconds=age)})
+
+        response = requests.get(self.endpoint + '/jobqueue')
+        self.assertEqual(401, response.status_code)
+
+        response = requests.get(self.endpoint + '/jobqueue', auth=self.auth)
+        self.assertEqual(200, response.status_code)
+        resp = response.json()
+        self.assertEqual(2, resp['pending'])
+        self.assertEqual(1, resp['running'])
+        self.assertEqual(1, resp['failed'])
+        self.assertEqual(['history', 'timeseries'], sorted(resp['jobs']))
+
+        history = resp['jobs']['history']
+        self.assertEqual(2, history['pending'])
+        self.assertEqual(0, history['running'])
+        self.assertEqual(1, history['failed'])
+        # The delay of the oldest pending job
+        self.assertEqual((now - timedelta(seconds=30)).replace(microsecond=0),
+                         datetime.strptime(history['oldest'][:19], '%Y-%m-%dT%H:%M:%S'))
+        self.assertGreaterEqual(history['delay'], 30)
+
+        self.assertEqual({'pending': 0, 'running': 1, 'failed': 0},
+                         resp['jobs']['timeseries'])
+
+    def test_jobs_worker(self):
+        """
+        Test the jobs_worker command processes the jobs of the queue until it is stopped
+
+        :return: None
+        """
+        from alignak_backend.app import app, jobs_worker
+
+        app.config['JOB_QUEUE'] = True
+        app.config['JOB_QUEUE_POLL'] = 0.1
+        with app.test_request_context():
+            jobs = app.data.driver.db['job']
+            for host in ['srv001', 'srv002', 'srv003']:
+                JobQueue.enqueue('test', [host])
+
+        worker = threading.Thread(target=jobs_worker, args=({},))
+        worker.daemon = True
+        worker.start()
+        for _ in range(50):
+            if len(self.done) == 3:
+                break
+            time.sleep(0.1)
+        JobQueue.stop.set()
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+
+        self.assertEqual([['srv001'], ['srv002'], ['srv003']], sorted(self.done))
+        with app.test_request_context():
+            self.assertEqual(0, jobs.count())
+            self.assertIn('status_1_not_before_1', jobs.index_information())
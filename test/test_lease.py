@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test verify the leases shared by the backend processes
+"""
+
+import os
+import shlex
+import subprocess
+from datetime import datetime, timedelta
+import unittest2
+from alignak_backend.lease import Lease
+
+
+class TestLease(unittest2.TestCase):
+    """
+    This class test the leases shared by the backend processes
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        This method delete the mongodb database
+
+        :return: None
+        """
+        # Set test mode for Alignak backend
+        os.environ['TEST_ALIGNAK_BACKEND'] = '1'
+        os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'] = 'alignak-backend-test'
+
+        # Delete used mongo DBs
+        exit_code = subprocess.call(
+            shlex.split(
+                'mongo %s --eval "db.dropDatabase()"' % os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'])
+        )
+        assert exit_code == 0
+
+    def setUp(self):
+        """
+        Delete the test leases
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        self.node = Lease.node
+        with app.test_request_context():
+            app.data.driver.db['lease'].delete_many({'_id': {'$regex': '^test-'}})
+
+    def tearDown(self):
+        """
+        Restore the identifier of the process
+
+        :return: None
+        """
+        Lease.node = self.node
+
+    def as_other_process(self, func, *args):
+        """
+        Call a function as another backend process
+
+        :param func: the function
+        :type func: function
+        :return: result of the function
+        """
+        Lease.node = 'other-node'
+        try:
+            return func(*args)
+        finally:
+            Lease.node = self.node
+
+    def test_acquire(self):
+        """
+        Test a lease is held by one process until it expires, and renewed by its owner
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        with app.test_request_context():
+            leases = app.data.driver.db['lease']
+            assert Lease.acquire('test-acquire', 60)
+            lease = leases.find_one({'_id': 'test-acquire'})
+            self.assertEqual(Lease.get_owner(), lease['owner'])
+            assert not self.as_other_process(Lease.acquire, 'test-acquire', 60)
+
+            # Renewed by its owner
+            assert Lease.acquire('test-acquire', 600)
+            renewed = leases.find_one({'_id': 'test-acquire'})
+            assert renewed['expires'] > lease['expires'] + timedelta(seconds=500)
+            assert not self.as_other_process(Lease.acquire, 'test-acquire', 60)
+
+            # Expired: another process gets it
+            leases.update_one({'_id': 'test-acquire'},
+                              {'$set': {'expires': datetime.utcnow() - timedelta(seconds=1)}})
+            assert self.as_other_process(Lease.acquire, 'test-acquire', 60)
+            assert not Lease.acquire('test-acquire', 60)
+            self.assertEqual('other-node-%d' % os.getpid(),
+                             leases.find_one({'_id': 'test-acquire'})['owner'])
+
+            # Only released by its owner
+            Lease.release('test-acquire')
+            assert not Lease.acquire('test-acquire', 60)
+            self.as_other_process(Lease.release, 'test-acquire')
+            assert Lease.acquire('test-acquire', 60)
+
+    def test_run_once(self):
+        """
+        Test a function is run by only one process, and by another process if it failed
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        calls = []
+
+        def fail():
+            """Fail to run"""
+            calls.append('fail')
+            raise ValueError('failed')
+
+        with app.test_request_context():
+            leases = app.data.driver.db['lease']
+            with self.assertRaises(ValueError):
+                Lease.run_once('test-run', fail, 60)
+            # The lease is released for the other processes
+            self.assertIsNone(leases.find_one({'_id': 'test-run'}))
+
+            assert self.as_other_process(Lease.run_once, 'test-run',
+                                         lambda: calls.append('run'), 60)
+            lease = leases.find_one({'_id': 'test-run'})
+            assert lease['done']
+            self.assertEqual('other-node-%d' % os.getpid(), lease['owner'])
+
+            # Already done
+            assert not Lease.run_once('test-run', lambda: calls.append('again'), 60)
+            self.assertEqual(['fail', 'run'], calls)
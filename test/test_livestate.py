@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test check the bulk update of the hosts and services live state
+"""
+
+import os
+import json
+import time
+import shlex
+import subprocess
+import requests
+import unittest2
+
+
+class TestLivestate(unittest2.TestCase):
+    """
+    This class test the livestate endpoint
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        This method:
+          * delete mongodb database
+          * start the backend with uwsgi
+          * log in the backend and get the token
+          * get the realm
+
+        :return: None
+        """
+        # Set test mode for Alignak backend
+        os.environ['TEST_ALIGNAK_BACKEND'] = '1'
+        os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'] = 'alignak-backend-test'
+
+        # Delete used mongo DBs
+        exit_code = subprocess.call(
+            shlex.split(
+                'mongo %s --eval "db.dropDatabase()"' % os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'])
+        )
+        assert exit_code == 0
+
+        cls.p = subprocess.Popen(['uwsgi', '--plugin', 'python', '-w', 'alignakbackend:app',
+                                  '--socket', '0.0.0.0:5000',
+                                  '--protocol=http', '--enable-threads', '--pidfile',
+                                  '/tmp/uwsgi.pid'])
+        time.sleep(3)
+
+        cls.endpoint = 'http://127.0.0.1:5000'
+
+        headers = {'Content-Type': 'application/json'}
+        params = {'username': 'admin', 'password': 'admin', 'action': 'generate'}
+        # get token
+        response = requests.post(cls.endpoint + '/login', json=params, headers=headers)
+        resp = response.json()
+        cls.token = resp['token']
+        cls.auth = requests.auth.HTTPBasicAuth(cls.token, '')
+
+        # get realms
+        response = requests.get(cls.endpoint + '/realm',
+                                auth=cls.auth)
+        resp = response.json()
+        cls.realm_all = resp['_items'][0]['_id']
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Kill uwsgi
+
+        :return: None
+        """
+        subprocess.call(['uwsgi', '--stop', '/tmp/uwsgi.pid'])
+        time.sleep(2)
+
+    def test_livestate(self):
+        """
+        Test the live state, overall states and live synthesis after a bulk update
+
+        :return: None
+        """
+        headers = {'Content-Type': 'application/json'}
+        sort_id = {'sort': '_id'}
+
+        # Add command
+        data = json.loads(open('cfg/command_ping.json').read())
+        data['_realm'] = self.realm_all
+        requests.post(self.endpoint + '/command', json=data, headers=headers, auth=self.auth)
+        response = requests.get(self.endpoint + '/command', params=sort_id, auth=self.auth)
+        resp = response.json()
+        rc = resp['_items']
+
+        # Add host
+        data = json.loads(open('cfg/host_srv001.json').read())
+        data['check_command'] = rc[2]['_id']
+        if 'realm' in data:
+            del data['realm']
+        data['_realm'] = self.realm_all
+        response = requests.post(self.endpoint + '/host', json=data, headers=headers,
+                                 auth=self.auth)
+        host_id = response.json()['_id']
+
+        # Add service
+        data = json.loads(open('cfg/service_srv001_ping.json').read())
+        data['host'] = host_id
+        data['check_command'] = rc[2]['_id']
+        data['_realm'] = self.realm_all
+        response = requests.post(self.endpoint + '/service', json=data, headers=headers,
+                                 auth=self.auth)
+        service_id = response.json()['_id']
+
+        # Not authenticated
+        response = requests.post(self.endpoint + '/livestate', json={}, headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+        # Host UP and service CRITICAL, plus invalid updates
+        data = {
+            'host': [{'_id': host_id, 'ls_state': 'UP', 'ls_state_type': 'HARD'},
+                     {'_id': host_id, 'name': 'renamed'}],
+            'service': [{'_id': service_id, 'ls_state': 'CRITICAL', 'ls_state_type': 'HARD',
+                         'ls_output': 'CRITICAL - no answer'},
+                        {'_id': 'notanid', 'ls_state': 'OK'}]
+        }
+        response = requests.post(self.endpoint + '/livestate', json=data, headers=headers,
+                                 auth=self.auth)
+        resp = response.json()
+        self.assertEqual(resp['_status'], 'ERR')
+        self.assertEqual(resp['_updated'], {'host': 1, 'service': 1})
+        self.assertEqual(len(resp['_issues']), 2)
+
+        response = requests.get(self.endpoint + '/service/' + service_id, auth=self.auth)
+        resp = response.json()
+        self.assertEqual(resp['ls_state'], 'CRITICAL')
+        self.assertEqual(resp['ls_output'], 'CRITICAL - no answer')
+        self.assertEqual(resp['_overall_state_id'], 4)
+
+        response = requests.get(self.endpoint + '/host/' + host_id, auth=self.auth)
+        resp = response.json()
+        self.assertEqual(resp['ls_state'], 'UP')
+        self.assertNotEqual(resp['name'], 'renamed')
+        self.assertEqual(resp['_overall_state_id'], 4)
+
+        response = requests.get(self.endpoint + '/livesynthesis', params=sort_id, auth=self.auth)
+        r = response.json()['_items']
+        self.assertEqual(len(r), 1)
+        self.assertEqual(r[0]['hosts_total'], 1)
+        self.assertEqual(r[0]['hosts_up_hard'], 1)
+        self.assertEqual(r[0]['hosts_unreachable_hard'], 0)
+        self.assertEqual(r[0]['services_total'], 1)
+        self.assertEqual(r[0]['services_critical_hard'], 1)
+        self.assertEqual(r[0]['services_unknown_hard'], 0)
+
+        # Service OK, so the host overall state is OK
+        data = {'service': [{'_id': service_id, 'ls_state': 'OK', 'ls_state_type': 'HARD'}]}
+        response = requests.post(self.endpoint + '/livestate', json=data, headers=headers,
+                                 auth=self.auth)
+        resp = response.json()
+        self.assertEqual(resp['_status'], 'OK')
+        self.assertEqual(resp['_updated'], {'host': 1, 'service': 1})
+
+        response = requests.get(self.endpoint + '/host/' + host_id, auth=self.auth)
+        resp = response.json()
+        self.assertEqual(resp['_overall_state_id'], 0)
+
+        response = requests.get(self.endpoint + '/livesynthesis', params=sort_id, auth=self.auth)
+        r = response.json()['_items']
+        self.assertEqual(r[0]['hosts_up_hard'], 1)
+        self.assertEqual(r[0]['services_ok_hard'], 1)
+        self.assertEqual(r[0]['services_critical_hard'], 0)
+
+    def test_livestate_services_host(self):
+        """
+        Test the overall state of an host is computed once for many services updated in one
+        request, and only when the services counters of the host change
+
+        :return: None
+        """
+        from bson.objectid import ObjectId
+        from flask import g
+        from alignak_backend.app import app
+        from alignak_backend.livestate import Livestate
+
+        headers = {'Content-Type': 'application/json'}
+        sort_id = {'sort': '_id'}
+
+        response = requests.get(self.endpoint + '/command', params=sort_id, auth=self.auth)
+        rc = response.json()['_items']
+
+        # Add host
+        data = json.loads(open('cfg/host_srv001.json').read())
+        data['name'] = 'srv002'
+        data['check_command'] = rc[2]['_id']
+        if 'realm' in data:
+            del data['realm']
+        data['_realm'] = self.realm_all
+        response = requests.post(self.endpoint + '/host', json=data, headers=headers,
+                                 auth=self.auth)
+        host_id = response.json()['_id']
+
+        # Add 3 services
+        services = []
+        for index in range(3):
+            data = json.loads(open('cfg/service_srv001_ping.json').read())
+            data['name'] = 'ping%d' % index
+            data['host'] = host_id
+            data['check_command'] = rc[2]['_id']
+            data['_realm'] = self.realm_all
+            response = requests.post(self.endpoint + '/service', json=data, headers=headers,
+                                     auth=self.auth)
+            services.append(response.json()['_id'])
+
+        data = {'host': [{'_id': host_id, 'ls_state': 'UP', 'ls_state_type': 'HARD'}]}
+        response = requests.post(self.endpoint + '/livestate', json=data, headers=headers,
+                                 auth=self.auth)
+        self.assertEqual(response.json()['_updated'], {'host': 1, 'service': 0})
+
+        # The 3 services are CRITICAL: the host is updated once
+        data = {'service': [{'_id': service_id, 'ls_state': 'CRITICAL', 'ls_state_type': 'HARD'}
+                            for service_id in services]}
+        response = requests.post(self.endpoint + '/livestate', json=data, headers=headers,
+                                 auth=self.auth)
+        self.assertEqual(response.json()['_updated'], {'host': 1, 'service': 3})
+        response = requests.get(self.endpoint + '/host/' + host_id, auth=self.auth)
+        host = response.json()
+        self.assertEqual(host['_overall_state_id'], 4)
+        self.assertEqual(host['_overall_state_services']['4'], 3)
+
+        # The services are still CRITICAL: the host is not updated
+        data = {'service': [{'_id': service_id, 'ls_state': 'CRITICAL', 'ls_state_type': 'HARD',
+                             'ls_output': 'CRITICAL - no answer'} for service_id in services]}
+        response = requests.post(self.endpoint + '/livestate', json=data, headers=headers,
+                                 auth=self.auth)
+        self.assertEqual(response.json()['_updated'], {'host': 0, 'service': 3})
+        response = requests.get(self.endpoint + '/host/' + host_id, auth=self.auth)
+        self.assertEqual(response.json()['_etag'], host['_etag'])
+
+        # The hooks mark the host many times, its overall state is computed once at the end of
+        # the request
+        with app.test_request_context():
+            host_db = app.data.driver.db['host']
+            host_db.update_one({'_id': ObjectId(host_id)}, {'$set': {'_overall_state_id': 0}})
+            for _ in services:
+                Livestate.mark_host(ObjectId(host_id))
+            self.assertEqual(g.dirty_hosts, set([ObjectId(host_id)]))
+            Livestate.flush_request(None)
+            self.assertIsNone(g.get('dirty_hosts'))
+            self.assertEqual(host_db.find_one({'_id': ObjectId(host_id)})['_overall_state_id'],
+                             4)
+
+    def test_overall_state_services(self):
+        """
+        Test the services counters of an host are kept consistent by the hooks when its services
+        change their state or are deleted, and they can not be modified by a client
+
+        :return: None
+        """
+        from alignak_backend.app import app
+        from alignak_backend.livestate import Livestate
+
+        headers = {'Content-Type': 'application/json'}
+        sort_id = {'sort': '_id'}
+
+        response = requests.get(self.endpoint + '/command', params=sort_id, auth=self.auth)
+        rc = response.json()['_items']
+
+        # Add host
+        data = json.loads(open('cfg/host_srv001.json').read())
+        data['name'] = 'srv003'
+        data['check_command'] = rc[2]['_id']
+        if 'realm' in data:
+            del data['realm']
+        data['_realm'] = self.realm_all
+        response = requests.post(self.endpoint + '/host', json=data, headers=headers,
+                                 auth=self.auth)
+        host_id = response.json()['_id']
+
+        # Add 3 services
+        services = []
+        for index in range(3):
+            data = json.loads(open('cfg/service_srv001_ping.json').read())
+            data['name'] = 'ping%d' % index
+            data['host'] = host_id
+            data['check_command'] = rc[2]['_id']
+            data['_realm'] = self.realm_all
+            response = requests.post(self.endpoint + '/service', json=data, headers=headers,
+                                     auth=self.auth)
+            services.append(response.json()['_id'])
+
+        def get_counters():
+            """Get the services counters of the host, check them against its services"""
+            response = requests.get(self.endpoint + '/host/' + host_id, auth=self.auth)
+            host = response.json()
+            response = requests.get(self.endpoint + '/service',
+                                    params={'where': json.dumps({'host': host_id})},
+                                    auth=self.auth)
+            expected = Livestate.empty_services_states()
+            for service in response.json()['_items']:
+                if service['ls_state_type'] == 'HARD':
+                    expected[str(service['_overall_state_id'])] += 1
+            self.assertEqual(expected, host['_overall_state_services'])
+            return host
+
+        def patch_service(service_id, updates):
+            """Update a service"""
+            response = requests.get(self.endpoint + '/service/' + service_id, auth=self.auth)
+            headers_patch = {'Content-Type': 'application/json',
+                             'If-Match': response.json()['_etag']}
+            response = requests.patch(self.endpoint + '/service/' + service_id, json=updates,
+                                      headers=headers_patch, auth=self.auth)
+            self.assertEqual(response.status_code, 200)
+
+        get_counters()
+
+        patch_service(services[0], {'ls_state': 'CRITICAL', 'ls_state_type': 'HARD'})
+        patch_service(services[1], {'ls_state': 'WARNING', 'ls_state_type': 'HARD'})
+        patch_service(services[2], {'ls_state': 'OK', 'ls_state_type': 'HARD'})
+        host = get_counters()
+        self.assertEqual(1, host['_overall_state_services']['4'])
+        self.assertEqual(1, host['_overall_state_services']['3'])
+        self.assertEqual(1, host['_overall_state_services']['0'])
+
+        # A SOFT state is not counted, an acknowledged problem is counted as acknowledged
+        patch_service(services[0], {'ls_state': 'WARNING', 'ls_state_type': 'SOFT'})
+        patch_service(services[1], {'ls_acknowledged': True, 'ls_state_type': 'HARD'})
+        host = get_counters()
+        self.assertEqual(0, host['_overall_state_services']['4'])
+        self.assertEqual(0, host['_overall_state_services']['3'])
+        self.assertEqual(1, host['_overall_state_services']['1'])
+
+        # Deleted service
+        response = requests.get(self.endpoint + '/service/' + services[1], auth=self.auth)
+        requests.delete(self.endpoint + '/service/' + services[1],
+                        headers={'If-Match': response.json()['_etag']}, auth=self.auth)
+        host = get_counters()
+        self.assertEqual(0, host['_overall_state_services']['1'])
+        self.assertEqual(1, host['_overall_state_services']['0'])
+
+        # Same counters as computed from the services
+        with app.test_request_context():
+            Livestate.recalculate_services_states()
+        self.assertEqual(host['_overall_state_services'],
+                         get_counters()['_overall_state_services'])
+
+        # The counters can not be modified by a client
+        headers_patch = {'Content-Type': 'application/json', 'If-Match': host['_etag']}
+        response = requests.patch(self.endpoint + '/host/' + host_id,
+                                  json={'_overall_state_services': {'0': 5}},
+                                  headers=headers_patch, auth=self.auth)
+        self.assertEqual(response.status_code, 422)
+
+        # and they are kept when the host is replaced
+        data = json.loads(open('cfg/host_srv001.json').read())
+        data['name'] = 'srv003'
+        data['check_command'] = rc[2]['_id']
+        del data['realm']
+        data['_realm'] = self.realm_all
+        response = requests.put(self.endpoint + '/host/' + host_id, json=data,
+                                headers=headers_patch, auth=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(host['_overall_state_services'],
+                         get_counters()['_overall_state_services'])
@@ -584,6 +584,8 @@ class TestHookLivesynthesis(unittest2.TestCase):
             'services_flapping': 0,
             'services_business_impact': 0
         }
+        # The counters of the realm and its sub-realms are maintained in the live synthesis
+        self.assertEqual(ref, resp['_all_counters'])
         for prop in copy.copy(resp):
             if prop.startswith('_'):
                 del resp[prop]
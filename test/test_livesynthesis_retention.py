@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test verify the storage of the livesynthesis history in buckets
+"""
+
+import os
+import shlex
+import subprocess
+from datetime import datetime, timedelta
+import unittest2
+from bson.objectid import ObjectId
+from flask import Flask
+from alignak_backend.livesynthesisretention import LivesynthesisRetention
+
+
+class TestLivesynthesisRetention(unittest2.TestCase):
+    """
+    This class test the livesynthesis history buckets
+    """
+
+    @staticmethod
+    def get_bucket(samples, value):
+        """
+        Get a bucket of the first tier with a value for all the counters at some offsets
+
+        :param samples: offsets of the samples
+        :type samples: list
+        :param value: value of the counters
+        :type value: int
+        :return: the bucket
+        :rtype: dict
+        """
+        names = LivesynthesisRetention.get_counters_names()
+        counters = dict((name, [0] * LivesynthesisRetention.slots) for name in names)
+        for offset in samples:
+            for name in names:
+                counters[name][offset] = value
+        return {'samples': samples, 'counters': counters}
+
+    def test_get_bucket(self):
+        """
+        Test the start date of the bucket of a sample and the offset of the sample in the bucket
+
+        :return: None
+        """
+        date = datetime(2017, 7, 14, 2, 17, 42)
+        self.assertEqual((datetime(2017, 7, 14, 2, 0), 17),
+                         LivesynthesisRetention.get_bucket(date))
+        self.assertEqual((datetime(2017, 7, 14, 2, 0), 0),
+                         LivesynthesisRetention.get_bucket(datetime(2017, 7, 14, 2, 0)))
+        self.assertEqual((datetime(2017, 7, 14, 2, 0), 59),
+                         LivesynthesisRetention.get_bucket(datetime(2017, 7, 14, 2, 59, 59)))
+        # A bucket has 60 samples of the resolution: 10 hours for a sample each 10 minutes
+        self.assertEqual((datetime(2017, 7, 13, 20, 0), 37),
+                         LivesynthesisRetention.get_bucket(date, 600))
+
+    def test_add_arrays(self):
+        """
+        Test the sum of the counters arrays
+
+        :return: None
+        """
+        self.assertEqual([1, 2, 3], LivesynthesisRetention.add_arrays([[1, 2, 3]]))
+        self.assertEqual([5, 7, 9], LivesynthesisRetention.add_arrays([[1, 2, 3], [4, 5, 6]]))
+
+    def test_get_offsets(self):
+        """
+        Test the offsets of the samples of a bucket in a period
+
+        :return: None
+        """
+        bucket = {'samples': [0, 1, 2, 5, 2]}
+        start = 1500000000
+        self.assertEqual([5, 2, 1, 0],
+                         LivesynthesisRetention.get_offsets(bucket, start, 60, [None, None]))
+        self.assertEqual([2, 1],
+                         LivesynthesisRetention.get_offsets(bucket, start, 60,
+                                                            [start + 60, start + 300]))
+
+    def test_concatenate(self):
+        """
+        Test the concatenation of the history of some live synthesis: the samples at the same
+        offset of the buckets starting at the same date are added
+
+        :return: None
+        """
+        names = LivesynthesisRetention.get_counters_names()
+        start = 1500000000 - 1500000000 % 3600
+        buckets = {
+            start: {
+                'ls1': self.get_bucket([0, 1, 2], 1),
+                'ls2': self.get_bucket([1, 2, 3], 10),
+                'ls3': self.get_bucket([2], 100),
+            },
+            start + 3600: {
+                'ls1': self.get_bucket([0], 2),
+                'ls2': self.get_bucket([0], 20),
+            },
+            # No sample of the first live synthesis, ignored
+            start + 7200: {
+                'ls2': self.get_bucket([0], 30),
+            }
+        }
+        columns = LivesynthesisRetention.concatenate(buckets, ['ls1', 'ls2', 'ls3'],
+                                                     ['counters'], 60)
+        self.assertEqual([datetime.utcfromtimestamp(start + 3600),
+                          datetime.utcfromtimestamp(start + 120),
+                          datetime.utcfromtimestamp(start + 60),
+                          datetime.utcfromtimestamp(start)], columns['_created'])
+        for name in names:
+            self.assertEqual([22, 111, 11, 1], columns[name])
+
+        # Only the first live synthesis, in a period
+        columns = LivesynthesisRetention.concatenate(
+            buckets, ['ls1'], ['counters'], 60,
+            (datetime.utcfromtimestamp(start + 60), datetime.utcfromtimestamp(start + 3600)))
+        self.assertEqual([datetime.utcfromtimestamp(start + 120),
+                          datetime.utcfromtimestamp(start + 60)], columns['_created'])
+        for name in names:
+            self.assertEqual([1, 1], columns[name])
+
+    def test_concatenate_rollup(self):
+        """
+        Test the concatenation of a rollup tier: the minimum and maximum values are added too
+
+        :return: None
+        """
+        names = LivesynthesisRetention.get_counters_names()
+        start = 1500000000 - 1500000000 % 36000
+        buckets = {start: {}}
+        for ls_id, value in [('ls1', 2), ('ls2', 5)]:
+            bucket = self.get_bucket([3], value)
+            bucket['min'] = self.get_bucket([3], value - 1)['counters']
+            bucket['max'] = self.get_bucket([3], value + 1)['counters']
+            buckets[start][ls_id] = bucket
+        columns = LivesynthesisRetention.concatenate(buckets, ['ls1', 'ls2'],
+                                                     ['counters', 'min', 'max'], 600)
+        self.assertEqual([datetime.utcfromtimestamp(start + 1800)], columns['_created'])
+        for name in names:
+            self.assertEqual([7], columns[name])
+            self.assertEqual([5], columns['_min'][name])
+            self.assertEqual([9], columns['_max'][name])
+
+    def test_get_resolution(self):
+        """
+        Test the tier of an history: the finest tier with a resolution of at least the
+        requested one which keeps the samples since the first date, or the tier with the
+        longest retention
+
+        :return: None
+        """
+        app = Flask(__name__)
+        app.config['SCHEDULER_LIVESYNTHESIS_HISTORY'] = 120
+        app.config['LIVESYNTHESIS_HISTORY_TIERS'] = [[3600, 43200], [600, 1440]]
+        now = datetime.utcnow()
+        with app.test_request_context():
+            self.assertEqual([(60, 7200), (600, 86400), (3600, 2592000)],
+                             LivesynthesisRetention.get_tiers())
+            get_resolution = LivesynthesisRetention.get_resolution
+            self.assertEqual(60, get_resolution())
+            self.assertEqual(60, get_resolution(resolution=60))
+            self.assertEqual(600, get_resolution(resolution=300))
+            self.assertEqual(600, get_resolution(resolution=600))
+            self.assertEqual(3600, get_resolution(resolution=7200))
+
+            self.assertEqual(60, get_resolution(now - timedelta(hours=1)))
+            self.assertEqual(600, get_resolution(now - timedelta(hours=1), 600))
+            self.assertEqual(600, get_resolution(now - timedelta(hours=3)))
+            self.assertEqual(3600, get_resolution(now - timedelta(hours=3), 900))
+            self.assertEqual(3600, get_resolution(now - timedelta(days=2)))
+            # Older than all the tiers
+            self.assertEqual(3600, get_resolution(now - timedelta(days=60)))
+            self.assertEqual(3600, get_resolution(now - timedelta(days=60), 60))
+
+        app.config['LIVESYNTHESIS_HISTORY_TIERS'] = []
+        with app.test_request_context():
+            self.assertEqual(60, LivesynthesisRetention.get_resolution(now - timedelta(days=2)))
+            self.assertEqual(60, LivesynthesisRetention.get_resolution(resolution=600))
+
+
+class TestLivesynthesisRetentionStorage(unittest2.TestCase):
+    """
+    This class test the livesynthesis history buckets stored in the database
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        This method delete the mongodb database
+
+        :return: None
+        """
+        # Set test mode for Alignak backend
+        os.environ['TEST_ALIGNAK_BACKEND'] = '1'
+        os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'] = 'alignak-backend-test'
+
+        # Delete used mongo DBs
+        exit_code = subprocess.call(
+            shlex.split(
+                'mongo %s --eval "db.dropDatabase()"' % os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'])
+        )
+        assert exit_code == 0
+
+    def setUp(self):
+        """
+        Delete the livesynthesis history
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        with app.test_request_context():
+            app.data.driver.db['livesynthesisretention'].delete_many({})
+
+    def test_migrate(self):
+        """
+        Test the former history documents (one per live synthesis and per minute) are moved to
+        the buckets
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        ls_id = ObjectId()
+        with app.test_request_context():
+            retention_db = app.data.driver.db['livesynthesisretention']
+            for minute, value in [(17, 1), (18, 2), (65, 3)]:
+                retention_db.insert_one({
+                    'livesynthesis': ls_id,
+                    '_created': datetime(2017, 7, 14, 2, 0) + timedelta(minutes=minute),
+                    'hosts_total': value, 'services_total': value * 10})
+
+            self.assertEqual(3, LivesynthesisRetention.migrate(batch=2))
+            self.assertEqual(0, retention_db.count({'start': {'$exists': False}}))
+
+            buckets = list(retention_db.find({'livesynthesis': ls_id}).sort('start', 1))
+            self.assertEqual(2, len(buckets))
+            self.assertEqual(datetime(2017, 7, 14, 2, 0), buckets[0]['start'].replace(tzinfo=None))
+            self.assertEqual(datetime(2017, 7, 14, 3, 0), buckets[0]['end'].replace(tzinfo=None))
+            self.assertEqual(60, buckets[0]['resolution'])
+            self.assertEqual([17, 18], sorted(buckets[0]['samples']))
+            self.assertEqual(60, len(buckets[0]['counters']['hosts_total']))
+            self.assertEqual(1, buckets[0]['counters']['hosts_total'][17])
+            self.assertEqual(20, buckets[0]['counters']['services_total'][18])
+            self.assertEqual(0, buckets[0]['counters']['hosts_total'][19])
+            self.assertEqual([5], buckets[1]['samples'])
+            self.assertEqual(3, buckets[1]['counters']['hosts_total'][5])
+
+            # The history is the same as before the migration
+            columns = LivesynthesisRetention.get_columns([ls_id])
+            self.assertEqual([datetime(2017, 7, 14, 3, 5), datetime(2017, 7, 14, 2, 18),
+                              datetime(2017, 7, 14, 2, 17)], columns['_created'])
+            self.assertEqual([3, 2, 1], columns['hosts_total'])
+            self.assertEqual([30, 20, 10], columns['services_total'])
+
+            # Nothing more to migrate
+            self.assertEqual(0, LivesynthesisRetention.migrate())
+
+    def test_rollup(self):
+        """
+        Test the samples of a rollup tier have the last, minimum and maximum values of the
+        samples of the previous tier in their period
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        ls_id = ObjectId()
+        start = datetime(2017, 7, 14, 2, 0)
+        tiers = app.config['LIVESYNTHESIS_HISTORY_TIERS']
+        app.config['LIVESYNTHESIS_HISTORY_TIERS'] = [[600, 1440]]
+        try:
+            with app.test_request_context():
+                values = [5, 9, 3, 7, 6, 2, 8, 4, 1, 6, 20]
+                LivesynthesisRetention.add([
+                    (ls_id, start + timedelta(minutes=minute), {'hosts_total': value})
+                    for minute, value in enumerate(values)])
+
+                # The previous and the current periods of 10 minutes
+                now = start + timedelta(minutes=15)
+                self.assertEqual(2, LivesynthesisRetention.rollup(now))
+                retention_db = app.data.driver.db['livesynthesisretention']
+                bucket = retention_db.find_one({'livesynthesis': ls_id, 'resolution': 600})
+                self.assertEqual(datetime(2017, 7, 13, 20, 0),
+                                 bucket['start'].replace(tzinfo=None))
+                self.assertEqual([36, 37], sorted(bucket['samples']))
+                self.assertEqual(6, bucket['counters']['hosts_total'][36])
+                self.assertEqual(1, bucket['min']['hosts_total'][36])
+                self.assertEqual(9, bucket['max']['hosts_total'][36])
+                self.assertEqual(20, bucket['counters']['hosts_total'][37])
+                self.assertEqual(20, bucket['min']['hosts_total'][37])
+                self.assertEqual(20, bucket['max']['hosts_total'][37])
+
+                # A new sample in the current period: its rollup sample is updated
+                LivesynthesisRetention.add([(ls_id, start + timedelta(minutes=11),
+                                             {'hosts_total': 0})])
+                self.assertEqual(2, LivesynthesisRetention.rollup(now))
+                self.assertEqual(1, retention_db.count({'livesynthesis': ls_id,
+                                                        'resolution': 600}))
+
+                columns = LivesynthesisRetention.get_columns([ls_id], resolution=600)
+                self.assertEqual([start + timedelta(minutes=10), start], columns['_created'])
+                self.assertEqual([0, 6], columns['hosts_total'])
+                self.assertEqual([0, 1], columns['_min']['hosts_total'])
+                self.assertEqual([20, 9], columns['_max']['hosts_total'])
+                self.assertEqual([0, 0], columns['services_total'])
+        finally:
+            app.config['LIVESYNTHESIS_HISTORY_TIERS'] = tiers
+
+    def test_rollup_tiers(self):
+        """
+        Test each rollup tier is computed from the samples of the previous tier
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        ls_id = ObjectId()
+        start = datetime(2017, 7, 14, 2, 0)
+        tiers = app.config['LIVESYNTHESIS_HISTORY_TIERS']
+        app.config['LIVESYNTHESIS_HISTORY_TIERS'] = [[3600, 43200], [600, 1440]]
+        try:
+            with app.test_request_context():
+                # A sample before the previous period of the 10 minutes tier, then one each
+                # minute from 2:10 to 2:24
+                values = [4, 0, 7, 3, 10, 6, 2, 9, 5, 1, 8, 4, 0, 7, 3]
+                LivesynthesisRetention.add(
+                    [(ls_id, start + timedelta(minutes=5), {'hosts_total': 50})] +
+                    [(ls_id, start + timedelta(minutes=10 + minute), {'hosts_total': value})
+                     for minute, value in enumerate(values)])
+
+                # 2 samples of the 10 minutes tier, 1 sample of the hour tier
+                self.assertEqual(3, LivesynthesisRetention.rollup(start + timedelta(minutes=25)))
+
+                columns = LivesynthesisRetention.get_columns([ls_id], resolution=600)
+                self.assertEqual([start + timedelta(minutes=20), start + timedelta(minutes=10)],
+                                 columns['_created'])
+                self.assertEqual([3, 1], columns['hosts_total'])
+                self.assertEqual([0, 0], columns['_min']['hosts_total'])
+                self.assertEqual([8, 10], columns['_max']['hosts_total'])
+
+                # The hour tier: the last value, the minimum of the minimum values and the
+                # maximum of the maximum values of the 10 minutes tier
+                columns = LivesynthesisRetention.get_columns([ls_id], resolution=3600)
+                self.assertEqual([start], columns['_created'])
+                self.assertEqual([3], columns['hosts_total'])
+                self.assertEqual([0], columns['_min']['hosts_total'])
+                self.assertEqual([10], columns['_max']['hosts_total'])
+        finally:
+            app.config['LIVESYNTHESIS_HISTORY_TIERS'] = tiers
+
+    def test_expire(self):
+        """
+        Test the buckets whose all samples are older than the history of their tier are deleted
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        ls_id = ObjectId()
+        now = datetime(2017, 7, 20, 12, 0)
+        config = dict(app.config)
+        app.config['SCHEDULER_LIVESYNTHESIS_HISTORY'] = 120
+        app.config['LIVESYNTHESIS_HISTORY_TIERS'] = [[600, 1440], [3600, 43200]]
+        try:
+            with app.test_request_context():
+                values = {'hosts_total': 1}
+                # The buckets of the first tier (2 hours) end at 9:00 and 12:00
+                LivesynthesisRetention.add([(ls_id, now - timedelta(hours=4), values),
+                                            (ls_id, now - timedelta(hours=1), values)])
+                # The buckets of the 10 minutes tier (1 day) are 10 hours long
+                LivesynthesisRetention.add([(ls_id, now - timedelta(days=2), values, values,
+                                             values),
+                                            (ls_id, now - timedelta(hours=1), values, values,
+                                             values)], 600)
+                # The buckets of the hour tier (30 days) are 60 hours long
+                LivesynthesisRetention.add([(ls_id, now - timedelta(days=40), values, values,
+                                             values),
+                                            (ls_id, now - timedelta(days=10), values, values,
+                                             values)], 3600)
+
+                self.assertEqual(3, LivesynthesisRetention.expire(now))
+                retention_db = app.data.driver.db['livesynthesisretention']
+                self.assertEqual(
+                    [(60, datetime(2017, 7, 20, 11, 0)), (600, datetime(2017, 7, 20, 2, 0)),
+                     (3600, datetime(2017, 7, 10, 12, 0))],
+                    sorted((bucket['resolution'], bucket['start'].replace(tzinfo=None))
+                           for bucket in retention_db.find({'livesynthesis': ls_id})))
+                self.assertEqual(0, LivesynthesisRetention.expire(now))
+
+                # The first tier is kept forever
+                app.config['SCHEDULER_LIVESYNTHESIS_HISTORY'] = 0
+                self.assertEqual(1, LivesynthesisRetention.expire(now + timedelta(days=5)))
+                self.assertEqual([60, 3600],
+                                 sorted(bucket['resolution']
+                                        for bucket in retention_db.find({'livesynthesis': ls_id})))
+        finally:
+            app.config.update(config)
+
+    def test_cron(self):
+        """
+        Test the counts of the cron of the livesynthesis history: the inserted samples, the
+        rolled up samples and the expired buckets
+
+        :return: None
+        """
+        import json
+        from alignak_backend.app import app, cron_livesynthesis_history
+
+        ls_id = ObjectId()
+        config = dict(app.config)
+        app.config['SCHEDULER_LIVESYNTHESIS_HISTORY'] = 1440
+        app.config['LIVESYNTHESIS_HISTORY_TIERS'] = [[600, 1440]]
+        try:
+            with app.test_request_context():
+                livesynthesis_db = app.data.driver.db['livesynthesis']
+                livesynthesis_db.insert_one({'_id': ls_id, 'hosts_total': 3})
+                count = livesynthesis_db.count()
+                # A bucket older than the first tier history
+                LivesynthesisRetention.add([(ls_id, datetime.utcnow() - timedelta(days=2),
+                                             {'hosts_total': 1})])
+
+                result = json.loads(cron_livesynthesis_history().get_data().decode('utf-8'))
+                livesynthesis_db.delete_one({'_id': ls_id})
+            self.assertEqual(count, result['inserted'])
+            self.assertEqual(count, result['rolled_up'])
+            self.assertEqual(1, result['expired'])
+            self.assertEqual(['expire', 'insert', 'rollup'], sorted(result['duration']))
+
+            with app.test_request_context():
+                columns = LivesynthesisRetention.get_columns([ls_id])
+                self.assertEqual([3], columns['hosts_total'])
+                columns = LivesynthesisRetention.get_columns([ls_id], resolution=600)
+                self.assertEqual([3], columns['hosts_total'])
+                self.assertEqual([3], columns['_max']['hosts_total'])
+        finally:
+            app.config.update(config)
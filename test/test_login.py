@@ -77,3 +77,99 @@ class Test_Login(unittest2.TestCase):
         response = requests.post(self.endpoint + '/login', json=params, headers=headers)
         resp = response.json()
         assert token != resp['token']
+
+    def test_signed_token(self):
+        """
+        Test the signed tokens: forged, expired, not ASCII and of a deleted user
+
+        :return: None
+        """
+        from bson.objectid import ObjectId
+        from alignak_backend.app import app, MyTokenAuth
+        from alignak_backend.authcache import AuthCache
+        from alignak_backend.signedtoken import SignedToken
+
+        app.config['AUTH_TOKEN_SIGNED'] = True
+        app.config['AUTH_TOKEN_SECRET'] = 'a secret for the tests'
+        try:
+            with app.test_request_context():
+                user = app.data.driver.db['user'].find_one({'name': 'admin'})
+                token = SignedToken.generate(user, 0)
+                payload = SignedToken.verify(token)
+                self.assertEqual(str(user['_id']), payload['u'])
+                AuthCache.clear()
+                assert MyTokenAuth().check_auth(token, [], 'host', 'GET')
+
+                # Forged token: another payload with the signature of the token
+                signature = token.split('.')[1]
+                forged = SignedToken.encode(
+                    ('{"u":"%s","e":%d,"v":0}' % (ObjectId(), time.time() + 3600))
+                    .encode('utf-8'))
+                self.assertIsNone(SignedToken.verify(forged + '.' + signature))
+                assert not MyTokenAuth().check_auth(forged + '.' + signature, [], 'host', 'GET')
+
+                # Token signed with another secret
+                app.config['AUTH_TOKEN_SECRET'] = 'another secret'
+                self.assertIsNone(SignedToken.verify(token))
+                app.config['AUTH_TOKEN_SECRET'] = 'a secret for the tests'
+
+                # Expired token
+                app.config['AUTH_TOKEN_LIFETIME'] = -10
+                expired = SignedToken.generate(user, 0)
+                app.config['AUTH_TOKEN_LIFETIME'] = 86400
+                self.assertIsNone(SignedToken.verify(expired))
+                assert not MyTokenAuth().check_auth(expired, [], 'host', 'GET')
+
+                # Not ASCII tokens
+                self.assertIsNone(SignedToken.verify(u'\xe9t\xe9.' + signature))
+                self.assertIsNone(SignedToken.verify(token.split('.')[0] + u'.\xe9t\xe9'))
+                assert not MyTokenAuth().check_auth(u'\xe9t\xe9.\xe9t\xe9', [], 'host', 'GET')
+
+                # Token of a super-administrator which does not exist anymore
+                deleted = SignedToken.generate({'_id': ObjectId(),
+                                                'back_role_super_admin': True}, 0)
+                assert SignedToken.verify(deleted)
+                AuthCache.clear()
+                assert not MyTokenAuth().check_auth(deleted, [], 'host', 'GET')
+        finally:
+            app.config['AUTH_TOKEN_SIGNED'] = False
+            app.config['AUTH_TOKEN_SECRET'] = None
+
+    def test_rehash(self):
+        """
+        Test the password hashed with another cost is hashed again when the user logs in
+
+        :return: None
+        """
+        from werkzeug.security import generate_password_hash
+        from alignak_backend.app import app
+
+        with app.test_request_context():
+            users = app.data.driver.db['user']
+            users.update_one({'name': 'admin'},
+                             {'$set': {'password': generate_password_hash(
+                                 'admin', 'pbkdf2:sha256:1000')}})
+
+        headers = {'Content-Type': 'application/json'}
+        params = {'username': 'admin', 'password': 'admin'}
+        response = requests.post(self.endpoint + '/login', json=params, headers=headers)
+        self.assertEqual(200, response.status_code)
+        assert response.json()['token']
+
+        with app.test_request_context():
+            password = users.find_one({'name': 'admin'})['password']
+        self.assertTrue(password.startswith('pbkdf2:sha256:%d$'
+                                            % app.config['PASSWORD_HASH_ITERATIONS']))
+
+        # The password is not hashed again at the next login
+        response = requests.post(self.endpoint + '/login', json=params, headers=headers)
+        self.assertEqual(200, response.status_code)
+        with app.test_request_context():
+            self.assertEqual(password, users.find_one({'name': 'admin'})['password'])
+
+        # A wrong password does not change the hash
+        params['password'] = 'wrong'
+        response = requests.post(self.endpoint + '/login', json=params, headers=headers)
+        self.assertEqual(401, response.status_code)
+        with app.test_request_context():
+            self.assertEqual(password, users.find_one({'name': 'admin'})['password'])
@@ -577,6 +577,15 @@ class TestOverallState(unittest2.TestCase):
                                 params=sort_id, auth=self.auth)
         ls_host = response.json()
         self.assertEqual(2, ls_host['_overall_state_id'])
+        # The host counts its services for each overall state
+        self.assertEqual({'0': 0, '1': 1, '2': 1, '3': 0, '4': 0},
+                         ls_host['_overall_state_services'])
+
+        # The realm counts the host in its overall state
+        response = requests.get(self.endpoint + '/realm/' + self.realm_all, auth=self.auth)
+        realm = response.json()
+        self.assertEqual(1, realm['_overall_state_counts']['2'])
+        self.assertGreaterEqual(realm['_overall_state_id'], 2)
 
     def test_update_service(self):
         """
@@ -906,3 +915,176 @@ class TestOverallState(unittest2.TestCase):
         ls_host = response.json()
         # _overall_state_id field is 2 (at least one service is problem and downtimed)
         self.assertEqual(2, ls_host['_overall_state_id'])
+
+    def test_unreachable_host_critical_service(self):
+        """
+        Test the overall state of an unreachable host having a critical service: the services
+        are only used when the host overall state is <= 2
+
+        :return: None
+        """
+        headers = {'Content-Type': 'application/json'}
+        sort_id = {'sort': '_id'}
+
+        # Add command
+        data = json.loads(open('cfg/command_ping.json').read())
+        data['_realm'] = self.realm_all
+        requests.post(self.endpoint + '/command', json=data, headers=headers, auth=self.auth)
+        response = requests.get(self.endpoint + '/command', params=sort_id, auth=self.auth)
+        resp = response.json()
+        rc = resp['_items']
+
+        # Add host
+        data = json.loads(open('cfg/host_srv001.json').read())
+        data['check_command'] = rc[2]['_id']
+        if 'realm' in data:
+            del data['realm']
+        data['_realm'] = self.realm_all
+        requests.post(self.endpoint + '/host', json=data, headers=headers, auth=self.auth)
+        response = requests.get(self.endpoint + '/host', params=sort_id, auth=self.auth)
+        resp = response.json()
+        rh = resp['_items']
+
+        # Add service
+        data = json.loads(open('cfg/service_srv001_ping.json').read())
+        data['host'] = rh[1]['_id']
+        data['check_command'] = rc[2]['_id']
+        data['_realm'] = self.realm_all
+        requests.post(self.endpoint + '/service', json=data, headers=headers, auth=self.auth)
+        response = requests.get(self.endpoint + '/service', params=sort_id, auth=self.auth)
+        resp = response.json()
+        ls_service = resp['_items'][0]
+
+        # The service is CRITICAL HARD
+        data = {
+            'ls_state': 'CRITICAL',
+            'ls_state_id': 2,
+            'ls_state_type': 'HARD',
+            'ls_acknowledged': False
+        }
+        headers_patch = {
+            'Content-Type': 'application/json',
+            'If-Match': ls_service['_etag']
+        }
+        requests.patch(self.endpoint + '/service/' + ls_service['_id'], json=data,
+                       headers=headers_patch, auth=self.auth)
+        response = requests.get(
+            self.endpoint + '/service/' + ls_service['_id'], params=sort_id, auth=self.auth
+        )
+        ls_service = response.json()
+        self.assertEqual(4, ls_service['_overall_state_id'])
+
+        # The host is UNREACHABLE HARD
+        response = requests.get(self.endpoint + '/host/' + rh[1]['_id'],
+                                params=sort_id, auth=self.auth)
+        ls_host = response.json()
+        data = {
+            'ls_state': 'UNREACHABLE',
+            'ls_state_id': 3,
+            'ls_state_type': 'HARD',
+            'ls_acknowledged': False,
+        }
+        headers_patch = {
+            'Content-Type': 'application/json',
+            'If-Match': ls_host['_etag']
+        }
+        requests.patch(self.endpoint + '/host/' + ls_host['_id'], json=data,
+                       headers=headers_patch, auth=self.auth)
+        response = requests.get(self.endpoint + '/host/' + ls_host['_id'],
+                                params=sort_id, auth=self.auth)
+        ls_host = response.json()
+        # The host counts its critical service...
+        self.assertEqual(1, ls_host['_overall_state_services']['4'])
+        # ... but its overall state is 3 (host unreachable), as without the services
+        self.assertEqual(3, ls_host['_overall_state_id'])
+
+    def test_move_groups(self):
+        """
+        Test the overall state of the former and new parents of a realm / hostgroup moved in
+        its tree
+
+        :return: None
+        """
+        headers = {'Content-Type': 'application/json'}
+
+        def get_item(resource, item_id):
+            """Get an item of the backend"""
+            response = requests.get(self.endpoint + '/' + resource + '/' + item_id,
+                                    auth=self.auth)
+            return response.json()
+
+        def add_item(resource, data):
+            """Add an item in the backend, get its id"""
+            response = requests.post(self.endpoint + '/' + resource, json=data,
+                                     headers=headers, auth=self.auth)
+            return response.json()['_id']
+
+        def move(resource, item_id, parent_id):
+            """Move an item under another parent"""
+            item = get_item(resource, item_id)
+            headers_patch = {'Content-Type': 'application/json', 'If-Match': item['_etag']}
+            response = requests.patch(self.endpoint + '/' + resource + '/' + item_id,
+                                      json={'_parent': parent_id}, headers=headers_patch,
+                                      auth=self.auth)
+            self.assertEqual(response.status_code, 200)
+
+        # Realms: All > Naboo > Theed, All > Tatooine
+        naboo = add_item('realm', {'name': 'Naboo', '_parent': self.realm_all})
+        theed = add_item('realm', {'name': 'Theed', '_parent': naboo})
+        tatooine = add_item('realm', {'name': 'Tatooine', '_parent': self.realm_all})
+
+        # An host DOWN HARD in Theed
+        data = json.loads(open('cfg/command_ping.json').read())
+        data['_realm'] = self.realm_all
+        command_id = add_item('command', data)
+        data = json.loads(open('cfg/host_srv001.json').read())
+        data['check_command'] = command_id
+        if 'realm' in data:
+            del data['realm']
+        data['_realm'] = theed
+        host_id = add_item('host', data)
+        host = get_item('host', host_id)
+        headers_patch = {'Content-Type': 'application/json', 'If-Match': host['_etag']}
+        requests.patch(self.endpoint + '/host/' + host_id,
+                       json={'ls_state': 'DOWN', 'ls_state_id': 1, 'ls_state_type': 'HARD',
+                             'ls_acknowledged': False},
+                       headers=headers_patch, auth=self.auth)
+        state = get_item('host', host_id)['_overall_state_id']
+        self.assertGreater(state, 0)
+
+        # Hostgroups: All > Jedi > Padawan (with the host), All > Sith
+        response = requests.get(self.endpoint + '/hostgroup', params={'sort': '_level'},
+                                auth=self.auth)
+        hostgroup_all = response.json()['_items'][0]['_id']
+        jedi = add_item('hostgroup', {'name': 'Jedi', '_realm': self.realm_all,
+                                      '_parent': hostgroup_all})
+        padawan = add_item('hostgroup', {'name': 'Padawan', '_realm': self.realm_all,
+                                         '_parent': jedi, 'hosts': [host_id]})
+        sith = add_item('hostgroup', {'name': 'Sith', '_realm': self.realm_all,
+                                      '_parent': hostgroup_all})
+
+        for resource, former, new in [('realm', naboo, tatooine), ('hostgroup', jedi, sith)]:
+            self.assertEqual(1, get_item(resource, former)['_overall_state_counts'][str(state)])
+            self.assertEqual(state, get_item(resource, former)['_overall_state_id'])
+            self.assertEqual(0, get_item(resource, new)['_overall_state_counts'][str(state)])
+            self.assertEqual(0, get_item(resource, new)['_overall_state_id'])
+
+        move('realm', theed, tatooine)
+        move('hostgroup', padawan, sith)
+
+        for resource, former, new in [('realm', naboo, tatooine), ('hostgroup', jedi, sith)]:
+            self.assertEqual(0, get_item(resource, former)['_overall_state_counts'][str(state)])
+            self.assertEqual(0, get_item(resource, former)['_overall_state_id'])
+            self.assertEqual(1, get_item(resource, new)['_overall_state_counts'][str(state)])
+            self.assertEqual(state, get_item(resource, new)['_overall_state_id'])
+        # The common parent still counts the host
+        realm_all = get_item('realm', self.realm_all)
+        self.assertEqual(1, realm_all['_overall_state_counts'][str(state)])
+        self.assertEqual(1, get_item('hostgroup', hostgroup_all)['_overall_state_counts'][
+            str(state)])
+
+        # Delete the hostgroups, not to change the groups of the other tests
+        for hostgroup_id in [padawan, jedi, sith]:
+            hostgroup = get_item('hostgroup', hostgroup_id)
+            requests.delete(self.endpoint + '/hostgroup/' + hostgroup_id,
+                            headers={'If-Match': hostgroup['_etag']}, auth=self.auth)
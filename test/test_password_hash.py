@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test verify the hash of the users passwords
+"""
+
+import os
+import time
+import unittest2
+from flask import Flask
+from werkzeug.exceptions import ServiceUnavailable
+from alignak_backend.passwordhash import PasswordHash
+
+
+class TestPasswordHash(unittest2.TestCase):
+    """
+    This class test the hash of the passwords in the pool of processes
+    """
+
+    def setUp(self):
+        """
+        Create an application with a cheap hash
+
+        :return: None
+        """
+        self.app = Flask(__name__)
+        self.app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+        self.app.config['PASSWORD_HASH_WORKERS'] = 1
+        self.app.config['PASSWORD_HASH_QUEUE'] = 2
+        self.app.config['PASSWORD_HASH_TIMEOUT'] = 10
+
+    def tearDown(self):
+        """
+        Stop the pool of processes
+
+        :return: None
+        """
+        if PasswordHash.pool is not None:
+            PasswordHash.pool.terminate()
+        PasswordHash.pool = None
+        PasswordHash.pool_pid = None
+        PasswordHash.pending = 0
+
+    def test_inline(self):
+        """
+        Test the passwords are hashed in the backend process without workers
+
+        :return: None
+        """
+        self.app.config['PASSWORD_HASH_WORKERS'] = 0
+        with self.app.test_request_context():
+            pwhash = PasswordHash.generate('secret')
+            self.assertTrue(pwhash.startswith('pbkdf2:sha256:1000$'))
+            self.assertTrue(PasswordHash.check(pwhash, 'secret'))
+            self.assertFalse(PasswordHash.check(pwhash, 'other'))
+        self.assertIsNone(PasswordHash.pool)
+
+    def test_pool(self):
+        """
+        Test the passwords are hashed in the pool, and a new pool is created in a forked
+        process
+
+        :return: None
+        """
+        with self.app.test_request_context():
+            pwhash = PasswordHash.generate('secret')
+            self.assertTrue(pwhash.startswith('pbkdf2:sha256:1000$'))
+            self.assertTrue(PasswordHash.check(pwhash, 'secret'))
+            self.assertFalse(PasswordHash.check(pwhash, 'other'))
+            pool = PasswordHash.pool
+            self.assertIsNotNone(pool)
+            self.assertEqual(os.getpid(), PasswordHash.pool_pid)
+            self.assertEqual(0, PasswordHash.pending)
+
+            # Same process, same pool
+            PasswordHash.check(pwhash, 'secret')
+            self.assertIs(pool, PasswordHash.pool)
+
+            # The pool was created by the parent process
+            PasswordHash.pool_pid = -1
+            self.assertTrue(PasswordHash.check(pwhash, 'secret'))
+            self.assertIsNot(pool, PasswordHash.pool)
+            self.assertEqual(os.getpid(), PasswordHash.pool_pid)
+            pool.terminate()
+
+    def test_queue_full(self):
+        """
+        Test a hash is rejected when too many hashes are waiting for the pool
+
+        :return: None
+        """
+        with self.app.test_request_context():
+            PasswordHash.pending = 2
+            with self.assertRaises(ServiceUnavailable):
+                PasswordHash.generate('secret')
+            self.assertEqual(2, PasswordHash.pending)
+
+            PasswordHash.pending = 1
+            self.assertTrue(PasswordHash.generate('secret'))
+            self.assertEqual(1, PasswordHash.pending)
+
+    def test_timeout(self):
+        """
+        Test a hash is rejected when the pool does not compute it in time
+
+        :return: None
+        """
+        self.app.config['PASSWORD_HASH_TIMEOUT'] = 0.2
+        with self.app.test_request_context():
+            with self.assertRaises(ServiceUnavailable):
+                PasswordHash.run(time.sleep, 2)
+            self.assertEqual(0, PasswordHash.pending)
+
+    def test_needs_rehash(self):
+        """
+        Test a hash computed with another method or cost must be computed again
+
+        :return: None
+        """
+        with self.app.test_request_context():
+            self.assertFalse(PasswordHash.needs_rehash('pbkdf2:sha256:1000$salt$hash'))
+            self.assertTrue(PasswordHash.needs_rehash('pbkdf2:sha256:50000$salt$hash'))
+            self.assertTrue(PasswordHash.needs_rehash('pbkdf2:sha1:1000$salt$hash'))
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test verify the realm path of the realm-scoped documents and the rights lookup using it
+"""
+
+import os
+import json
+import time
+import shlex
+import subprocess
+import requests
+import unittest2
+from bson.objectid import ObjectId
+from flask import Flask, g
+from alignak_backend.rightscheck import RightsCheck
+
+
+class TestRightsLookup(unittest2.TestCase):
+    """
+    This class test the conditions on the items a user can read
+    """
+
+    def setUp(self):
+        """
+        Create an application and the rights of a user on the hosts: the realm All with its
+        sub-realms, the realm A without its sub-realms
+
+        :return: None
+        """
+        self.app = Flask(__name__)
+        self.app.config['REALM_PATH_FILTER'] = True
+        self.realm_all = ObjectId()
+        self.realm_a = ObjectId()
+        self.realm_a1 = ObjectId()
+        self.rights = {
+            'resources_get': {'host': [self.realm_all, self.realm_a, self.realm_a1]},
+            'resources_get_direct': {'host': []},
+            'resources_get_paths': {'host': ['%s/' % self.realm_all]},
+            'resources_get_parents': {'host': []},
+            'resources_get_custom': {},
+            'users_id': ObjectId()
+        }
+
+    def get_lookup(self, resource):
+        """
+        Get the lookup of the user
+
+        :param resource: name of the resource
+        :type resource: str
+        :return: the lookup
+        :rtype: list or None
+        """
+        with self.app.test_request_context():
+            for name, value in self.rights.items():
+                setattr(g, name, value)
+            return RightsCheck.get_lookup(resource)
+
+    def test_realm_path(self):
+        """
+        Test the realms with their sub-realms are searched with their path, and only the
+        conditions which may find some items are in the lookup
+
+        :return: None
+        """
+        self.assertEqual([{'_realm_path': {'$regex': '^%s/' % self.realm_all}}],
+                         self.get_lookup('host'))
+        self.assertIsNone(self.get_lookup('service'))
+
+        # A realm without its sub-realms, a parent realm, custom rights
+        self.rights['resources_get_direct']['host'] = [self.realm_a]
+        self.rights['resources_get_parents']['host'] = [self.realm_all]
+        self.rights['resources_get_custom']['host'] = [self.realm_a1]
+        self.assertEqual([{'_realm': {'$in': [self.realm_a]}},
+                          {'_realm_path': {'$regex': '^%s/' % self.realm_all}},
+                          {'$and': [{'_sub_realm': True},
+                                    {'_realm': {'$in': [self.realm_all]}}]},
+                          {'$and': [{'_users_read': self.rights['users_id']},
+                                    {'_realm': {'$in': [self.realm_a1]}}]}],
+                         self.get_lookup('host'))
+
+    def test_realms(self):
+        """
+        Test the lookup without the realm path: the realms with their sub-realms are all in
+        the lookup
+
+        :return: None
+        """
+        self.app.config['REALM_PATH_FILTER'] = False
+        self.assertEqual([{'_realm': {'$in': [self.realm_all, self.realm_a, self.realm_a1]}}],
+                         self.get_lookup('host'))
+
+        # Only custom rights
+        self.rights['resources_get'] = {}
+        self.rights['resources_get_custom']['host'] = [self.realm_a]
+        self.assertEqual([{'$and': [{'_users_read': self.rights['users_id']},
+                                    {'_realm': {'$in': [self.realm_a]}}]}],
+                         self.get_lookup('host'))
+
+        # No right on the realms
+        self.rights['resources_get_custom']['host'] = []
+        self.assertIsNone(self.get_lookup('host'))
+
+
+class TestRealmPath(unittest2.TestCase):
+    """
+    This class test the realm path of the realm-scoped documents
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        This method:
+          * delete mongodb database
+          * start the backend with uwsgi
+          * log in the backend and get the token
+          * get the realm
+
+        :return: None
+        """
+        # Set test mode for Alignak backend
+        os.environ['TEST_ALIGNAK_BACKEND'] = '1'
+        os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'] = 'alignak-backend-test'
+
+        # Delete used mongo DBs
+        exit_code = subprocess.call(
+            shlex.split(
+                'mongo %s --eval "db.dropDatabase()"' % os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'])
+        )
+        assert exit_code == 0
+
+        cls.p = subprocess.Popen(['uwsgi', '--plugin', 'python', '-w', 'alignakbackend:app',
+                                  '--socket', '0.0.0.0:5000',
+                                  '--protocol=http', '--enable-threads', '--pidfile',
+                                  '/tmp/uwsgi.pid'])
+        time.sleep(3)
+
+        cls.endpoint = 'http://127.0.0.1:5000'
+
+        headers = {'Content-Type': 'application/json'}
+        params = {'username': 'admin', 'password': 'admin', 'action': 'generate'}
+        # get token
+        response = requests.post(cls.endpoint + '/login', json=params, headers=headers)
+        resp = response.json()
+        cls.token = resp['token']
+        cls.auth = requests.auth.HTTPBasicAuth(cls.token, '')
+
+        # get realms
+        response = requests.get(cls.endpoint + '/realm', auth=cls.auth)
+        resp = response.json()
+        cls.realm_all = resp['_items'][0]['_id']
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Kill uwsgi
+
+        :return: None
+        """
+        subprocess.call(['uwsgi', '--stop', '/tmp/uwsgi.pid'])
+        time.sleep(2)
+
+    @classmethod
+    def tearDown(cls):
+        """
+        Delete resources in backend
+
+        :return: None
+        """
+        for resource in ['command', 'realm']:
+            requests.delete(cls.endpoint + '/' + resource, auth=cls.auth)
+
+    def add_realm(self, name, parent_id):
+        """
+        Add a realm
+
+        :param name: name of the realm
+        :type name: str
+        :param parent_id: id of the parent realm
+        :type parent_id: str
+        :return: id of the realm
+        :rtype: str
+        """
+        headers = {'Content-Type': 'application/json'}
+        response = requests.post(self.endpoint + '/realm',
+                                 json={'name': name, '_parent': parent_id},
+                                 headers=headers, auth=self.auth)
+        return response.json()['_id']
+
+    def add_command(self, name, realm_id):
+        """
+        Add a command in a realm
+
+        :param name: name of the command
+        :type name: str
+        :param realm_id: id of the realm
+        :type realm_id: str
+        :return: the command
+        :rtype: dict
+        """
+        headers = {'Content-Type': 'application/json'}
+        data = json.loads(open('cfg/command_ping.json').read())
+        data['name'] = name
+        data['_realm'] = realm_id
+        response = requests.post(self.endpoint + '/command', json=data, headers=headers,
+                                 auth=self.auth)
+        return response.json()
+
+    @staticmethod
+    def get_path(command_id):
+        """
+        Get the realm path stored in a command
+
+        :param command_id: id of the command
+        :type command_id: str
+        :return: the realm path
+        :rtype: str
+        """
+        from alignak_backend.app import app
+
+        with app.test_request_context():
+            command = app.data.driver.db['command'].find_one({'_id': ObjectId(command_id)})
+        return command.get('_realm_path')
+
+    def test_insert_update_replace(self):
+        """
+        Test the realm path is set when a document is inserted, updated and replaced
+
+        :return: None
+        """
+        realm_a = self.add_realm('All A', self.realm_all)
+        realm_a1 = self.add_realm('All A1', realm_a)
+        path_a = '%s/%s/' % (self.realm_all, realm_a)
+        path_a1 = path_a + '%s/' % realm_a1
+
+        command = self.add_command('ping_a1', realm_a1)
+        self.assertEqual(path_a1, self.get_path(command['_id']))
+
+        # Update of the realm
+        headers = {'Content-Type': 'application/json', 'If-Match': command['_etag']}
+        response = requests.patch(self.endpoint + '/command/' + command['_id'],
+                                  json={'_realm': realm_a}, headers=headers, auth=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(path_a, self.get_path(command['_id']))
+
+        # Update of another field: the path is kept
+        headers['If-Match'] = response.json()['_etag']
+        response = requests.patch(self.endpoint + '/command/' + command['_id'],
+                                  json={'alias': 'ping'}, headers=headers, auth=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(path_a, self.get_path(command['_id']))
+
+        # Replace
+        headers['If-Match'] = response.json()['_etag']
+        data = json.loads(open('cfg/command_ping.json').read())
+        data['name'] = 'ping_a1'
+        data['_realm'] = realm_a1
+        response = requests.put(self.endpoint + '/command/' + command['_id'], json=data,
+                                headers=headers, auth=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(path_a1, self.get_path(command['_id']))
+
+    def test_move_realm(self):
+        """
+        Test the realm path of the documents of a realm and of its sub-realms is updated when
+        the realm is moved in the tree
+
+        :return: None
+        """
+        realm_a = self.add_realm('All A', self.realm_all)
+        realm_a1 = self.add_realm('All A1', realm_a)
+        realm_b = self.add_realm('All B', self.realm_all)
+        command_a = self.add_command('ping_a', realm_a)
+        command_a1 = self.add_command('ping_a1', realm_a1)
+        command_b = self.add_command('ping_b', realm_b)
+
+        # The realm A (with the realm A1) is moved under the realm B
+        response = requests.get(self.endpoint + '/realm/' + realm_a, auth=self.auth)
+        headers = {'Content-Type': 'application/json', 'If-Match': response.json()['_etag']}
+        response = requests.patch(self.endpoint + '/realm/' + realm_a,
+                                  json={'_parent': realm_b}, headers=headers, auth=self.auth)
+        self.assertEqual(response.status_code, 200)
+
+        path_b = '%s/%s/' % (self.realm_all, realm_b)
+        self.assertEqual(path_b + '%s/' % realm_a, self.get_path(command_a['_id']))
+        self.assertEqual(path_b + '%s/%s/' % (realm_a, realm_a1),
+                         self.get_path(command_a1['_id']))
+        self.assertEqual(path_b, self.get_path(command_b['_id']))
+
+    def test_backfill(self):
+        """
+        Test the realm path of the documents without a path or with a wrong path is set by the
+        backfill and by the realm_path command
+
+        :return: None
+        """
+        from alignak_backend.app import app, realm_path
+        from alignak_backend.realmpath import RealmPath
+
+        realm_a = self.add_realm('All A', self.realm_all)
+        command_all = self.add_command('ping_all', self.realm_all)
+        command_a = self.add_command('ping_a', realm_a)
+        path_all = '%s/' % self.realm_all
+        path_a = '%s/%s/' % (self.realm_all, realm_a)
+
+        with app.test_request_context():
+            commands = app.data.driver.db['command']
+            commands.update_one({'_id': ObjectId(command_all['_id'])},
+                                {'$unset': {'_realm_path': ''}})
+            commands.update_one({'_id': ObjectId(command_a['_id'])},
+                                {'$set': {'_realm_path': 'wrong/'}})
+            self.assertEqual(2, RealmPath.backfill())
+            self.assertEqual(0, RealmPath.backfill())
+            self.assertIn('_realm_path_1', commands.index_information())
+        self.assertEqual(path_all, self.get_path(command_all['_id']))
+        self.assertEqual(path_a, self.get_path(command_a['_id']))
+
+        with app.test_request_context():
+            app.data.driver.db['command'].update_many({}, {'$unset': {'_realm_path': ''}})
+        realm_path({})
+        self.assertEqual(path_all, self.get_path(command_all['_id']))
+        self.assertEqual(path_a, self.get_path(command_a['_id']))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test verify the snapshot of the realms tree
+"""
+
+import os
+import shlex
+import subprocess
+import unittest2
+from flask import g
+from alignak_backend.realmtree import RealmTree
+
+
+class TestRealmTree(unittest2.TestCase):
+    """
+    This class test the snapshot of the realms tree and its reload
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        This method delete the mongodb database
+
+        :return: None
+        """
+        # Set test mode for Alignak backend
+        os.environ['TEST_ALIGNAK_BACKEND'] = '1'
+        os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'] = 'alignak-backend-test'
+
+        # Delete used mongo DBs
+        exit_code = subprocess.call(
+            shlex.split(
+                'mongo %s --eval "db.dropDatabase()"' % os.environ['ALIGNAK_BACKEND_MONGO_DBNAME'])
+        )
+        assert exit_code == 0
+
+    def setUp(self):
+        """
+        Delete the realms generation
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        with app.test_request_context():
+            app.data.driver.db['generation'].delete_many({'_id': 'realm'})
+        RealmTree.current = None
+
+    def test_paths(self):
+        """
+        Test the paths of the realms in the snapshot
+
+        :return: None
+        """
+        realms = [
+            {'_id': 'a1', 'name': 'A1', '_level': 2, '_parent': 'a', '_tree_parents': ['all', 'a'],
+             '_children': [], '_all_children': []},
+            {'_id': 'all', 'name': 'All', '_level': 0, '_parent': None, '_tree_parents': [],
+             '_children': ['a'], '_all_children': ['a', 'a1']},
+            {'_id': 'a', 'name': 'A', '_level': 1, '_parent': 'all', '_tree_parents': ['all'],
+             '_children': ['a1'], '_all_children': ['a1']},
+        ]
+        tree = RealmTree(realms, 3)
+        self.assertEqual(3, tree.generation)
+        self.assertEqual({'all': 'All', 'a': 'All.A', 'a1': 'All.A.A1'}, tree.paths)
+        self.assertEqual({'all': 'all/', 'a': 'all/a/', 'a1': 'all/a/a1/'}, tree.id_paths)
+        self.assertEqual(('all', 'a'), tree.parents['a1'])
+        self.assertEqual(('a', 'a1'), tree.all_children['all'])
+
+    def test_bump(self):
+        """
+        Test the realms generation is incremented in the database
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        with app.test_request_context():
+            self.assertEqual(0, RealmTree.get_generation())
+            RealmTree.bump()
+            self.assertEqual(1, RealmTree.get_generation())
+            RealmTree.bump()
+            self.assertEqual(2, RealmTree.get_generation())
+            self.assertIsNone(RealmTree.current)
+
+    def test_get(self):
+        """
+        Test the snapshot is loaded once per request and reloaded only when the realms
+        generation changed
+
+        :return: None
+        """
+        from alignak_backend.app import app
+
+        with app.test_request_context():
+            tree = RealmTree.get()
+            self.assertEqual(0, tree.generation)
+            self.assertIs(tree, g.realm_tree)
+            self.assertIs(tree, RealmTree.current)
+            realm_all = app.data.driver.db['realm'].find_one({'_level': 0})
+            self.assertEqual('All', tree.paths[realm_all['_id']])
+
+            # The generation is read once per request
+            app.data.driver.db['generation'].update_one({'_id': 'realm'},
+                                                        {'$inc': {'value': 1}}, upsert=True)
+            self.assertIs(tree, RealmTree.get())
+
+        # Another request with the same generation gets the same snapshot
+        with app.test_request_context():
+            app.data.driver.db['generation'].update_one({'_id': 'realm'},
+                                                        {'$set': {'value': 0}})
+            self.assertIs(tree, RealmTree.get())
+
+        # The realms changed in another process
+        with app.test_request_context():
+            app.data.driver.db['generation'].update_one({'_id': 'realm'},
+                                                        {'$inc': {'value': 1}})
+            new_tree = RealmTree.get()
+            self.assertIsNot(tree, new_tree)
+            self.assertEqual(1, new_tree.generation)
+            self.assertIs(new_tree, RealmTree.get())
+
+        # The realms changed in this request
+        with app.test_request_context():
+            self.assertIs(new_tree, RealmTree.get())
+            RealmTree.bump()
+            self.assertNotIn('realm_tree', g)
+            bumped_tree = RealmTree.get()
+            self.assertEqual(2, bumped_tree.generation)
+            self.assertIsNot(new_tree, bumped_tree)
@@ -165,3 +165,73 @@ class TestRecalculateLivesynthesis(unittest2.TestCase):
         self.assertEqual(r[0]['services_unknown_soft'], 0)
         self.assertEqual(r[0]['services_acknowledged'], 0)
         self.assertEqual(r[0]['services_in_downtime'], 0)
+
+    def test_recalculate_drift(self):
+        """
+        Test the incremental recalculation and the full recalculation (--full option of the
+        livesynthesis_recalculate command) fix the same wrong counters
+
+        :return: None
+        """
+        from bson.objectid import ObjectId
+        from alignak_backend.app import app, livesynthesis_recalculate
+        from alignak_backend.livesynthesis import Livesynthesis
+
+        headers = {'Content-Type': 'application/json'}
+
+        # An host in a sub-realm
+        response = requests.post(self.endpoint + '/realm',
+                                 json={'name': 'All A', '_parent': self.realm_all},
+                                 headers=headers, auth=self.auth)
+        realm_a = ObjectId(response.json()['_id'])
+        response = requests.get(self.endpoint + '/command', params={'where': '{"name": "ping"}'},
+                                auth=self.auth)
+        data = json.loads(open('cfg/host_srv001.json').read())
+        data['name'] = 'srv002'
+        data['check_command'] = response.json()['_items'][0]['_id']
+        del data['realm']
+        data['_realm'] = str(realm_a)
+        requests.post(self.endpoint + '/host', json=data, headers=headers, auth=self.auth)
+        realm_all = ObjectId(self.realm_all)
+
+        def get_counters():
+            """Get the live synthesis counters of each realm"""
+            with app.test_request_context():
+                return dict((live['_realm'],
+                             dict((name, value) for name, value in live.items()
+                                  if name not in ['_id', '_etag', '_created', '_updated']))
+                            for live in app.data.driver.db['livesynthesis'].find())
+
+        def drift():
+            """Set some wrong counters and delete a live synthesis"""
+            with app.test_request_context():
+                livesynthesis = app.data.driver.db['livesynthesis']
+                livesynthesis.update_one({'_realm': realm_all},
+                                         {'$set': {'hosts_total': 10,
+                                                   'services_unknown_hard': 0,
+                                                   '_all_counters.hosts_total': 0}})
+                livesynthesis.delete_one({'_realm': realm_a})
+
+        with app.test_request_context():
+            # Already right
+            self.assertEqual(0, Livesynthesis.recalculate())
+            self.assertEqual(2, Livesynthesis.recalculate(True))
+        expected = get_counters()
+        self.assertEqual(1, expected[realm_all]['hosts_total'])
+        self.assertEqual(2, expected[realm_all]['_all_counters']['hosts_total'])
+        self.assertEqual(1, expected[realm_a]['hosts_total'])
+        self.assertEqual(1, expected[realm_a]['_all_counters']['hosts_total'])
+
+        # Only the wrong live synthesis are written
+        drift()
+        self.assertNotEqual(expected, get_counters())
+        with app.test_request_context():
+            self.assertEqual(2, Livesynthesis.recalculate())
+            self.assertEqual(0, Livesynthesis.recalculate())
+        self.assertEqual(expected, get_counters())
+
+        # The commands, incremental and full
+        for options in [{'--full': False}, {'--full': True}]:
+            drift()
+            livesynthesis_recalculate(options)
+            self.assertEqual(expected, get_counters())
@@ -299,3 +299,201 @@ class TestRights(unittest2.TestCase):
         self.assertEqual(resp['_meta']['total'], 2)
         self.assertEqual('Dagobah', resp['_items'][0]['name'])
         self.assertEqual('Sluis', resp['_items'][1]['name'])
+
+    def test_rights_refresh(self):
+        """
+        Test the rights of a user are refreshed as soon as its userrestrictrole are modified,
+        even if its rights are in the authentication cache
+
+        :return: None
+        """
+        headers = {'Content-Type': 'application/json'}
+        params = {'username': 'user3', 'password': 'test', 'action': 'generate'}
+        response = requests.post(self.endpoint + '/login', json=params, headers=headers)
+        resp = response.json()
+        user3_auth = requests.auth.HTTPBasicAuth(resp['token'], '')
+
+        # No rights, so no commands
+        response = requests.get(self.endpoint + '/command', auth=user3_auth)
+        resp = response.json()
+        self.assertEqual(len(resp['_items']), 0)
+
+        # Add a read right on the commands
+        data = {'user': self.user3_id, 'realm': self.realmAll_id, 'resource': 'command',
+                'crud': ['read']}
+        response = requests.post(self.endpoint + '/userrestrictrole', json=data,
+                                 headers=headers, auth=self.auth)
+        resp = response.json()
+        role_id = resp['_id']
+        role_etag = resp['_etag']
+
+        # The default commands are now available
+        response = requests.get(self.endpoint + '/command', auth=user3_auth)
+        resp = response.json()
+        self.assertEqual(len(resp['_items']), 2)
+
+        # Delete the read right
+        headers_delete = {'Content-Type': 'application/json', 'If-Match': role_etag}
+        response = requests.delete(self.endpoint + '/userrestrictrole/' + role_id,
+                                   headers=headers_delete, auth=self.auth)
+        self.assertEqual(response.status_code, 204)
+
+        # No more commands
+        response = requests.get(self.endpoint + '/command', auth=user3_auth)
+        resp = response.json()
+        self.assertEqual(len(resp['_items']), 0)
+
+    def test_rights_check(self):
+        """
+        Test the rights of a user on several items checked in one request
+
+        :return: None
+        """
+        headers = {'Content-Type': 'application/json'}
+        data = json.loads(open('cfg/command_ping.json').read())
+        data['_realm'] = self.dagobah
+        data['name'] = 'ping_check'
+        response = requests.post(self.endpoint + '/command', json=data, headers=headers,
+                                 auth=self.auth)
+        resp = response.json()
+        command_id = resp['_id']
+        command_etag = resp['_etag']
+
+        checks = [['command', command_id, 'GET'], ['command', command_id, 'PATCH'],
+                  {'resource': 'command', 'item_id': command_id, 'method': 'DELETE'},
+                  ['command', 'notanid', 'GET']]
+
+        # Not authenticated
+        response = requests.post(self.endpoint + '/rights/check', json={'checks': checks},
+                                 headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+        # Bad data
+        response = requests.post(self.endpoint + '/rights/check', json={'checks': 'command'},
+                                 headers=headers, auth=self.auth)
+        self.assertEqual(response.status_code, 400)
+
+        # Super-admin has all the rights on the existing items
+        response = requests.post(self.endpoint + '/rights/check', json={'checks': checks},
+                                 headers=headers, auth=self.auth)
+        resp = response.json()
+        self.assertEqual([item['allowed'] for item in resp['_items']],
+                         [True, True, True, False])
+        self.assertEqual(resp['_items'][2]['method'], 'DELETE')
+        self.assertEqual(resp['_items'][2]['item_id'], command_id)
+
+        # user1 can read the commands of Sluis and its sub-realms, not update / delete them
+        params = {'username': 'user1', 'password': 'test', 'action': 'generate'}
+        response = requests.post(self.endpoint + '/login', json=params, headers=headers)
+        resp = response.json()
+        user1_auth = requests.auth.HTTPBasicAuth(resp['token'], '')
+        response = requests.post(self.endpoint + '/rights/check', json=checks,
+                                 headers=headers, auth=user1_auth)
+        resp = response.json()
+        self.assertEqual([item['allowed'] for item in resp['_items']],
+                         [True, False, False, False])
+
+        # user2 can only read the commands of Hoth
+        params = {'username': 'user2', 'password': 'test', 'action': 'generate'}
+        response = requests.post(self.endpoint + '/login', json=params, headers=headers)
+        resp = response.json()
+        user2_auth = requests.auth.HTTPBasicAuth(resp['token'], '')
+        response = requests.post(self.endpoint + '/rights/check', json={'checks': checks},
+                                 headers=headers, auth=user2_auth)
+        resp = response.json()
+        self.assertEqual([item['allowed'] for item in resp['_items']],
+                         [False, False, False, False])
+
+        # Delete the command, not to change the commands of the other tests
+        headers_delete = {'Content-Type': 'application/json', 'If-Match': command_etag}
+        response = requests.delete(self.endpoint + '/command/' + command_id,
+                                   headers=headers_delete, auth=self.auth)
+        self.assertEqual(response.status_code, 204)
+
+    def test_user_rights(self):
+        """
+        Test the rights stored in the users follow the changes of their userrestrictrole and of
+        the realms, and are computed once for all the realms changes of a request
+
+        :return: None
+        """
+        from bson.objectid import ObjectId
+        from alignak_backend.app import app
+        from alignak_backend.userrights import UserRights
+
+        def get_rights(user_id):
+            """Get the rights stored in a user"""
+            with app.test_request_context():
+                user = app.data.driver.db['user'].find_one({'_id': ObjectId(user_id)})
+            return dict((name, dict((resource, sorted(str(realm) for realm in realms))
+                                    for resource, realms in rights.items()))
+                        for name, rights in user['_user_rights'].items() if name != 'version')
+
+        headers = {'Content-Type': 'application/json'}
+
+        # A new role of user2
+        data = {'user': self.user2_id, 'realm': self.dagobah, 'resource': 'host',
+                'crud': ['read', 'update']}
+        response = requests.post(self.endpoint + '/userrestrictrole', json=data,
+                                 headers=headers, auth=self.auth)
+        resp = response.json()
+        role_id = resp['_id']
+        role_etag = resp['_etag']
+        rights = get_rights(self.user2_id)
+        self.assertEqual([self.dagobah], rights['resources_get']['host'])
+        self.assertEqual([self.dagobah], rights['resources_patch']['host'])
+        self.assertEqual([self.hoth], rights['resources_get']['command'])
+
+        # The role is modified
+        headers_patch = {'Content-Type': 'application/json', 'If-Match': role_etag}
+        response = requests.patch(self.endpoint + '/userrestrictrole/' + role_id,
+                                  json={'crud': ['read']}, headers=headers_patch,
+                                  auth=self.auth)
+        role_etag = response.json()['_etag']
+        rights = get_rights(self.user2_id)
+        self.assertEqual([self.dagobah], rights['resources_get']['host'])
+        self.assertNotIn('host', rights['resources_patch'])
+
+        # A new sub-realm of Sluis is in the rights of the users with the sub-realms of Sluis
+        data = {'name': 'Kashyyyk', '_parent': self.sluis}
+        response = requests.post(self.endpoint + '/realm', json=data, headers=headers,
+                                 auth=self.auth)
+        resp = response.json()
+        kashyyyk = resp['_id']
+        kashyyyk_etag = resp['_etag']
+        self.assertEqual(sorted([self.sluis, self.dagobah, kashyyyk]),
+                         get_rights(self.user6_id)['resources_get']['command'])
+        self.assertEqual(sorted([self.sluis, self.dagobah, kashyyyk]),
+                         get_rights(self.user1_id)['resources_get']['command'])
+        self.assertEqual([self.sluis], get_rights(self.user5_id)['resources_get']['command'])
+
+        # The realm is deleted
+        headers_delete = {'Content-Type': 'application/json', 'If-Match': kashyyyk_etag}
+        response = requests.delete(self.endpoint + '/realm/' + kashyyyk,
+                                   headers=headers_delete, auth=self.auth)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(sorted([self.sluis, self.dagobah]),
+                         get_rights(self.user6_id)['resources_get']['command'])
+
+        # The rights are computed once at the end of the request
+        calls = []
+        update = UserRights.update
+        UserRights.update = staticmethod(lambda user_ids=None: calls.append(user_ids))
+        try:
+            with app.test_request_context():
+                for _ in range(3):
+                    UserRights.on_realm_changed([{'_id': ObjectId(self.sluis)}])
+                self.assertEqual([], calls)
+                UserRights.flush_request(None)
+                self.assertEqual([None], calls)
+                UserRights.flush_request(None)
+                self.assertEqual([None], calls)
+        finally:
+            UserRights.update = staticmethod(update)
+
+        # Delete the role, not to change the rights of the other tests
+        headers_delete = {'Content-Type': 'application/json', 'If-Match': role_etag}
+        response = requests.delete(self.endpoint + '/userrestrictrole/' + role_id,
+                                   headers=headers_delete, auth=self.auth)
+        self.assertEqual(response.status_code, 204)
+        self.assertNotIn('host', get_rights(self.user2_id)['resources_get'])
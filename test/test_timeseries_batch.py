@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test verify the batches of perfdata sent to the timeseries databases
+"""
+
+import time
+import unittest2
+from bson.objectid import ObjectId
+from flask import Flask
+from alignak_backend.timeseriesbatch import TimeseriesBatch
+from alignak_backend.timeseriesstats import TimeseriesStats
+
+
+class TestTimeseriesBatch(unittest2.TestCase):
+    """
+    This class test the batches of perfdata sent to the timeseries databases
+    """
+
+    def setUp(self):
+        """
+        Create an application with the batches settings, the buffers are flushed by the
+        tests, not by the flush thread, and the statistics are not published
+
+        :return: None
+        """
+        self.app = Flask(__name__)
+        self.app.config['TIMESERIES_BATCH_SIZE'] = 3
+        self.app.config['TIMESERIES_BATCH_DELAY'] = 1000
+        self.start = TimeseriesBatch.start
+        TimeseriesBatch.start = staticmethod(lambda app: None)
+        self.sources = TimeseriesStats.sources
+        TimeseriesStats.sources = {}
+        TimeseriesBatch.buffers.clear()
+        TimeseriesBatch.stats_counters.clear()
+        self.destination = {'_id': ObjectId()}
+        self.sent = []
+
+    def tearDown(self):
+        """
+        Restore the flush thread and the statistics sources
+
+        :return: None
+        """
+        TimeseriesBatch.start = staticmethod(self.start)
+        TimeseriesStats.sources = self.sources
+        TimeseriesBatch.buffers.clear()
+        TimeseriesBatch.stats_counters.clear()
+
+    def sender(self, resource, destination, data):
+        """
+        Record the sent perfdata, fail for the perfdata named 'fail'
+
+        :param resource: graphite or influxdb
+        :type resource: str
+        :param destination: the graphite or influxdb document
+        :type destination: dict
+        :param data: list of perfdata
+        :type data: list
+        :return: True if sent
+        :rtype: bool
+        """
+        if 'error' in data:
+            raise IOError('connection refused')
+        self.sent.append((resource, destination['_id'], list(data)))
+        return 'fail' not in data
+
+    def test_flush_size(self):
+        """
+        Test a buffer is sent when it has TIMESERIES_BATCH_SIZE points
+
+        :return: None
+        """
+        key = 'graphite/%s' % self.destination['_id']
+        with self.app.test_request_context():
+            TimeseriesBatch.add('graphite', self.destination, ['a', 'b'], self.sender)
+            self.assertEqual([], self.sent)
+            self.assertEqual({key: 2}, TimeseriesBatch.stats()['pending'])
+
+            TimeseriesBatch.add('graphite', self.destination, ['c', 'd'], self.sender)
+            self.assertEqual([('graphite', self.destination['_id'], ['a', 'b', 'c', 'd'])],
+                             self.sent)
+            self.assertEqual({}, TimeseriesBatch.stats()['pending'])
+
+            # Each database has its own buffer
+            influxdb = {'_id': self.destination['_id']}
+            TimeseriesBatch.add('influxdb', influxdb, ['e', 'f'], self.sender)
+            TimeseriesBatch.add('graphite', self.destination, ['g', 'h'], self.sender)
+            self.assertEqual(1, len(self.sent))
+            TimeseriesBatch.add('influxdb', influxdb, ['i'], self.sender)
+            self.assertEqual(('influxdb', influxdb['_id'], ['e', 'f', 'i']), self.sent[1])
+
+        stats = TimeseriesBatch.stats()['destinations'][key]
+        self.assertEqual(1, stats['batches'])
+        self.assertEqual(4, stats['points'])
+        self.assertEqual(4, stats['max_size'])
+
+        # Without TIMESERIES_BATCH_SIZE, the perfdata are sent at once, without flush thread
+        started = []
+        TimeseriesBatch.start = staticmethod(started.append)
+        self.app.config['TIMESERIES_BATCH_SIZE'] = 0
+        with self.app.test_request_context():
+            TimeseriesBatch.add('influxdb', influxdb, ['j'], self.sender)
+            self.assertEqual(('influxdb', influxdb['_id'], ['j']), self.sent[2])
+        self.assertEqual([], started)
+
+        self.app.config['TIMESERIES_BATCH_SIZE'] = 3
+        with self.app.test_request_context():
+            TimeseriesBatch.add('influxdb', influxdb, ['k'], self.sender)
+        self.assertEqual([self.app], started)
+
+    def test_flush_delay(self):
+        """
+        Test a buffer is sent when its oldest point waits for the delay, and all the buffers
+        are sent when the process stops
+
+        :return: None
+        """
+        other = {'_id': ObjectId()}
+        with self.app.test_request_context():
+            TimeseriesBatch.add('graphite', self.destination, ['a'], self.sender)
+            TimeseriesBatch.add('graphite', other, ['b'], self.sender)
+        TimeseriesBatch.buffers[('graphite', self.destination['_id'])]['since'] -= 2
+
+        self.assertEqual(0, TimeseriesBatch.flush(self.app, 5))
+        self.assertEqual(1, TimeseriesBatch.flush(self.app, 1))
+        self.assertEqual([('graphite', self.destination['_id'], ['a'])], self.sent)
+
+        # The points added later do not reset the age of the buffer
+        since = time.time() - 2
+        TimeseriesBatch.buffers[('graphite', other['_id'])]['since'] = since
+        with self.app.test_request_context():
+            TimeseriesBatch.add('graphite', other, ['c'], self.sender)
+        self.assertEqual(since, TimeseriesBatch.buffers[('graphite', other['_id'])]['since'])
+        self.assertEqual(2, TimeseriesBatch.flush(self.app, 1))
+        self.assertEqual(('graphite', other['_id'], ['b', 'c']), self.sent[1])
+
+        # All the buffers
+        with self.app.test_request_context():
+            TimeseriesBatch.add('graphite', other, ['d'], self.sender)
+        self.assertEqual(0, TimeseriesBatch.flush(self.app, 1))
+        self.assertEqual(1, TimeseriesBatch.flush(self.app))
+        self.assertEqual({}, TimeseriesBatch.buffers)
+
+    def test_stats(self):
+        """
+        Test the statistics of the retained (send failed) and dropped (error) perfdata, and
+        their aggregation for all the processes
+
+        :return: None
+        """
+        key = 'graphite/%s' % self.destination['_id']
+        with self.app.test_request_context():
+            TimeseriesBatch.add('graphite', self.destination, ['a', 'b', 'c'], self.sender)
+            TimeseriesBatch.add('graphite', self.destination, ['fail', 'b', 'c'], self.sender)
+            TimeseriesBatch.add('graphite', self.destination, ['error', 'b', 'c', 'd'],
+                                self.sender)
+        stats = TimeseriesBatch.stats()
+        counters = stats['destinations'][key]
+        self.assertEqual((3, 10, 4, 4), (counters['batches'], counters['points'],
+                                         counters['last_size'], counters['max_size']))
+        self.assertEqual((3, 4), (counters['retained'], counters['dropped']))
+
+        other = {'pending': {key: 2, 'influxdb/1': 1},
+                 'destinations': {key: {'batches': 1, 'points': 6, 'last_size': 6,
+                                        'max_size': 6, 'retained': 0, 'dropped': 0,
+                                        'last_latency': 5, 'max_latency': 5}}}
+        total = TimeseriesBatch.aggregate({'p1': stats, 'p2': other})
+        self.assertEqual({key: 2, 'influxdb/1': 1}, total['pending'])
+        self.assertEqual(4, total['destinations'][key]['batches'])
+        self.assertEqual(16, total['destinations'][key]['points'])
+        self.assertEqual(6, total['destinations'][key]['max_size'])
+        self.assertEqual(3, total['destinations'][key]['retained'])
+        self.assertNotIn('last_size', total['destinations'][key])
+        self.assertEqual({'p1': stats, 'p2': other}, total['processes'])
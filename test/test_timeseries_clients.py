@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test verify the clients of the timeseries databases are kept between the sends
+"""
+
+import unittest2
+from bson.objectid import ObjectId
+from alignak_backend.timeseriesclients import TimeseriesClients
+
+
+class FakeClient(object):
+    """
+    Client of a timeseries database which records if it is closed
+    """
+
+    def __init__(self, resource, destination, prefix):
+        self.resource = resource
+        self.destination = destination
+        self.prefix = prefix
+        self.closed = False
+
+    def close(self):
+        """
+        Close the client
+
+        :return: None
+        """
+        self.closed = True
+
+
+class TestTimeseriesClients(unittest2.TestCase):
+    """
+    This class test the registry of the clients of the timeseries databases
+    """
+
+    def setUp(self):
+        """
+        Create fake clients instead of connecting to the timeseries databases
+
+        :return: None
+        """
+        self.create = TimeseriesClients.create
+        TimeseriesClients.create = staticmethod(FakeClient)
+        TimeseriesClients.clients.clear()
+
+    def tearDown(self):
+        """
+        Restore the creation of the clients
+
+        :return: None
+        """
+        TimeseriesClients.create = staticmethod(self.create)
+        TimeseriesClients.clients.clear()
+
+    def test_get_etag(self):
+        """
+        Test a client is kept while its destination is not modified, and created again when
+        the _etag of its destination changes
+
+        :return: None
+        """
+        graphite = {'_id': ObjectId(), '_etag': 'a'}
+        client = TimeseriesClients.get('graphite', graphite)
+        self.assertIsInstance(client, FakeClient)
+        self.assertIs(client, TimeseriesClients.get('graphite', graphite))
+        self.assertIs(client, TimeseriesClients.get('graphite', dict(graphite)))
+
+        # Another destination or another prefix has its own client
+        influxdb = {'_id': graphite['_id'], '_etag': 'a'}
+        self.assertIsNot(client, TimeseriesClients.get('influxdb', influxdb))
+        prefixed = TimeseriesClients.get('graphite', graphite, 'alignak')
+        self.assertIsNot(client, prefixed)
+        self.assertEqual('alignak', prefixed.prefix)
+        self.assertEqual(3, len(TimeseriesClients.clients))
+
+        # The destination was modified: the former client is closed
+        graphite['_etag'] = 'b'
+        new_client = TimeseriesClients.get('graphite', graphite)
+        self.assertIsNot(client, new_client)
+        self.assertTrue(client.closed)
+        self.assertFalse(new_client.closed)
+        self.assertIs(new_client, TimeseriesClients.get('graphite', graphite))
+        self.assertFalse(prefixed.closed)
+
+    def test_reset(self):
+        """
+        Test the clients of a destination are closed and created again after a reset (send
+        error, destination updated or deleted)
+
+        :return: None
+        """
+        graphite = {'_id': ObjectId(), '_etag': 'a'}
+        other = {'_id': ObjectId(), '_etag': 'a'}
+        client = TimeseriesClients.get('graphite', graphite)
+        prefixed = TimeseriesClients.get('graphite', graphite, 'alignak')
+        other_client = TimeseriesClients.get('graphite', other)
+
+        TimeseriesClients.reset('graphite', graphite['_id'])
+        self.assertTrue(client.closed)
+        self.assertTrue(prefixed.closed)
+        self.assertFalse(other_client.closed)
+        self.assertEqual(1, len(TimeseriesClients.clients))
+
+        new_client = TimeseriesClients.get('graphite', graphite)
+        self.assertIsNot(client, new_client)
+        self.assertIs(other_client, TimeseriesClients.get('graphite', other))
+
+        # The Eve hooks reset the clients of the updated and deleted destinations
+        TimeseriesClients.on_updated_graphite({'carbon_port': 2004}, graphite)
+        self.assertTrue(new_client.closed)
+        TimeseriesClients.on_deleted_item_graphite(other)
+        self.assertTrue(other_client.closed)
+        self.assertEqual({}, TimeseriesClients.clients)
+
+        # A reset of an unknown destination does nothing
+        TimeseriesClients.reset('influxdb', graphite['_id'])
+
+    def test_close(self):
+        """
+        Test the errors when closing a client are ignored
+
+        :return: None
+        """
+        class BrokenClient(object):
+            """Client failing to close"""
+
+            def close(self):
+                """Close the client"""
+                raise IOError('closed')
+
+        TimeseriesClients.close(BrokenClient())
+        TimeseriesClients.close(object())
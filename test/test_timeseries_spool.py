@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This test verify the spool files of the perfdata not sent to the timeseries databases
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest2
+from bson.objectid import ObjectId
+from flask import Flask
+from alignak_backend.timeseriesspool import TimeseriesSpool
+
+
+class TestTimeseriesSpool(unittest2.TestCase):
+    """
+    This class test the spool files of the timeseries databases
+    """
+
+    def setUp(self):
+        """
+        Create a spool directory and an application with the spool settings
+
+        :return: None
+        """
+        self.spool = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        self.app.config['TIMESERIES_SPOOL'] = self.spool
+        self.app.config['TIMESERIES_SPOOL_SEGMENT_SIZE'] = 10485760
+        self.destination = ObjectId()
+
+    def tearDown(self):
+        """
+        Close the segments and delete the spool directory
+
+        :return: None
+        """
+        TimeseriesSpool.close_all()
+        shutil.rmtree(self.spool)
+
+    @staticmethod
+    def get_perfdata(count, name='rta'):
+        """
+        Get some perfdata
+
+        :param count: number of perfdata
+        :type count: int
+        :param name: name of the perfdata
+        :type name: str
+        :return: list of perfdata
+        :rtype: list
+        """
+        return [{'name': name, 'realm': u'All', 'host': u'srv\xe9001', 'service': '',
+                 'value': index, 'timestamp': 1500000000 + index, 'uom': 'ms'}
+                for index in range(count)]
+
+    def test_write_rotate(self):
+        """
+        Test the segments are closed when they have TIMESERIES_SPOOL_SEGMENT_SIZE bytes
+
+        :return: None
+        """
+        self.app.config['TIMESERIES_SPOOL_SEGMENT_SIZE'] = 100
+        with self.app.test_request_context():
+            directory = TimeseriesSpool.get_directory('graphite', self.destination)
+            assert TimeseriesSpool.write('graphite', self.destination, self.get_perfdata(3))
+            writer = TimeseriesSpool.writers[directory]
+            # The size of the segment is the number of bytes written
+            self.assertEqual(os.path.getsize(writer['path'] + '.open'), writer['size'])
+            self.assertEqual([], TimeseriesSpool.get_segments(directory))
+
+            assert TimeseriesSpool.write('graphite', self.destination, self.get_perfdata(1))
+            self.assertEqual(1, len(TimeseriesSpool.get_segments(directory)))
+            TimeseriesSpool.close_all()
+            self.assertEqual(2, len(TimeseriesSpool.get_segments(directory)))
+
+        self.app.config['TIMESERIES_SPOOL'] = ''
+        with self.app.test_request_context():
+            assert not TimeseriesSpool.write('graphite', self.destination, self.get_perfdata(1))
+
+    def test_replay_segment(self):
+        """
+        Test a segment is sent by batches, the offset of the sent perfdata is kept when a send
+        fails and the segment is deleted when all its perfdata are sent
+
+        :return: None
+        """
+        with self.app.test_request_context():
+            directory = TimeseriesSpool.get_directory('graphite', self.destination)
+            TimeseriesSpool.write('graphite', self.destination, self.get_perfdata(5))
+            TimeseriesSpool.close_all()
+            segment = TimeseriesSpool.get_segments(directory)[0]
+
+            sent = []
+
+            def sender(resource, destination, data):
+                """Send the first 2 batches, then fail"""
+                self.assertEqual('graphite', resource)
+                self.assertEqual(self.destination, destination['_id'])
+                if len(sent) >= 2:
+                    return False
+                sent.append(data)
+                return True
+
+            count, done = TimeseriesSpool.replay_segment(segment, 'graphite',
+                                                         {'_id': self.destination}, sender, 2)
+            self.assertEqual((4, False), (count, done))
+            self.assertEqual([0, 1, 2, 3], [perf['value'] for data in sent for perf in data])
+            self.assertEqual(u'srv\xe9001', sent[0][0]['host'])
+            assert os.path.exists(segment)
+
+            # Send again since the offset of the sent perfdata
+            del sent[:]
+            count, done = TimeseriesSpool.replay_segment(segment, 'graphite',
+                                                         {'_id': self.destination}, sender, 2)
+            self.assertEqual((1, True), (count, done))
+            self.assertEqual([4], [perf['value'] for data in sent for perf in data])
+            self.assertEqual([], os.listdir(directory))
+
+    def test_stale_segment(self):
+        """
+        Test a segment still open but not written for a long time is replayed only once, even
+        if its process writes again
+
+        :return: None
+        """
+        with self.app.test_request_context():
+            directory = TimeseriesSpool.get_directory('graphite', self.destination)
+            TimeseriesSpool.write('graphite', self.destination, self.get_perfdata(2))
+            writer = TimeseriesSpool.writers[directory]
+            old = time.time() - TimeseriesSpool.stale_age - 10
+            os.utime(writer['path'] + '.open', (old, old))
+            writer['opened'] = old
+
+            # The replay closes the stale segment
+            segments = TimeseriesSpool.get_segments(directory)
+            self.assertEqual([writer['path'] + '.spool'], segments)
+
+            # The process writes again: a new segment is opened, the stale one is not renamed
+            TimeseriesSpool.write('graphite', self.destination, self.get_perfdata(1, 'pl'))
+            self.assertNotEqual(writer, TimeseriesSpool.writers[directory])
+            TimeseriesSpool.close_all()
+
+            sent = []
+            for segment in TimeseriesSpool.get_segments(directory):
+                TimeseriesSpool.replay_segment(
+                    segment, 'graphite', {'_id': self.destination},
+                    lambda resource, destination, data: sent.extend(data) or True, 1000)
+            self.assertEqual(['rta', 'rta', 'pl'], [perf['name'] for perf in sent])
+            self.assertEqual([], os.listdir(directory))
+
+    def test_send_raises(self):
+        """
+        Test the perfdata are written in the spool when the send raises
+
+        :return: None
+        """
+        from alignak_backend.circuitbreaker import CircuitBreaker
+        from alignak_backend.timeseries import Timeseries
+
+        def send(data, destination):
+            """Send which raises"""
+            raise IOError('Connection reset by peer')
+
+        send_graphite = Timeseries.send_to_timeseries_graphite
+        Timeseries.send_to_timeseries_graphite = staticmethod(send)
+        try:
+            with self.app.test_request_context():
+                directory = TimeseriesSpool.get_directory('graphite', self.destination)
+                self.assertFalse(Timeseries.send_or_retain('graphite', {'_id': self.destination},
+                                                           self.get_perfdata(3)))
+                TimeseriesSpool.close_all()
+                sent = []
+                for segment in TimeseriesSpool.get_segments(directory):
+                    TimeseriesSpool.replay_segment(
+                        segment, 'graphite', {'_id': self.destination},
+                        lambda resource, destination, data: sent.extend(data) or True, 1000)
+                self.assertEqual([0, 1, 2], [perf['value'] for perf in sent])
+        finally:
+            Timeseries.send_to_timeseries_graphite = staticmethod(send_graphite)
+            CircuitBreaker.breakers.clear()